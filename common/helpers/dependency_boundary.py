@@ -17,16 +17,34 @@ while keeping the same hash.
 
 For some discussion on the specific design decisions here, see:
 https://github.com/rwth-i6/i6_experiments/issues/78
+
+The cache is either stored as generated Python code (cache_format="py", the default),
+or in a compact binary file (cache_format="binary") which stores the hash and the list of paths
+in a header in front of the (compressed) generated code.
+Then the hash does not need to be recomputed,
+and the code is only executed when the hash matches and all paths exist.
+
+The startup timings of every call are appended to a file next to the cache
+(see :func:`get_timings_filename` and :func:`load_timings`), to compare them across runs and cache formats.
 """
 
-from typing import Any, Optional, TypeVar, Callable
+from typing import Any, Dict, List, Optional, TypeVar, Callable
+from concurrent.futures import ThreadPoolExecutor
 from sisyphus.hash import short_hash
 from sisyphus.tools import extract_paths
 from i6_experiments.common.utils.dump_py_code import PythonCodeDumper
 from i6_experiments.common.utils.diff import collect_diffs
+from i6_experiments.common.utils.sis_hash_memo import SisHashMemo, sis_hash_memo
+import hashlib
+import io
+import json
 import os
+import pickle
 import sys
 import textwrap
+import time
+import types
+import zlib
 import importlib.util
 
 
@@ -34,7 +52,13 @@ T = TypeVar("T")
 
 
 # noinspection PyShadowingBuiltins
-def dependency_boundary(func: Callable[[], T], *, hash: Optional[str]) -> T:
+def dependency_boundary(
+    func: Callable[[], T],
+    *,
+    hash: Optional[str],
+    cache_format: str = "py",
+    num_threads: int = 16,
+) -> T:
     """
     It basically returns func(), or some object which has the same hash.
 
@@ -44,19 +68,51 @@ def dependency_boundary(func: Callable[[], T], *, hash: Optional[str]) -> T:
     :param hash: sisyphus.hash.short_hash(func()), or None if you do not know this value yet.
         This value is used to verify the hash of the object.
         For new code when the hash is not known yet, you would pass None here, and it will print the hash on stdout.
+    :param cache_format: "py" for generated Python code, "binary" for the binary cache with precomputed hash
+    :param num_threads: threads used to check the availability of the paths
     :return: func(), or object with same hash
     """
     hash_via_user = hash
     obj_via_cache = None
     hash_via_cache = None
     cached_paths_available = False
+    timings = {}  # type: Dict[str,float]
+    creation_time = None  # type: Optional[float]
 
-    cache_fn = get_cache_filename_for_func(func)
+    cache_fn = get_cache_filename_for_func(func, cache_format=cache_format)
     if os.path.exists(cache_fn):
         try:
-            obj_via_cache = load_obj_from_cache_file(cache_fn)
-            hash_via_cache = short_hash(obj_via_cache)
-            cached_paths_available = _paths_available(func, obj_via_cache)
+            if cache_format == "binary":
+                start = time.monotonic()
+                header = load_header_from_binary_cache_file(cache_fn)
+                hash_via_cache = header["hash"]
+                creation_time = header["creation_time"]
+                timings["read header"] = time.monotonic() - start
+                # Only reconstruct the object if it would be used.
+                if hash_via_user and hash_via_user == hash_via_cache:
+                    start = time.monotonic()
+                    cached_paths_available = _files_exist(
+                        func, header["paths"], num_threads=num_threads
+                    )
+                    timings[f"check {len(header['paths'])} files"] = (
+                        time.monotonic() - start
+                    )
+                    if cached_paths_available:
+                        start = time.monotonic()
+                        obj_via_cache = load_obj_from_cache_file(cache_fn)
+                        timings["reconstruct object"] = time.monotonic() - start
+            else:
+                start = time.monotonic()
+                obj_via_cache = load_obj_from_cache_file(cache_fn)
+                timings["load module"] = time.monotonic() - start
+                start = time.monotonic()
+                hash_via_cache = short_hash(obj_via_cache)
+                timings["compute hash"] = time.monotonic() - start
+                start = time.monotonic()
+                cached_paths_available = _paths_available(
+                    func, obj_via_cache, num_threads=num_threads
+                )
+                timings["check paths available"] = time.monotonic() - start
         except Exception as exc:
             print(
                 f"Dependency boundary for {func.__qualname__}:"
@@ -76,13 +132,27 @@ def dependency_boundary(func: Callable[[], T], *, hash: Optional[str]) -> T:
         print(
             f"Dependency boundary for {func.__qualname__}: using cached object with hash {hash_via_user}"
         )
+        print(
+            f"Dependency boundary for {func.__qualname__}: {_timing_report(timings, creation_time)}"
+        )
+        _record_timings(
+            cache_fn,
+            cache_format=cache_format,
+            used_cache=True,
+            timings=timings,
+            creation_time=creation_time,
+        )
         return obj_via_cache
 
     # Either user hash invalid, or cached hash invalid, or not all paths are available, or user hash not defined.
     # In any case, need to check actual function.
+    start = time.monotonic()
     obj_via_func = func()
     assert obj_via_func is not None  # unexpected
-    hash_via_func = short_hash(obj_via_func)
+    obj_via_func_memo = SisHashMemo()  # reused for the diff below
+    with sis_hash_memo(obj_via_func_memo):
+        hash_via_func = short_hash(obj_via_func)
+    timings["create original object"] = time.monotonic() - start
     print(
         f"Dependency boundary for {func.__qualname__}: hash of original object = {hash_via_func}"
     )
@@ -109,7 +179,12 @@ def dependency_boundary(func: Callable[[], T], *, hash: Optional[str]) -> T:
         print(
             f"Dependency boundary for {func.__qualname__}: create or update cache {cache_fn!r}"
         )
-        save_obj_to_cache_file(obj_via_func, cache_filename=cache_fn)
+        save_obj_to_cache_file(
+            obj_via_func,
+            cache_filename=cache_fn,
+            obj_hash=hash_via_func,
+            creation_time=timings["create original object"],
+        )
         # Do some check that the dumped object has the same hash.
         obj_via_cache = load_obj_from_cache_file(cache_fn)
         hash_via_cache = short_hash(obj_via_cache)
@@ -119,7 +194,13 @@ def dependency_boundary(func: Callable[[], T], *, hash: Optional[str]) -> T:
                 f" dumped object hash {hash_via_cache}"
             )
             print("Differences:")
-            diffs = collect_diffs("obj", obj_via_func, obj_via_cache)
+            diffs = collect_diffs(
+                "obj",
+                obj_via_func,
+                obj_via_cache,
+                only_hash_diffs=True,
+                memo=obj_via_func_memo,
+            )
             if diffs:
                 for diff in diffs:
                     print(diff)
@@ -131,36 +212,97 @@ def dependency_boundary(func: Callable[[], T], *, hash: Optional[str]) -> T:
                     f" error, user provided hash is matching to wrong cache!"
                 )
                 os.remove(cache_fn)  # make sure it is not used
+            elif cache_format == "binary":
+                # The header stores hash_via_func, and the binary cache does not rehash on load,
+                # so it would wrongly be used next time.
+                os.remove(cache_fn)
 
+    _record_timings(
+        cache_fn,
+        cache_format=cache_format,
+        used_cache=False,
+        timings=timings,
+        creation_time=timings["create original object"],
+    )
     return obj_via_func
 
 
-def get_cache_filename_for_func(func: Callable[[], T]) -> str:
+def get_cache_filename_for_func(
+    func: Callable[[], T], *, cache_format: str = "py"
+) -> str:
     """
-    :return: filename of autogenerated Python file
+    :return: filename of autogenerated Python file, or of the binary cache file
     """
+    assert cache_format in ("py", "binary"), f"invalid cache_format {cache_format!r}"
     mod = sys.modules[getattr(func, "__module__")]
     mod_dir = os.path.dirname(os.path.abspath(mod.__file__))
-    return f"{mod_dir}/_dependency_boundary_autogenerated_cache.{mod.__name__.split('.')[-1]}.{func.__qualname__}.py"
+    ext = _BINARY_CACHE_EXT if cache_format == "binary" else ".py"
+    return f"{mod_dir}/_dependency_boundary_autogenerated_cache.{mod.__name__.split('.')[-1]}.{func.__qualname__}{ext}"
+
+
+_BINARY_CACHE_EXT = ".cache"
+_TIMINGS_EXT = ".timings.jsonl"
+_BINARY_CACHE_MAGIC = b"i6-dependency-boundary-cache-v1\n"
 
 
-def save_obj_to_cache_file(obj: Any, *, cache_filename: str) -> None:
+def save_obj_to_cache_file(
+    obj: Any,
+    *,
+    cache_filename: str,
+    obj_hash: Optional[str] = None,
+    creation_time: Optional[float] = None,
+) -> None:
     """
     Save object.
+
+    :param obj:
+    :param cache_filename: binary cache if it ends with the binary cache extension, otherwise Python code
+    :param obj_hash: short_hash(obj), stored in the header of the binary cache
+    :param creation_time: seconds it took to create obj via the original function, for the timing report
     """
-    with open(cache_filename, "w") as cache_f:
-        cache_f.write(
-            textwrap.dedent(
-                """\
-                \"\"\"
-                Auto-generated code via dependency_boundary.
-                Do not modify by hand!
-                \"\"\"
-        
-                """
-            )
+    code = io.StringIO()
+    code.write(
+        textwrap.dedent(
+            """\
+            \"\"\"
+            Auto-generated code via dependency_boundary.
+            Do not modify by hand!
+            \"\"\"
+    
+            """
         )
-        PythonCodeDumper(file=cache_f, use_fake_jobs=True).dump(obj, lhs="obj")
+    )
+    PythonCodeDumper(file=code, use_fake_jobs=True).dump(obj, lhs="obj")
+
+    if not cache_filename.endswith(_BINARY_CACHE_EXT):
+        with open(cache_filename, "w") as cache_f:
+            cache_f.write(code.getvalue())
+        return
+
+    payload = zlib.compress(code.getvalue().encode("utf8"))
+    header = {
+        "hash": obj_hash if obj_hash is not None else short_hash(obj),
+        "paths": sorted({path.get_path() for path in extract_paths(obj)}),
+        "payload_sha256": hashlib.sha256(payload).hexdigest(),
+        "creation_time": creation_time,
+    }
+    tmp_filename = cache_filename + ".tmp"
+    with open(tmp_filename, "wb") as cache_f:
+        cache_f.write(_BINARY_CACHE_MAGIC)
+        pickle.dump(header, cache_f, protocol=pickle.HIGHEST_PROTOCOL)
+        pickle.dump(payload, cache_f, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(tmp_filename, cache_filename)
+
+
+def load_header_from_binary_cache_file(cache_filename: str) -> Dict[str, Any]:
+    """
+    :return: header of the binary cache, without reading the object
+    """
+    with open(cache_filename, "rb") as cache_f:
+        assert (
+            cache_f.read(len(_BINARY_CACHE_MAGIC)) == _BINARY_CACHE_MAGIC
+        ), "not a dependency boundary cache"
+        return pickle.load(cache_f)
 
 
 def load_obj_from_cache_file(cache_filename: str) -> Any:
@@ -168,6 +310,26 @@ def load_obj_from_cache_file(cache_filename: str) -> Any:
     :return: previously saved object
     """
     cache_fn_mod_name = cache_filename.lstrip("/").replace("/", ".")
+    if cache_filename.endswith(_BINARY_CACHE_EXT):
+        with open(cache_filename, "rb") as cache_f:
+            assert (
+                cache_f.read(len(_BINARY_CACHE_MAGIC)) == _BINARY_CACHE_MAGIC
+            ), "not a dependency boundary cache"
+            header = pickle.load(cache_f)
+            payload = pickle.load(cache_f)
+        assert (
+            hashlib.sha256(payload).hexdigest() == header["payload_sha256"]
+        ), "corrupted cache payload"
+        cache_fn_mod = types.ModuleType(cache_fn_mod_name)
+        cache_fn_mod.__file__ = cache_filename
+        sys.modules[cache_fn_mod_name] = cache_fn_mod
+        exec(
+            compile(zlib.decompress(payload).decode("utf8"), cache_filename, "exec"),
+            cache_fn_mod.__dict__,
+        )
+        obj = cache_fn_mod.obj
+        assert obj is not None
+        return obj
     spec = importlib.util.spec_from_file_location(cache_fn_mod_name, cache_filename)
     cache_fn_mod = importlib.util.module_from_spec(spec)
     sys.modules[cache_fn_mod_name] = cache_fn_mod
@@ -177,16 +339,101 @@ def load_obj_from_cache_file(cache_filename: str) -> Any:
     return obj
 
 
-def _paths_available(func, obj: Any) -> bool:
+def _paths_available(func, obj: Any, *, num_threads: int = 16) -> bool:
     """
     :return: True if all paths in obj are available
     """
-    paths = extract_paths(obj)
-    for path in paths:
-        if not path.available():
+    paths = list(extract_paths(obj))
+    with ThreadPoolExecutor(max_workers=num_threads) as pool:
+        available = list(pool.map(lambda path: path.available(), paths))
+    for path, path_available in zip(paths, available):
+        if not path_available:
             print(
                 f"Dependency boundary for {func.__qualname__}: path {path} in cached object not available"
             )
             # No need to print this for all paths, just the first one is enough.
             return False
     return True
+
+
+def _files_exist(func, filenames: List[str], *, num_threads: int = 16) -> bool:
+    """
+    :return: True if all files of the binary cache header exist, checked before the object is reconstructed
+    """
+    with ThreadPoolExecutor(max_workers=num_threads) as pool:
+        exist = list(pool.map(os.path.exists, filenames))
+    for filename, file_exists in zip(filenames, exist):
+        if not file_exists:
+            print(
+                f"Dependency boundary for {func.__qualname__}: file {filename} in cached object does not exist"
+            )
+            return False
+    return True
+
+
+def get_timings_filename(cache_filename: str) -> str:
+    """
+    :return: file next to the cache file, with one JSON line of startup timings per dependency_boundary call
+    """
+    return cache_filename + _TIMINGS_EXT
+
+
+def load_timings(cache_filename: str) -> List[Dict[str, Any]]:
+    """
+    :param cache_filename: see :func:`get_cache_filename_for_func`
+    :return: recorded startup timings, oldest first, see :func:`_record_timings` for the entries
+    """
+    timings_filename = get_timings_filename(cache_filename)
+    if not os.path.exists(timings_filename):
+        return []
+    with open(timings_filename, "r") as timings_f:
+        return [json.loads(line) for line in timings_f if line.strip()]
+
+
+def _record_timings(
+    cache_filename: str,
+    *,
+    cache_format: str,
+    used_cache: bool,
+    timings: Dict[str, float],
+    creation_time: Optional[float],
+) -> None:
+    """
+    Appends the startup timings of this call to the timings file next to the cache.
+
+    :param cache_filename:
+    :param cache_format: "py" or "binary"
+    :param used_cache: whether the cached object was used, otherwise the original function was called
+    :param timings: name -> seconds of the startup steps
+    :param creation_time: seconds the original function took, if known
+    """
+    entry = {
+        "time": time.time(),
+        "cache_format": cache_format,
+        "used_cache": used_cache,
+        "total": sum(timings.values()),
+        "timings": timings,
+        "creation_time": creation_time,
+    }
+    try:
+        with open(get_timings_filename(cache_filename), "a") as timings_f:
+            timings_f.write(json.dumps(entry) + "\n")
+    except OSError as exc:
+        # The timings are only informative, this should not break the setup.
+        print(f"Dependency boundary: could not record timings: {exc}")
+
+
+def _timing_report(
+    timings: Dict[str, float], creation_time: Optional[float] = None
+) -> str:
+    """
+    :param timings: name -> seconds of the startup steps
+    :param creation_time: seconds the original function took, if known
+    """
+    report = f"startup took {sum(timings.values()):.2f}s"
+    report += (
+        " (" + ", ".join(f"{name}: {secs:.2f}s" for name, secs in timings.items()) + ")"
+    )
+    if creation_time is not None:
+        report += f", creating the original object took {creation_time:.2f}s"
+    return report
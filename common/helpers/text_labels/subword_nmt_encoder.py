@@ -0,0 +1,284 @@
+"""
+In-process application of subword-nmt BPE codes
+
+Produces the same segmentation as `apply_bpe.py` of subword-nmt (without glossaries, vocabulary filter and dropout),
+but loads the codes only once and caches the segmentation of each word, so no separate interpreter
+and no temporary files are needed.
+"""
+import functools
+import gzip
+import multiprocessing
+import os
+import re
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Dict, Iterable, List, Optional, Tuple
+
+
+class SubwordNmtEncoder:
+    """
+    Applies subword-nmt BPE merge operations.
+
+    The codes are stored as a dict pair -> rank, a word is split into characters and the pair with the lowest rank
+    is merged until no pair is left in the codes, exactly like `encode` in `apply_bpe.py`.
+    """
+
+    def __init__(
+        self,
+        codes_path: str,
+        separator: str = "@@",
+        merges: int = -1,
+        cache_size: Optional[int] = 2**20,
+    ):
+        """
+        :param codes_path: subword-nmt codes file, optionally gzipped
+        :param separator: appended to every subword which is not word final
+        :param merges: only use the first n merge operations, -1 for all
+        :param cache_size: number of words to keep in the LRU cache, None for no limit
+        """
+        self.codes_path = codes_path
+        self.separator = separator
+        self.version, self.bpe_codes = self.load_codes(codes_path, merges)
+        self.encode_word = functools.lru_cache(maxsize=cache_size)(self._encode_word)
+
+    @staticmethod
+    def load_codes(
+        codes_path: str, merges: int = -1
+    ) -> Tuple[Tuple[int, ...], Dict[Tuple[str, str], int]]:
+        """
+        :return: codes version and the rank of each merge operation
+        """
+        open_func = gzip.open if codes_path.endswith(".gz") else open
+        with open_func(codes_path, "rt", encoding="utf-8") as f:
+            lines = f.read().rstrip("\n").split("\n")
+        if lines[0].startswith("#version:"):
+            version = tuple(
+                int(x) for x in re.sub(r"(\.0+)*$", "", lines[0].split()[-1]).split(".")
+            )
+            lines = lines[1:]
+        else:
+            version = (0, 1)
+        if merges != -1:
+            lines = lines[:merges]
+
+        bpe_codes = {}
+        for n, line in enumerate(lines):
+            pair = tuple(line.strip("\r\n ").split(" "))
+            assert len(pair) == 2, f"invalid line {n} in {codes_path}: {line!r}"
+            bpe_codes.setdefault(pair, n)  # only the first occurrence of a pair counts
+        return version, bpe_codes
+
+    def _encode_word(self, orig: str) -> Tuple[str, ...]:
+        if len(orig) == 1:
+            return (orig,)
+
+        if self.version == (0, 1):
+            word = list(orig) + ["</w>"]
+        else:
+            word = list(orig[:-1]) + [orig[-1] + "</w>"]
+
+        while len(word) > 1:
+            pairs = [
+                (self.bpe_codes[pair], i, pair)
+                for (i, pair) in enumerate(zip(word, word[1:]))
+                if pair in self.bpe_codes
+            ]
+            if not pairs:
+                break
+            bigram = min(pairs)[2]
+            positions = [i for (rank, i, pair) in pairs if pair == bigram]
+            merged = "".join(bigram)
+            new_word = []
+            i = 0
+            for j in positions:
+                # overlapping pairs, e.g. (x x x -> xx x)
+                if j < i:
+                    continue
+                new_word.extend(word[i:j])
+                new_word.append(merged)
+                i = j + 2
+            new_word.extend(word[i:])
+            word = new_word
+
+        if word[-1] == "</w>":
+            word = word[:-1]
+        elif word[-1].endswith("</w>"):
+            word[-1] = word[-1][:-4]
+        return tuple(word)
+
+    def segment_tokens(self, tokens: Iterable[str]) -> List[str]:
+        output = []
+        for word in tokens:
+            if not word:
+                continue
+            subwords = self.encode_word(word)
+            output.extend(subword + self.separator for subword in subwords[:-1])
+            output.append(subwords[-1])
+        return output
+
+    def segment(self, sentence: str) -> str:
+        return " ".join(self.segment_tokens(sentence.strip("\r\n ").split(" ")))
+
+    def process_line(self, line: str) -> str:
+        """
+        Segments a line and keeps its leading and trailing whitespace, like `apply_bpe.py` does.
+        """
+        out = ""
+        leading_whitespace = len(line) - len(line.lstrip("\r\n "))
+        if leading_whitespace:
+            out += line[:leading_whitespace]
+        out += self.segment(line)
+        trailing_whitespace = len(line) - len(line.rstrip("\r\n "))
+        if trailing_whitespace and trailing_whitespace != len(line):
+            out += line[-trailing_whitespace:]
+        return out
+
+
+_worker_encoder = None  # type: Optional[SubwordNmtEncoder]
+
+
+def _init_worker(codes_path: str, separator: str, merges: int):
+    global _worker_encoder
+    _worker_encoder = SubwordNmtEncoder(codes_path, separator=separator, merges=merges)
+
+
+def _process_lines(lines: List[str]) -> List[str]:
+    return [_worker_encoder.process_line(line) for line in lines]
+
+
+def apply_bpe_to_lines(
+    codes_path: str,
+    lines: Iterable[str],
+    separator: str = "@@",
+    merges: int = -1,
+    num_workers: int = 1,
+    chunk_size: int = 10000,
+) -> Iterable[str]:
+    """
+    Bulk mode for corpus-scale text, the lines are segmented in chunks by a pool of worker processes,
+    each with its own word cache. The order of the lines is kept.
+
+    :param codes_path:
+    :param lines: lines including their line endings, like read from a file
+    :param separator:
+    :param merges:
+    :param num_workers: segment in the current process if 1
+    :param chunk_size: number of lines sent to a worker at once
+    :return: generator over the segmented lines
+    """
+    if num_workers <= 1:
+        encoder = SubwordNmtEncoder(codes_path, separator=separator, merges=merges)
+        for line in lines:
+            yield encoder.process_line(line)
+        return
+
+    def chunks():
+        chunk = []
+        for line in lines:
+            chunk.append(line)
+            if len(chunk) >= chunk_size:
+                yield chunk
+                chunk = []
+        if chunk:
+            yield chunk
+
+    with multiprocessing.Pool(
+        num_workers, initializer=_init_worker, initargs=(codes_path, separator, merges)
+    ) as pool:
+        for processed in pool.imap(_process_lines, chunks()):
+            yield from processed
+
+
+def apply_bpe_to_file(
+    codes_path: str, input_path: str, output_path: str, num_workers: int = 1, **kwargs
+):
+    """
+    In-process equivalent of `apply_bpe.py --codes codes_path --input input_path --output output_path`,
+    input and output may be gzipped.
+    """
+    in_open = gzip.open if input_path.endswith(".gz") else open
+    out_open = gzip.open if output_path.endswith(".gz") else open
+    with in_open(input_path, "rt", encoding="utf-8") as f_in, out_open(
+        output_path, "wt", encoding="utf-8"
+    ) as f_out:
+        for line in apply_bpe_to_lines(
+            codes_path, f_in, num_workers=num_workers, **kwargs
+        ):
+            f_out.write(line)
+
+
+def benchmark_subword_nmt_encoder(
+    codes_path: str,
+    input_path: str,
+    subword_nmt_repo: Optional[str] = None,
+    num_workers: int = 4,
+) -> Dict[str, float]:
+    """
+    Compares the in-process encoder with calling `apply_bpe.py` of the given subword-nmt repository
+    and checks that the outputs are identical.
+
+    :param codes_path:
+    :param input_path: text file to segment
+    :param subword_nmt_repo: the subprocess path is skipped if None
+    :param num_workers: for the bulk mode
+    :return: seconds per variant
+    """
+    results = {}
+    outputs = {}
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        variants = [
+            ("in_process", 1),
+            (f"in_process_{num_workers}_workers", num_workers),
+        ]
+        for name, workers in variants:
+            output_path = os.path.join(tmp_dir, name)
+            start = time.monotonic()
+            apply_bpe_to_file(codes_path, input_path, output_path, num_workers=workers)
+            results[name] = time.monotonic() - start
+            outputs[name] = output_path
+
+        if subword_nmt_repo is not None:
+            output_path = os.path.join(tmp_dir, "subprocess")
+            args = [
+                sys.executable,
+                os.path.join(subword_nmt_repo, "apply_bpe.py"),
+                "--input",
+                input_path,
+                "--codes",
+                codes_path,
+                "--output",
+                output_path,
+            ]
+            start = time.monotonic()
+            subprocess.run(args, check=True)
+            results["subprocess"] = time.monotonic() - start
+            outputs["subprocess"] = output_path
+
+        reference = None
+        for name, output_path in outputs.items():
+            with open(output_path, "rt", encoding="utf-8") as f:
+                content = f.read()
+            if reference is None:
+                reference = content
+            assert content == reference, f"output of {name} differs"
+    return results
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(
+        description="benchmark the in-process BPE encoder against apply_bpe.py"
+    )
+    parser.add_argument("codes")
+    parser.add_argument("input")
+    parser.add_argument("--subword_nmt_repo", default=None)
+    parser.add_argument("--num_workers", type=int, default=4)
+    args = parser.parse_args()
+    print(
+        benchmark_subword_nmt_encoder(
+            args.codes, args.input, args.subword_nmt_repo, args.num_workers
+        )
+    )
@@ -6,7 +6,7 @@ Diff utils
 import sisyphus
 from sisyphus import gs, tk
 
-from typing import List
+from typing import Any, Callable, Dict, List, Optional
 
 import i6_core.rasr as rasr
 import i6_core.util
@@ -14,17 +14,41 @@ from sisyphus.hash import sis_hash_helper
 
 import i6_experiments.common.setups.rasr.util as rasr_util
 from .py_repr import py_repr
+from .sis_hash_memo import SisHashMemo, sis_hash_memo
 
 
 _limit = 3
 
 
-def collect_diffs(prefix: str, orig, new) -> List[str]:
+def collect_diffs(
+    prefix: str,
+    orig,
+    new,
+    *,
+    only_hash_diffs: bool = False,
+    memo: Optional[SisHashMemo] = None,
+) -> List[str]:
     """
+    :param prefix:
+    :param orig:
+    :param new:
+    :param only_hash_diffs: only descend into sub-objects where the sis_hash differs.
+        Much faster for large objects, but differences which do not influence the hash are not reported.
+    :param memo: share the hashes with other hash computations of the same objects
     :return: list of diff descriptions. empty if no diffs
     """
+    with sis_hash_memo(memo) as memo:
+        return _collect_diffs(prefix, orig, new, hash_func=memo, prune=only_hash_diffs)
+
+
+def _collect_diffs(
+    prefix: str, orig, new, *, hash_func: Callable[[Any], bytes], prune: bool
+) -> List[str]:
     if orig is None and new is None:
         return []
+    if prune and hash_func(orig) == hash_func(new):
+        return []
+    kwargs = dict(hash_func=hash_func, prune=prune)
     if isinstance(orig, i6_core.util.MultiPath) and isinstance(
         new, i6_core.util.MultiPath
     ):
@@ -34,18 +58,22 @@ def collect_diffs(prefix: str, orig, new) -> List[str]:
         if orig._sis_id() != new._sis_id():
             # noinspection PyProtectedMember
             return [f"{prefix} Job diff sis_id {orig._sis_id()} != {new._sis_id()}"]
-        return _sis_hash_diff(prefix, orig, new)
+        return _sis_hash_diff(prefix, orig, new, hash_func=hash_func)
     elif type(orig) != type(new):
         return [f"{prefix} diff type: {py_repr(orig)} != {py_repr(new)}"]
     if isinstance(orig, dict):
-        diffs = collect_diffs(f"{prefix}:keys", set(orig.keys()), set(new.keys()))
+        diffs = _collect_diffs(
+            f"{prefix}:keys", set(orig.keys()), set(new.keys()), **kwargs
+        )
         if diffs:
             return diffs
         num_int_key_diffs = 0
         keys = list(orig.keys())
         for i in range(len(keys)):
             key = keys[i]
-            sub_diffs = collect_diffs(f"{prefix}[{key!r}]", orig[key], new[key])
+            sub_diffs = _collect_diffs(
+                f"{prefix}[{key!r}]", orig[key], new[key], **kwargs
+            )
             diffs += sub_diffs
             if isinstance(key, int) and sub_diffs:
                 num_int_key_diffs += 1
@@ -97,7 +125,7 @@ def collect_diffs(prefix: str, orig, new) -> List[str]:
         diffs = []
         num_diffs = 0
         for i in range(len(orig)):
-            sub_diffs = collect_diffs(f"{prefix}[{i}]", orig[i], new[i])
+            sub_diffs = _collect_diffs(f"{prefix}[{i}]", orig[i], new[i], **kwargs)
             diffs += sub_diffs
             if sub_diffs:
                 num_diffs += 1
@@ -108,32 +136,34 @@ def collect_diffs(prefix: str, orig, new) -> List[str]:
     if isinstance(orig, (int, float, str)):
         if orig != new:
             return [f"{prefix} diff: {py_repr(orig)} != {py_repr(new)}"]
-        return _sis_hash_diff(prefix, orig, new)
+        return _sis_hash_diff(prefix, orig, new, hash_func=hash_func)
     if isinstance(orig, tk.AbstractPath):
-        diffs = collect_diffs(f"{prefix}:path-state", _PathState(orig), _PathState(new))
+        diffs = _collect_diffs(
+            f"{prefix}:path-state", _PathState(orig), _PathState(new), **kwargs
+        )
         if not diffs:
-            return _sis_hash_diff(prefix, orig, new)
+            return _sis_hash_diff(prefix, orig, new, hash_func=hash_func)
         return diffs
     if isinstance(orig, i6_core.util.MultiPath):
         # only hidden_paths relevant (?)
-        diffs = collect_diffs(
-            f"{prefix}.hidden_paths", orig.hidden_paths, new.hidden_paths
+        diffs = _collect_diffs(
+            f"{prefix}.hidden_paths", orig.hidden_paths, new.hidden_paths, **kwargs
         )
         if not diffs:
-            return _sis_hash_diff(prefix, orig, new)
+            return _sis_hash_diff(prefix, orig, new, hash_func=hash_func)
         return diffs
     if isinstance(orig, _expected_obj_types):
         orig_attribs = set(vars(orig).keys())
         new_attribs = set(vars(new).keys())
-        diffs = collect_diffs(f"{prefix}:attribs", orig_attribs, new_attribs)
+        diffs = _collect_diffs(f"{prefix}:attribs", orig_attribs, new_attribs, **kwargs)
         if diffs:
             return diffs
         for key in vars(orig).keys():
-            diffs += collect_diffs(
-                f"{prefix}.{key}", getattr(orig, key), getattr(new, key)
+            diffs += _collect_diffs(
+                f"{prefix}.{key}", getattr(orig, key), getattr(new, key), **kwargs
             )
         if not diffs:
-            return _sis_hash_diff(prefix, orig, new)
+            return _sis_hash_diff(prefix, orig, new, hash_func=hash_func)
         return diffs
     raise TypeError(f"unexpected type {type(orig)}")
 
@@ -179,9 +209,34 @@ _expected_obj_types = (
 )
 
 
-def _sis_hash_diff(prefix, a, b) -> List[str]:
-    h1 = sis_hash_helper(a)
-    h2 = sis_hash_helper(b)
+def _sis_hash_diff(
+    prefix, a, b, *, hash_func: Callable[[Any], bytes] = sis_hash_helper
+) -> List[str]:
+    h1 = hash_func(a)
+    h2 = hash_func(b)
     if h1 == h2:
         return []
     return [f"{prefix} diff hash: {py_repr(a)} != {py_repr(b)}"]
+
+
+def benchmark_collect_diffs(orig, new) -> Dict[str, float]:
+    """
+    Compares :func:`collect_diffs` with the previous non-memoized hashing,
+    e.g. for the outputs of a full GmmSystem and a modified deepcopy of them.
+
+    :return: seconds per variant
+    """
+    import time
+
+    results = {}
+    start = time.monotonic()
+    reference = _collect_diffs("obj", orig, new, hash_func=sis_hash_helper, prune=False)
+    results["not_memoized"] = time.monotonic() - start
+    start = time.monotonic()
+    diffs = collect_diffs("obj", orig, new)
+    results["memoized"] = time.monotonic() - start
+    assert diffs == reference
+    start = time.monotonic()
+    collect_diffs("obj", orig, new, only_hash_diffs=True)
+    results["only_hash_diffs"] = time.monotonic() - start
+    return results
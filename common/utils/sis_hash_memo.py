@@ -0,0 +1,73 @@
+"""
+Memoized sis_hash_helper for one dump/diff session.
+
+sis_hash_helper recurses through the whole object for every call,
+so hashing every sub-object of a large CRP/RasrConfig tree is quadratic.
+With the memo, every object is hashed only once.
+"""
+
+import contextlib
+from typing import Any, Dict, Optional, Set, Tuple
+
+import sisyphus.hash
+
+
+_orig_sis_hash_helper = sisyphus.hash.sis_hash_helper
+_primitive_types = (type(None), bool, int, float, str, bytes)
+
+
+class SisHashMemo:
+    """
+    Callable with the same result as sis_hash_helper, memoized by id(obj).
+    The objects are kept alive so that the ids stay unique.
+    Objects must not be modified while the memo is in use.
+    """
+
+    def __init__(self):
+        self._memo = {}  # type: Dict[int, Tuple[Any, bytes]]
+        self._in_progress = set()  # type: Set[int]
+        self.hits = 0
+        self.misses = 0
+
+    def __call__(self, obj: Any) -> bytes:
+        if isinstance(obj, _primitive_types):
+            return _orig_sis_hash_helper(obj)
+        key = id(obj)
+        entry = self._memo.get(key)
+        if entry is not None:
+            self.hits += 1
+            return entry[1]
+        if key in self._in_progress:
+            raise ValueError(
+                f"cyclic reference, cannot compute sis_hash of {type(obj).__qualname__} object"
+            )
+        self._in_progress.add(key)
+        try:
+            h = _orig_sis_hash_helper(obj)
+        finally:
+            self._in_progress.remove(key)
+        self.misses += 1
+        self._memo[key] = (obj, h)
+        return h
+
+
+@contextlib.contextmanager
+def sis_hash_memo(memo: Optional[SisHashMemo] = None):
+    """
+    Installs the memo as sisyphus.hash.sis_hash_helper, such that the recursion inside of sis_hash_helper,
+    and also short_hash, use the memo. Reuses the active memo when nested.
+    Not thread-safe, the Sisyphus hash functions are patched globally.
+
+    :param memo: shared memo, a new one if not given
+    :return: context manager yielding the memo
+    """
+    prev = sisyphus.hash.sis_hash_helper
+    if isinstance(prev, SisHashMemo) and (memo is None or memo is prev):
+        yield prev
+        return
+    memo = memo or SisHashMemo()
+    sisyphus.hash.sis_hash_helper = memo
+    try:
+        yield memo
+    finally:
+        sisyphus.hash.sis_hash_helper = prev
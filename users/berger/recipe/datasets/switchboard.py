@@ -1,57 +1,59 @@
-import copy
+from typing import Union
 
 from sisyphus import *
 
-from i6_core.lib.lexicon import Lexicon, Lemma
-from i6_core.util import write_xml
+from i6_core.lib.lexicon import Lexicon
 
+from i6_experiments.users.berger.recipe.lexicon.index import LexiconIndex
 
-def add_alt_orth_to_lexicon(alt_orth: str, base_orth: str, lexicon: Lexicon):
-    """
-    Add alternative orthography to all lemmas that contain the base_orth
-    """
-    for lemma in lexicon.lemmata:
-        if base_orth in lemma.orth and alt_orth not in lemma.orth:
-            lemma.orth.append(alt_orth)
-        lemma.orth.sort(key=str.swapcase)
+
+def _as_index(lexicon: Union[Lexicon, LexiconIndex]) -> LexiconIndex:
+    return lexicon if isinstance(lexicon, LexiconIndex) else LexiconIndex(lexicon)
 
 
-def combine_lemmata(lemma_1: Lemma, lemma_2: Lemma):
-    result = copy.deepcopy(lemma_1)
-    result.orth = list(set(result.orth + lemma_2.orth))
-    result.orth.sort(key=str.swapcase)
-    result.phon = list(set(result.phon + lemma_2.phon))
-    result.eval = list(set(result.eval + lemma_2.eval))
-    return result
+def add_alt_orth_to_lexicon(alt_orth: str, base_orth: str, lexicon: Union[Lexicon, LexiconIndex]):
+    """
+    Add alternative orthography to all lemmas that contain the base_orth.
+    When called with a LexiconIndex, the orths are sorted in LexiconIndex.finalize instead of every call.
+    """
+    if isinstance(lexicon, LexiconIndex):
+        lexicon.add_alt_orth(alt_orth, base_orth)
+        return
+    index = LexiconIndex(lexicon)
+    index.add_alt_orth(alt_orth, base_orth)
+    index.finalize(orth_sort_key=str.swapcase)
 
 
-def add_lowercase_orths_to_lexicon(lexicon: Lexicon):
+def add_lowercase_orths_to_lexicon(lexicon: Union[Lexicon, LexiconIndex]):
     """
     Add lower-case versions of all orthographies to the lexicon.
     This may introduce overlap, so merge capitalized and lowercase versions
     of the same lemma into one.
+    Lemmata are merged in place via the index instead of copying, keeping the order of the pronunciations.
     """
+    index = _as_index(lexicon)
     base_lemma_list = []
     lemma_dict = {}
-    for lemma in lexicon.lemmata:
+    for lemma in index.lemmata:
         if not lemma.orth or lemma.orth[0].startswith("["):
             base_lemma_list.append(lemma)
             continue
         key_orth = lemma.orth[
             0
         ].lower()  # Lemmas will be merged if their key_orth is equal
-        lowercase_orth = [orth.lower() for orth in lemma.orth]
-        lemma.orth = list(set(lemma.orth + lowercase_orth))
-        lemma.orth.sort(key=str.swapcase)
+        for orth in list(lemma.orth):
+            index.add_orth(lemma, orth.lower())
 
         if key_orth in lemma_dict:
-            lemma_dict[key_orth] = combine_lemmata(lemma_dict[key_orth], lemma)
+            index.merge_lemmata(lemma_dict[key_orth], lemma)
         else:
             lemma_dict[key_orth] = lemma
 
-    lexicon.lemmata = base_lemma_list + [
+    index.lexicon.lemmata = base_lemma_list + [
         lemma_dict[key] for key in sorted(lemma_dict.keys())
     ]
+    if not isinstance(lexicon, LexiconIndex):
+        index.finalize(orth_sort_key=str.swapcase)
 
 
 class PreprocessSwitchboardLexiconJob(Job):
@@ -73,7 +75,9 @@ class PreprocessSwitchboardLexiconJob(Job):
         lexicon_object = Lexicon()
         lexicon_object.load(self.base_lexicon)
 
-        add_lowercase_orths_to_lexicon(lexicon_object)
+        # all edits go through one index, the lexicon is sorted and written once at the end
+        index = LexiconIndex(lexicon_object)
+        add_lowercase_orths_to_lexicon(index)
 
         for alt_orth, base_orth in [
             ("Act", "act"),
@@ -103,6 +107,6 @@ class PreprocessSwitchboardLexiconJob(Job):
             ("Thirtysomething", "thirtysomething"),
             ("Wasp", "wasp"),
         ]:
-            add_alt_orth_to_lexicon(alt_orth, base_orth, lexicon_object)
+            add_alt_orth_to_lexicon(alt_orth, base_orth, index)
 
-        write_xml(self.out_lexicon.get_path(), lexicon_object.to_xml())
+        index.write(self.out_lexicon.get_path(), orth_sort_key=str.swapcase)
@@ -1,8 +1,6 @@
 __all__ = ["CreateBPELexiconJob"]
 
-import subprocess as sp
-import os
-import sys
+import ast
 import xml.etree.ElementTree as ET
 
 from sisyphus import *
@@ -12,6 +10,8 @@ Path = setup_path(__package__)
 from i6_core.lib.lexicon import Lexicon, Lemma
 import i6_core.util as util
 
+from i6_experiments.common.helpers.text_labels.subword_nmt_encoder import SubwordNmtEncoder
+
 
 class CreateBPELexiconJob(Job):
     """
@@ -30,7 +30,8 @@ class CreateBPELexiconJob(Job):
         :param Path base_lexicon_path:
         :param Path bpe_codes:
         :param Path|None bpe_vocab:
-        :param Path|str|None subword_nmt_repo:
+        :param Path|str|None subword_nmt_repo: not used anymore, the codes are applied in-process
+            with the same segmentation as apply_bpe.py
         """
         self.base_lexicon_path = base_lexicon_path
         self.bpe_codes = bpe_codes
@@ -61,44 +62,21 @@ class CreateBPELexiconJob(Job):
                 for t in eval:
                     lm_tokens.add(t)
 
-        lm_tokens = list(lm_tokens)
-
-        with util.uopen("words", "wt") as f:
-            for t in lm_tokens:
-                f.write(f"{t}\n")
-
-        apply_binary = os.path.join(
-            tk.uncached_path(self.subword_nmt_repo), "apply_bpe.py"
-        )
-        args = [
-            sys.executable,
-            apply_binary,
-            "--input",
-            "words",
-            "--codes",
-            self.bpe_codes.get_path(),
-            "--output",
-            "bpes",
-        ]
-        sp.run(args, check=True)
-
-        with util.uopen("bpes", "rt") as f:
-            bpe_tokens = [l.strip() for l in f]
-
-        w2b = {w: b for w, b in zip(lm_tokens, bpe_tokens)}
+        encoder = SubwordNmtEncoder(self.bpe_codes.get_path())
+        w2b = {t: encoder.process_line(f"{t}\n").strip() for t in lm_tokens}
 
         vocab = set()
         lexicon.add_phoneme("</s>", variation="none")
         lexicon.add_phoneme(self.unk_label, variation="none")
         with util.uopen(self.bpe_vocab.get_path(), "rt") as f:
-            for line in f:
-                if "{" in line or "<s>" in line or "</s>" in line or "}" in line:
-                    continue
-                symbol = line.split(":")[0][1:-1]
-                if symbol != self.unk_label:
-                    symbol = symbol.replace(".", "_")
-                    vocab.add(symbol)
-                    lexicon.add_phoneme(symbol.replace(".", "_"))
+            bpe_vocab = ast.literal_eval(f.read())
+        for symbol in bpe_vocab:
+            if any(s in symbol for s in ["{", "}", "<s>", "</s>"]):
+                continue
+            if symbol != self.unk_label:
+                symbol = symbol.replace(".", "_")
+                vocab.add(symbol)
+                lexicon.add_phoneme(symbol)
         lexicon.add_phoneme("[SILENCE]", variation="none")
 
         lexicon.add_lemma(
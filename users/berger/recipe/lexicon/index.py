@@ -0,0 +1,118 @@
+from collections import defaultdict
+from typing import Callable, Dict, Iterable, List, Optional
+
+from i6_core.lib.lexicon import Lexicon, Lemma
+from i6_core.util import write_xml
+
+
+class LexiconIndex:
+    """
+    Indexed view on a :class:`Lexicon` with orth -> lemmata and phon -> lemmata hash maps.
+
+    Edits done via the index update the maps incrementally, so batches of edits don't need
+    to scan all lemmata. Removals and orth sorting are deferred until :func:`finalize`,
+    which should be called once before serializing the lexicon.
+    """
+
+    def __init__(self, lexicon: Lexicon):
+        self.lexicon = lexicon
+        self.orth_to_lemmata: Dict[str, List[Lemma]] = defaultdict(list)
+        self.phon_to_lemmata: Dict[str, List[Lemma]] = defaultdict(list)
+        self._removed = {}  # id -> merged lemma, keeps the object alive so the id is not reused
+        for lemma in lexicon.lemmata:
+            self._index(lemma)
+
+    def _index(self, lemma: Lemma):
+        for orth in lemma.orth:
+            self.orth_to_lemmata[orth].append(lemma)
+        for phon in lemma.phon:
+            self.phon_to_lemmata[phon].append(lemma)
+
+    def _unindex(self, lemma: Lemma):
+        for orth in lemma.orth:
+            self.orth_to_lemmata[orth] = [l for l in self.orth_to_lemmata[orth] if l is not lemma]
+        for phon in lemma.phon:
+            self.phon_to_lemmata[phon] = [l for l in self.phon_to_lemmata[phon] if l is not lemma]
+
+    def lemmata_for_orth(self, orth: str) -> List[Lemma]:
+        return list(self.orth_to_lemmata.get(orth, []))
+
+    def lemmata_for_phon(self, phon: str) -> List[Lemma]:
+        return list(self.phon_to_lemmata.get(phon, []))
+
+    def add_orth(self, lemma: Lemma, orth: str):
+        if orth not in lemma.orth:
+            lemma.orth.append(orth)
+            self.orth_to_lemmata[orth].append(lemma)
+
+    def add_phon(self, lemma: Lemma, phon: str):
+        if phon not in lemma.phon:
+            lemma.phon.append(phon)
+            self.phon_to_lemmata[phon].append(lemma)
+
+    def add_alt_orth(self, alt_orth: str, base_orth: str):
+        """
+        Add alternative orthography to all lemmas that contain the base_orth
+        """
+        for lemma in self.lemmata_for_orth(base_orth):
+            self.add_orth(lemma, alt_orth)
+
+    def merge_lemmata(self, target: Lemma, source: Lemma):
+        """
+        Merges orths, pronunciations and evals of source into target (keeping their order)
+        and removes source from the lexicon.
+        """
+        assert target is not source
+        for orth in source.orth:
+            self.add_orth(target, orth)
+        for phon in source.phon:
+            self.add_phon(target, phon)
+        for ev in source.eval:
+            if ev not in target.eval:
+                target.eval.append(ev)
+        self._unindex(source)
+        self._removed[id(source)] = source
+
+    def map_pronunciations(self, transform: Callable[[str], str], lemmata: Optional[Iterable[Lemma]] = None):
+        """
+        Applies transform to the pronunciations of the given (default: all) lemmata,
+        pronunciations which become identical are merged.
+        """
+        if lemmata is None:
+            lemmata = self.lemmata
+            self.phon_to_lemmata = defaultdict(list)
+            reindex_all = True
+        else:
+            reindex_all = False
+        for lemma in lemmata:
+            if not reindex_all:
+                for phon in lemma.phon:
+                    self.phon_to_lemmata[phon] = [l for l in self.phon_to_lemmata[phon] if l is not lemma]
+            phons = []
+            for phon in lemma.phon:
+                phon = transform(phon)
+                if phon not in phons:
+                    phons.append(phon)
+            lemma.phon = phons
+            for phon in phons:
+                self.phon_to_lemmata[phon].append(lemma)
+
+    @property
+    def lemmata(self) -> List[Lemma]:
+        return [lemma for lemma in self.lexicon.lemmata if id(lemma) not in self._removed]
+
+    def finalize(self, orth_sort_key: Optional[Callable[[str], object]] = None) -> Lexicon:
+        """
+        Applies the deferred removals and optionally sorts the orths of every lemma once.
+
+        :return: the underlying lexicon
+        """
+        self.lexicon.lemmata = self.lemmata
+        self._removed = {}
+        if orth_sort_key is not None:
+            for lemma in self.lexicon.lemmata:
+                lemma.orth.sort(key=orth_sort_key)
+        return self.lexicon
+
+    def write(self, path: str, orth_sort_key: Optional[Callable[[str], object]] = None):
+        write_xml(path, self.finalize(orth_sort_key).to_xml())
@@ -3,6 +3,8 @@ from sisyphus import Job, Task, tk
 from i6_core.lib.lexicon import Lexicon, Lemma
 from i6_core.util import write_xml
 
+from i6_experiments.users.berger.recipe.lexicon.index import LexiconIndex
+
 
 class AddBoundaryMarkerToLexiconJob(Job):
     def __init__(self, bliss_lexicon, add_eow=False, add_sow=False):
@@ -43,11 +45,10 @@ class AddBoundaryMarkerToLexiconJob(Job):
             if not (phoneme.startswith("[") or phoneme.endswith("]")):
                 out_lexicon.add_phoneme(phoneme + "#", variation)
 
-        for lemma in in_lexicon.lemmata:
-            lemma.phon = map(self.modify_phon, lemma.phon)
-            out_lexicon.add_lemma(lemma)
-
-        write_xml(self.out_lexicon.get_path(), out_lexicon.to_xml())
+        out_lexicon.lemmata = in_lexicon.lemmata
+        index = LexiconIndex(out_lexicon)
+        index.map_pronunciations(self.modify_phon)
+        index.write(self.out_lexicon.get_path())
 
 
 class DeleteEmptyOrthJob(Job):
@@ -0,0 +1,203 @@
+"""
+Incremental parsing of the metrics in the ``hydra_train.log`` files of fairseq-hydra-train.
+
+The relevant lines look like::
+
+    [...][fairseq_cli.train][INFO] - end of epoch 1 (average epoch stats below)
+    [...][train][INFO] - {"epoch": 1, "train_loss": "3.512", "train_accuracy": "0.42", "train_lr": "5e-05", ...}
+    [...][fairseq_cli.train][INFO] - begin validation on "valid" subset
+    [...][valid][INFO] - {"epoch": 1, "valid_loss": "3.201", "valid_accuracy": "0.47", ...}
+
+The parser state (byte offset per log file and the metrics found so far) is stored in a JSON file,
+such that a new call only reads what was appended to the logs since the last call.
+"""
+
+import json
+import os
+import re
+
+# kind -> (marker in the line before the stats, stats keys), keys as in FairseqHydraTrainingJob.plot
+_MARKERS = {
+    "valid": ('begin validation on "valid" subset', ("valid_loss", "valid_accuracy")),
+    "train": ("end of epoch", ("train_loss", "train_accuracy", "train_lr")),
+}
+_STATE_VERSION = 1
+
+
+def _parse_stats_line(line, keys):
+    """
+    :param str line: log line following a marker
+    :param tuple[str] keys: which must be in the stats
+    :return: epoch and values of the keys, or None if not all of them are in the line
+    :rtype: (int, list[float])|None
+    """
+    start = line.find("{")
+    stats = None
+    if start >= 0:
+        try:
+            stats = json.loads(line[start:])
+        except ValueError:
+            pass
+    if not isinstance(stats, dict):
+        # not JSON (e.g. cut off), fall back to plain tokenization
+        split = re.sub('[{,":]', "", line).split()
+        stats = {split[i]: split[i + 1] for i in range(len(split) - 1)}
+    try:
+        return int(stats["epoch"]), [float(stats[key]) for key in keys]
+    except (KeyError, ValueError, TypeError):
+        return None
+
+
+class HydraTrainLogParser:
+    """
+    Keeps the read position of every log file, and reads only complete lines appended since the last call.
+    """
+
+    def __init__(self, state_file=None):
+        """
+        :param str|None state_file: JSON file to keep the state between calls, created if it does not exist
+        """
+        self.state_file = state_file
+        self.files = {}  # path -> file state dict
+        if state_file and os.path.exists(state_file):
+            with open(state_file, "r") as f:
+                state = json.load(f)
+            if state.get("version") == _STATE_VERSION:
+                self.files = state["files"]
+
+    @staticmethod
+    def _new_file_state(inode):
+        return {"inode": inode, "offset": 0, "pending": None, "train": {}, "valid": {}}
+
+    def update_file(self, path):
+        """
+        :param str path: hydra_train.log
+        :return: whether anything new was parsed
+        :rtype: bool
+        """
+        st = os.stat(path)
+        state = self.files.get(path)
+        if state is None or state["inode"] != st.st_ino or st.st_size < state["offset"]:
+            state = self.files[path] = self._new_file_state(st.st_ino)  # new or rewritten file
+        if st.st_size == state["offset"]:
+            return False
+        with open(path, "rb") as f:
+            f.seek(state["offset"])
+            data = f.read()
+        end = data.rfind(b"\n") + 1  # only complete lines, the rest is read again next time
+        if end == 0:
+            return False
+        state["offset"] += end
+        for line in data[:end].decode("utf8", errors="replace").splitlines():
+            kind = state["pending"]
+            if kind is not None:
+                result = _parse_stats_line(line, _MARKERS[kind][1])
+                if result is not None:
+                    epoch, values = result
+                    state[kind][str(epoch)] = values
+            state["pending"] = None
+            for kind, (marker, _) in _MARKERS.items():
+                if marker in line:
+                    state["pending"] = kind
+                    break
+        return True
+
+    def update(self, directory):
+        """
+        Parses all ``hydra_train.log`` files below the directory (e.g. the hydra ``outputs`` dir).
+
+        :param str directory:
+        :return: whether anything new was parsed
+        :rtype: bool
+        """
+        changed = False
+        for dir_path, _, files in os.walk(directory):
+            if "hydra_train.log" in files:
+                changed |= self.update_file(os.path.join(dir_path, "hydra_train.log"))
+        if changed and self.state_file:
+            tmp_file = self.state_file + ".tmp"
+            with open(tmp_file, "w") as f:
+                json.dump({"version": _STATE_VERSION, "files": self.files}, f)
+            os.replace(tmp_file, self.state_file)
+        return changed
+
+    def get_table(self):
+        """
+        :return: metrics of all log files, later runs (sorted by path, i.e. by hydra's date/time dirs)
+            overwrite the epochs of earlier runs
+        :rtype: EpochMetricsTable
+        """
+        table = EpochMetricsTable()
+        for path in sorted(self.files):
+            state = self.files[path]
+            for epoch, (loss, accuracy) in state["valid"].items():
+                table.set(int(epoch), valid_score=loss, valid_error=1 - accuracy)
+            for epoch, (loss, accuracy, lr) in state["train"].items():
+                table.set(int(epoch), train_score=loss, train_error=1 - accuracy, learning_rate=lr)
+        return table
+
+
+class EpochMetricsTable:
+    """
+    Per-epoch metrics: train/valid score (loss), train/valid error (1 - accuracy) and learning rate.
+    """
+
+    columns = ("train_score", "train_error", "valid_score", "valid_error", "learning_rate")
+
+    def __init__(self, epochs=None):
+        """
+        :param dict[int,dict[str,float]]|None epochs:
+        """
+        self.epochs = epochs or {}
+
+    def set(self, epoch, **values):
+        self.epochs.setdefault(epoch, {}).update(values)
+
+    def get(self, column):
+        """
+        :param str column: one of :attr:`columns`
+        :return: epochs (sorted) and the values, for all epochs which have this column
+        :rtype: (list[int], list[float])
+        """
+        epochs = sorted(epoch for epoch, values in self.epochs.items() if column in values)
+        return epochs, [self.epochs[epoch][column] for epoch in epochs]
+
+    def get_best_epochs(self, column="valid_score", n=1, epochs=None):
+        """
+        :param str column:
+        :param int n:
+        :param collections.abc.Container[int]|None epochs: only consider these, e.g. the kept checkpoints
+        :return: the n epochs with the lowest value
+        :rtype: list[int]
+        """
+        candidates = [
+            (values[column], epoch)
+            for epoch, values in self.epochs.items()
+            if column in values and (epochs is None or epoch in epochs)
+        ]
+        return [epoch for _, epoch in sorted(candidates)[:n]]
+
+    def write(self, filename):
+        """
+        Writes the table as JSON, one line per epoch.
+
+        :param str filename:
+        """
+        with open(filename, "w") as f:
+            f.write("{\n")
+            f.write(
+                ",\n".join(
+                    "%s: %s" % (json.dumps(str(epoch)), json.dumps(self.epochs[epoch], sort_keys=True))
+                    for epoch in sorted(self.epochs)
+                )
+            )
+            f.write("\n}\n")
+
+    @classmethod
+    def read(cls, filename):
+        """
+        :param str filename: written by :func:`write`
+        :rtype: EpochMetricsTable
+        """
+        with open(filename, "r") as f:
+            return cls({int(epoch): values for epoch, values in json.load(f).items()})
@@ -4,12 +4,13 @@ import subprocess as sp
 import yaml
 import sys
 import copy
-import re
 
 from sisyphus import *
 
 import recipe.i6_core.util as util
 
+from .hydra_log import HydraTrainLogParser, EpochMetricsTable
+
 
 class FairseqHydraConfig:
     """
@@ -176,6 +177,7 @@ class FairseqHydraTrainingJob(Job):
         )
         self.out_plot_se = self.output_path("score_and_error.png")
         self.out_plot_lr = self.output_path("learning_rate.png")
+        self.out_epoch_metrics = self.output_path("epoch_metrics.json")
 
         # Requirements:
         self.gpu_rqmt = gpu_rqmt
@@ -282,74 +284,41 @@ class FairseqHydraTrainingJob(Job):
             my_env["PYTHONPATH"] = self.fairseq_root
         sp.check_call(self._get_run_cmd(), env=my_env)
 
+    def get_epoch_metrics(self):
+        """
+        Parses the new parts of the hydra_train.log files (see :class:`HydraTrainLogParser`).
+        Can also be called while the training is running, e.g. for epoch selection.
+
+        :rtype: EpochMetricsTable
+        """
+        work_dir = self._sis_path(gs.JOB_WORK_DIR)
+        parser = HydraTrainLogParser(state_file=os.path.join(work_dir, "hydra_train_log_state.json"))
+        parser.update(os.path.join(work_dir, "outputs"))
+        return parser.get_table()
+
     def plot(self):
-        directory = "./outputs"
-        train_score, train_error = {}, {}
-        valid_score, valid_error = {}, {}
-        learning_rates = {}
-
-        for cur in os.walk(directory):
-            dir_path = cur[0]
-            files = cur[2]
-            if "hydra_train.log" in files:
-                with open(f"{dir_path}/hydra_train.log", "r") as f:
-                    lines = f.readlines()
-                    for i in range(len(lines) - 1):
-                        line = lines[i]
-                        if 'begin validation on "valid" subset' in line:
-                            split = re.sub('[{,":]', "", lines[i + 1]).split(" ")
-                            #  Exception handling for cases in which accuracy and loss 
-                            #  are not logged in next line
-                            try:
-                                epoch = int(split[split.index("epoch") + 1])
-                                score = float(split[split.index("valid_loss") + 1])
-                                error = 1 - float(
-                                    split[split.index("valid_accuracy") + 1]
-                                )
-                            except ValueError:
-                                continue
-                            valid_score[epoch] = score
-                            valid_error[epoch] = error
-                            i += 1
-                        elif "end of epoch" in line:
-                            split = re.sub('[{,":]', "", lines[i + 1]).split(" ")
-                            #  Exception handling for cases in which accuracy, loss and
-                            #  learningrate are not logged in next line
-                            try:
-                                epoch = int(split[split.index("epoch") + 1])
-                                score = float(split[split.index("train_loss") + 1])
-                                error = 1 - float(
-                                    split[split.index("train_accuracy") + 1]
-                                )
-                                lr = float(split[split.index("train_lr") + 1])
-                            except ValueError:
-                                continue
-                            train_score[epoch] = score
-                            train_error[epoch] = error
-                            learning_rates[epoch] = lr
-                            i += 1
+        table = self.get_epoch_metrics()
+        table.write(self.out_epoch_metrics.get_path())
+        train_epochs, train_score = table.get("train_score")
+        _, train_error = table.get("train_error")
+        valid_epochs, valid_score = table.get("valid_score")
+        _, valid_error = table.get("valid_error")
+        lr_epochs, learning_rates = table.get("learning_rate")
 
         colors = ["#2a4d6e", "#aa3c39"]
         import matplotlib.pyplot as plt
 
         fig, axs = plt.subplots(2, sharex=True, figsize=(12, 9))
-        train_epochs = list(train_score.keys())
-        valid_epochs = list(valid_score.keys())
-        lr_epochs = list(learning_rates.keys())
-        train_epochs.sort()
-        valid_epochs.sort()
-        lr_epochs.sort()
-
         axs[0].plot(
             train_epochs,
-            [train_score[e] for e in train_epochs],
+            train_score,
             "o-",
             color=colors[0],
             label="train score",
         )
         axs[0].plot(
             valid_epochs,
-            [valid_score[e] for e in valid_epochs],
+            valid_score,
             "o-",
             color=colors[1],
             label="valid score",
@@ -359,14 +328,14 @@ class FairseqHydraTrainingJob(Job):
 
         axs[1].plot(
             train_epochs,
-            [train_error[e] for e in train_epochs],
+            train_error,
             "o-",
             color=colors[0],
             label="train error",
         )
         axs[1].plot(
             valid_epochs,
-            [valid_error[e] for e in valid_epochs],
+            valid_error,
             "o-",
             color=colors[1],
             label="valid error",
@@ -380,7 +349,7 @@ class FairseqHydraTrainingJob(Job):
         fig, axs = plt.subplots()
         axs.plot(
             lr_epochs,
-            [learning_rates[e] for e in lr_epochs],
+            learning_rates,
             "o-",
             color=colors[0],
             label="learning rate",
@@ -1,74 +1,168 @@
 from sisyphus import *
-import h5py
 from i6_core.lib import corpus
 import numpy as np
+from typing import Optional, Tuple
+
+from i6_experiments.users.rossenbach.lib.hdf import HDFSequenceReader
+
+
+class TokenFeatureStatistics:
+  """
+  Streaming per-token mean and variance of feature frames (Welford / Chan et al. parallel update),
+  memory is O(tokens x dim) independent of the number of frames.
+  Optionally keeps a uniform reservoir sample of the frames per token to estimate percentiles.
+  """
+
+  def __init__(self, dim: int, reservoir_size: Optional[int] = None, seed: int = 42):
+    self.dim = dim
+    self.reservoir_size = reservoir_size
+    self.rng = np.random.default_rng(seed)
+    self.tokens = []
+    self.token_to_id = {}
+    self.count = np.zeros((0,), dtype=np.int64)
+    self.mean = np.zeros((0, dim), dtype=np.float64)
+    self.m2 = np.zeros((0, dim), dtype=np.float64)
+    self.reservoirs = []
+
+  def _grow(self, num_tokens: int):
+    missing = num_tokens - len(self.count)
+    if missing > 0:
+      self.count = np.concatenate([self.count, np.zeros((missing,), dtype=np.int64)])
+      self.mean = np.concatenate([self.mean, np.zeros((missing, self.dim))])
+      self.m2 = np.concatenate([self.m2, np.zeros((missing, self.dim))])
+
+  def get_id(self, token: str) -> int:
+    if token not in self.token_to_id:
+      self.token_to_id[token] = len(self.tokens)
+      self.tokens.append(token)
+      self.reservoirs.append(np.zeros((0, self.dim)))
+    return self.token_to_id[token]
+
+  def add_segment(self, tokens, durations, features):
+    """
+    :param list[str] tokens:
+    :param np.ndarray durations: number of frames per token
+    :param np.ndarray features: (sum(durations), dim)
+    """
+    token_ids = np.array([self.get_id(token) for token in tokens], dtype=np.int64)
+    self._grow(len(self.tokens))
+    frame_ids = np.repeat(token_ids, np.maximum(np.asarray(durations, dtype=np.int64).reshape(-1), 0))
+    features = np.asarray(features, dtype=np.float64).reshape(len(frame_ids), self.dim)
+
+    # statistics of this segment
+    seg_count = np.bincount(frame_ids, minlength=len(self.tokens))
+    seg_sum = np.zeros((len(self.tokens), self.dim))
+    np.add.at(seg_sum, frame_ids, features)
+    seen = seg_count > 0
+    seg_mean = np.zeros_like(seg_sum)
+    seg_mean[seen] = seg_sum[seen] / seg_count[seen, None]
+    seg_m2 = np.zeros_like(seg_sum)
+    np.add.at(seg_m2, frame_ids, (features - seg_mean[frame_ids]) ** 2)
+
+    # merge with the statistics so far
+    total = self.count + seg_count
+    delta = seg_mean - self.mean
+    self.mean[seen] += delta[seen] * (seg_count[seen] / total[seen])[:, None]
+    self.m2[seen] += seg_m2[seen] + delta[seen] ** 2 * (self.count[seen] * seg_count[seen] / total[seen])[:, None]
+
+    if self.reservoir_size:
+      for token_id in np.nonzero(seen)[0]:
+        self._sample(token_id, features[frame_ids == token_id])
+    self.count = total
+
+  def _sample(self, token_id: int, frames: np.ndarray):
+    """
+    Algorithm R for a block of frames, has to be called before the count is updated
+    """
+    # global index of each frame among all frames of this token
+    index = self.count[token_id] + np.arange(len(frames))
+    slot = np.where(index < self.reservoir_size, index, self.rng.integers(0, index + 1))
+    keep = slot < self.reservoir_size
+    reservoir = self.reservoirs[token_id]
+    fill = min(self.reservoir_size, index[-1] + 1)
+    if len(reservoir) < fill:
+      reservoir = np.concatenate([reservoir, np.zeros((fill - len(reservoir), self.dim))])
+    reservoir[slot[keep]] = frames[keep]
+    self.reservoirs[token_id] = reservoir
+
+  def std(self, token: str) -> np.ndarray:
+    token_id = self.token_to_id[token]
+    with np.errstate(invalid="ignore", divide="ignore"):
+      return np.sqrt(self.m2[token_id] / self.count[token_id])
+
+  def percentiles(self, token: str, q) -> np.ndarray:
+    """
+    :return: (len(q), dim) percentiles estimated from the reservoir sample
+    """
+    assert self.reservoir_size, "percentiles need a reservoir sample"
+    reservoir = self.reservoirs[self.token_to_id[token]]
+    if len(reservoir) == 0:
+      return np.full((len(q), self.dim), np.nan)
+    return np.percentile(reservoir, q, axis=0)
 
 
 class CalculateVarianceFromFeaturesJob(Job):
 
-  def __init__(self, feature_hdf: tk.Path, duration_hdf: tk.Path, bliss: tk.Path):
+  __sis_hash_exclude__ = {"reservoir_size": None, "percentiles": (5, 25, 50, 75, 95)}
+
+  def __init__(
+    self,
+    feature_hdf: tk.Path,
+    duration_hdf: tk.Path,
+    bliss: tk.Path,
+    reservoir_size: Optional[int] = None,
+    percentiles: Tuple[float, ...] = (5, 25, 50, 75, 95),
+  ):
+    """
+    :param feature_hdf:
+    :param duration_hdf:
+    :param bliss:
+    :param reservoir_size: if set, keep this many randomly sampled frames per token
+      and write the feature percentiles per token to out_percentiles
+    :param percentiles: which percentiles to write, only used with reservoir_size
+    """
 
     self.features = feature_hdf
     self.durations = duration_hdf
     self.corpus = bliss
+    self.reservoir_size = reservoir_size
+    self.percentiles = percentiles
 
     self.out_csv = self.output_path("stats.csv")
     self.out_variance = self.output_var("variance")
     self.out_weight_variance = self.output_var("weighted_variance")
     self.out_variance_no_sil = self.output_var("variance_no_sil")
     self.out_weight_variance_no_sil = self.output_var("weighted_variance_no_sil")
+    if reservoir_size:
+      self.out_percentiles = self.output_path("percentiles.csv")
 
   def tasks(self):
-    yield Task("run", rqmt={"time": 2, "mem": 16})
+    yield Task("run", rqmt={"time": 2, "mem": 4})
 
   def run(self):
 
-    duration_data = h5py.File(self.durations.get_path(), "r")
-    duration_inputs = duration_data["inputs"]
-    duration_raw_tags = duration_data["seqTags"]
-    duration_lengths = duration_data["seqLengths"]
-
-    durations_by_tag = {}
-    offset = 0
-    for tag, length in zip(duration_raw_tags, duration_lengths):
-      durations_by_tag[tag] = duration_inputs[offset:offset + length[0]]
-      offset += length[0]
-    print("Durations loaded ", len(durations_by_tag))
-
-    feature_data = h5py.File(self.features.get_path(), "r")
-    feature_inputs = feature_data["inputs"]
-    feature_raw_tags = list(feature_data["seqTags"])
-    feature_lengths = feature_data["seqLengths"]
-    features_by_tag = {}
-    offset = 0
-    for tag, length in zip(feature_raw_tags, feature_lengths):
-      features_by_tag[tag if isinstance(tag, str) else str(tag, "utf-8")] = feature_inputs[offset:offset + length[0]]
-      offset += length[0]
-
-    print("Features loaded ", len(features_by_tag))
-
-    bliss = corpus.Corpus()
-    bliss.load(self.corpus.get_path())
-    counter = 0
-    phoneme_dict = {}
-    for recording in bliss.all_recordings():
-      for segment in recording.segments:
-        text = segment.orth.split(" ")
-        durations = durations_by_tag[segment.fullname()]
-        features = features_by_tag[segment.fullname()]
-        counter += 1
-        print(counter)
-        assert np.sum(durations) == len(features), (sum(durations), len(features), segment.fullname())
-        assert len(text) == len(durations), (len(text), len(durations), segment.fullname())
-        offset = 0
-        for duration, token in zip(durations, text):
-          if token not in phoneme_dict:
-            phoneme_dict[token] = []
-          if int(duration) > 0:
-            for feature in features[offset:int(duration) + offset]:
-              phoneme_dict[token].append(feature)
-            offset += int(duration)
-        # print(list(zip(text, durations)))
+    with HDFSequenceReader(self.durations.get_path()) as durations_by_tag, \
+        HDFSequenceReader(self.features.get_path()) as features_by_tag:
+      print("Durations indexed ", len(durations_by_tag))
+      print("Features indexed ", len(features_by_tag))
+
+      bliss = corpus.Corpus()
+      bliss.load(self.corpus.get_path())
+      counter = 0
+      statistics = None
+      for recording in bliss.all_recordings():
+        for segment in recording.segments:
+          text = segment.orth.split(" ")
+          durations = durations_by_tag[segment.fullname()]
+          features = features_by_tag[segment.fullname()]
+          counter += 1
+          print(counter)
+          assert np.sum(durations) == len(features), (sum(durations), len(features), segment.fullname())
+          assert len(text) == len(durations), (len(text), len(durations), segment.fullname())
+          if statistics is None:
+            dim = int(np.prod(features.shape[1:]))
+            statistics = TokenFeatureStatistics(dim, reservoir_size=self.reservoir_size)
+          statistics.add_segment(text, durations, features)
 
     mean_ls = []
     counts = []
@@ -76,10 +170,11 @@ class CalculateVarianceFromFeaturesJob(Job):
     no_sil_counts = []
     with open(self.out_csv.get_path(), "wt") as f:
       f.write("Phoneme, mean, median, min, max, std\n")
-      for token in phoneme_dict:
+      for token in statistics.tokens:
         if token.startswith("[start") or token.startswith("[end"):
           continue
-        covs = np.std(phoneme_dict[token], axis=0)
+        covs = statistics.std(token)
+        count = int(statistics.count[statistics.token_to_id[token]])
         print(token, covs)
         print("Mean:", np.mean(covs), "Median:", np.median(covs), "Min:", covs.min(), "Max:", covs.max(), "Stds:",
           np.std(covs))
@@ -93,10 +188,10 @@ class CalculateVarianceFromFeaturesJob(Job):
         )
         f.write(string)
         mean_ls.append(np.mean(covs))
-        counts.append(len(phoneme_dict[token]))
+        counts.append(count)
         if not token.startswith("["):
           no_sil_means.append(np.mean(covs))
-          no_sil_counts.append(len(phoneme_dict[token]))
+          no_sil_counts.append(count)
     assert len(mean_ls) == len(no_sil_means) + 1
     assert len(counts) == len(no_sil_counts) + 1
     self.out_variance.set(np.mean(mean_ls))
@@ -104,6 +199,22 @@ class CalculateVarianceFromFeaturesJob(Job):
     self.out_variance_no_sil.set(np.mean(no_sil_means))
     self.out_weight_variance_no_sil.set(np.average(no_sil_means, weights=no_sil_counts))
 
+    if self.reservoir_size:
+      with open(self.out_percentiles.get_path(), "wt") as f:
+        f.write("Phoneme, percentile, mean, median, min, max\n")
+        for token in statistics.tokens:
+          if token.startswith("[start") or token.startswith("[end"):
+            continue
+          for q, values in zip(self.percentiles, statistics.percentiles(token, self.percentiles)):
+            f.write("%s,%g,%.3f,%.3f,%.3f,%.3f\n" % (
+              token,
+              q,
+              float(np.mean(values)),
+              float(np.median(values)),
+              float(np.min(values)),
+              float(np.max(values)),
+            ))
+
 
 class CalculateVarianceFromDurations(Job):
 
@@ -126,23 +237,8 @@ class CalculateVarianceFromDurations(Job):
     c = corpus.Corpus()
     c.load(self.bliss.get_path())
 
-    input_data = h5py.File(self.durations.get_path(), 'r')
-
-    inputs = input_data['inputs']
-    seq_tags = input_data['seqTags']
-    lengths = input_data['seqLengths']
-
-    sequences = []
-    tags = []
-    offset = 0
-    for tag, length in zip(seq_tags, lengths):
-      tag = tag if isinstance(tag, str) else tag.decode()
-      in_data = inputs[offset:offset + length[0]]
-      sequences.append(in_data)
-      offset += length[0]
-      tags.append(tag)
-
-    tagged_sequences = {tag: sequence for tag, sequence in zip(tags, sequences)}
+    with HDFSequenceReader(self.durations.get_path()) as reader:
+      tagged_sequences = dict(reader.iter_sequences())
     tagged_annotated_sequences = {}
     for segment in c.segments():
       name = segment.fullname()
@@ -1,13 +1,41 @@
+import multiprocessing
+import time
 import numpy
 import h5py
 from typing import Optional
 from sisyphus import tk, Job, Task
 from i6_core.lib.rasr_cache import FileArchive
-from i6_experiments.users.rossenbach.lib.hdf import SimpleHDFWriter
+from i6_experiments.users.rossenbach.lib.durations import AllophoneDurationTable, rasr_alignment_to_durations
+from i6_experiments.users.rossenbach.lib.hdf import BufferedHDFWriter
 from i6_core.lib.corpus import Corpus
 from i6_core.lib.hdf import get_input_dict_from_returnn_hdf
 
 
+def _extract_cache_durations(args):
+  """
+  Converts all alignments of a single cache of the bundle, runs in a worker process
+
+  :param tuple[str, str, str, str] args: cache path, allophone file, silence token and boundary token
+  :return: key, durations (None if the alignment is empty), labels and number of frames per sequence
+  :rtype: list[tuple[str, numpy.ndarray|None, list[str]|None, int]]
+  """
+  cache_path, allophones_path, silence_token, boundary_token = args
+  sprint_cache = FileArchive(cache_path)
+  sprint_cache.setAllophones(allophones_path)
+  table = AllophoneDurationTable(sprint_cache.allophones, silence_token, boundary_token)
+  results = []
+  for key in [str(s) for s in sprint_cache.ft if not str(s).endswith(".attribs")]:
+    alignment = sprint_cache.read(key, "align")
+    if len(alignment) == 0:
+      results.append((key, None, None, 0))
+      continue
+    times = numpy.array([a[0] for a in alignment])
+    allophone_indices = numpy.array([a[1] for a in alignment])
+    durations, labels = rasr_alignment_to_durations(times, allophone_indices, table)
+    results.append((key, durations, labels, len(alignment)))
+  return results
+
+
 class ExtractDurationsFromRASRAlignmentJob(Job):
   """
   Takes given rasr alignment bundle and converts it to a hdf which contains the aligned durations
@@ -25,6 +53,7 @@ class ExtractDurationsFromRASRAlignmentJob(Job):
     start_token: str = "[start]",
     end_token: str = "[end]",
     boundary_token: str = "[space]",
+    cpu_rqmt: int = 1,
   ):
     """
     :param rasr_alignment: Path to the rasr alignment file.
@@ -37,6 +66,7 @@ class ExtractDurationsFromRASRAlignmentJob(Job):
     :param boundary_token: boundary token to be inserted
     :param time_rqmt:
     :param mem_rqmt:
+    :param cpu_rqmt: number of caches of the bundle which are converted in parallel
     """
     self.align = rasr_alignment
     self.bliss_corpus = bliss_corpus
@@ -50,13 +80,12 @@ class ExtractDurationsFromRASRAlignmentJob(Job):
     self.out_durations_hdf = self.output_path("durations.hdf")
     self.out_bliss = self.output_path("labeled_corpus.xml.gz")
 
-    self.rqmt = {"time": time_rqmt, "mem": mem_rqmt}
+    self.rqmt = {"time": time_rqmt, "mem": mem_rqmt, "cpu": cpu_rqmt}
 
   def tasks(self):
     yield Task("run", rqmt=self.rqmt)
 
   def run(self):
-    durations = []
     tags = []
     full_corpus_labels = {}
     empty_aligns = []
@@ -64,103 +93,56 @@ class ExtractDurationsFromRASRAlignmentJob(Job):
       hdf_file = h5py.File(self.target_duration_hdf, "r")
       returnn_length_dict = get_input_dict_from_returnn_hdf(hdf_file=hdf_file)
     if self.align.get_path().endswith(".bundle"):
-      files = open(self.align.get_path(), "rt")
-      for cache in files:
-        sprint_cache = FileArchive(cache.strip())
-        sprint_cache.setAllophones(self.rasr_allophones.get_path())
-        keys = [str(s) for s in sprint_cache.ft if not str(s).endswith(".attribs")]
-        for key in keys:
-          seq = []
-          gmm_seq = []
+      with open(self.align.get_path(), "rt") as files:
+        caches = [cache.strip() for cache in files if cache.strip()]
+    else:
+      caches = [self.align.get_path()]
+
+    start = time.monotonic()
+    num_frames = 0
+    writer = BufferedHDFWriter(self.out_durations_hdf.get_path(), dim=1, ndim=2)
+    args = [
+      (cache, self.rasr_allophones.get_path(), self.silence_token, self.boundary_token) for cache in caches]
+    with multiprocessing.Pool(self.rqmt["cpu"]) as pool:
+      # imap keeps the order of the bundle, results are written as soon as a cache is done
+      for results in pool.imap(_extract_cache_durations, args):
+        for key, seq, gmm_seq, alignment_length in results:
           tags.append(key)
-          start_time = 0
-          space_insert = False
-          alignment = [
-            (a[0], sprint_cache.allophones[a[1]])
-            for a in sprint_cache.read(key, "align")
-          ]
-          # Start computing duration sequence from rasr alignment
-          last_allophone = None
-          if len(alignment) == 0:
+          if seq is None:
             empty_aligns.append(key)
             continue
-          for time, allophone in alignment:
-            phoneme = allophone.split("{", 1)[0].rstrip()
-            # new sequence has boundary instead of silence token
-            if phoneme == self.silence_token:
-              phoneme = self.boundary_token
-            # start of sequence
-            if len(gmm_seq) == 0:
-              gmm_seq.append(phoneme)
-            # within phoneme or silence
-            elif allophone == last_allophone:
-              space_insert = False
-            # Insert word boundary token between words where there is no silence
-            elif (
-              self.boundary_token not in gmm_seq[-1]
-              and allophone != last_allophone
-              and "@i" in allophone
-              and phoneme != self.boundary_token
-            ):
-              seq.append(time - start_time)
-              gmm_seq.append(self.boundary_token)
-              seq.append(0)
-              space_insert = True
-              start_time = time
-              gmm_seq.append(phoneme)
-            # new phoneme but no word boundary
-            elif allophone != last_allophone and space_insert is False:
-              gmm_seq.append(phoneme)
-              seq.append(time - start_time)
-              start_time = time
-            else:
-              assert False, "Check your data, this should not be reached!"
-            last_allophone = allophone
-          # Add duration of last token
+          num_frames += alignment_length
           if self.target_duration_hdf is not None:
             # take the difference between returnn feature extraction and rasr feature extraction in account
-            difference = len(alignment) - returnn_length_dict[key]
+            difference = alignment_length - returnn_length_dict[key]
             assert -1 <= difference <= 1, (
               "The difference must not be greater, remember to use center=False "
               "for the RETURNN feature extration"
             )
+            seq[-1] -= difference
           else:
             difference = 0
-          seq.append(len(alignment) - start_time - difference)
           # Assert that number of durations fit the given alignment
-          assert len(alignment) == (sum(seq) + difference), (
+          assert alignment_length == (sum(seq) + difference), (
             key,
-            len(alignment),
+            alignment_length,
             sum(seq),
           )
           # manually add start/end token with duration 0
-          seq = numpy.insert(seq, 0, 0)
-          seq = numpy.append(seq, 0)
-          gmm_seq.append(self.end_token)
-          gmm_seq.insert(0, self.start_token)
-
-          # Create new labels for corpus
-          corpus_labels = gmm_seq
+          seq = numpy.concatenate([[0], seq, [0]]).astype(numpy.int32)
+          corpus_labels = [self.start_token] + gmm_seq + [self.end_token]
           # Assert that the number of labels fit the number of tokens in the duration sequence
-          assert len(seq) == len(corpus_labels), (key, alignment, len(seq), len(corpus_labels))
-          durations.append(seq)
+          assert len(seq) == len(corpus_labels), (key, len(seq), len(corpus_labels))
           full_corpus_labels[key] = corpus_labels
 
-    # Write durations to hdf file
+          in_data = numpy.expand_dims(seq, axis=1)
+          writer.insert_batch(numpy.asarray([in_data]), [in_data.shape[0]], [key])
+
     assert len(empty_aligns) == 0, (len(empty_aligns), empty_aligns)
-    new_lengths = []
-    for seq in durations:
-      new_lengths.append([len(seq), 2, 2])
-    duration_sequence = numpy.hstack(durations).astype(numpy.int32)
-    dim = 1
-    writer = SimpleHDFWriter(self.out_durations_hdf.get_path(), dim=dim, ndim=2)
-    offset = 0
-    for tag, length in zip(tags, new_lengths):
-      in_data = duration_sequence[offset : offset + length[0]]
-      in_data = numpy.expand_dims(in_data, axis=1)
-      offset += length[0]
-      writer.insert_batch(numpy.asarray([in_data]), [in_data.shape[0]], [tag])
     writer.close()
+    elapsed = time.monotonic() - start
+    print("Converted %i frames of %i sequences in %.1fs (%.0f frames/s)" % (
+      num_frames, len(tags), elapsed, num_frames / max(elapsed, 1e-9)))
 
     # Write new labels into the corpus such that label sequence fits the duration sequence
     bliss_corpus = Corpus()
@@ -170,3 +152,8 @@ class ExtractDurationsFromRASRAlignmentJob(Job):
       new_orth = delimiter_str.join(full_corpus_labels[s.fullname()])
       s.orth = new_orth
     bliss_corpus.dump(self.out_bliss.get_path())
+
+  @classmethod
+  def hash(cls, kwargs):
+    kwargs.pop("cpu_rqmt")
+    return super().hash(kwargs)
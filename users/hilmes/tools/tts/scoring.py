@@ -1,4 +1,10 @@
 from sisyphus import *
+import hashlib
+import multiprocessing
+import os
+import tempfile
+from typing import Optional
+
 import soundfile
 import librosa
 import numpy
@@ -6,18 +12,133 @@ import numpy
 from i6_core.lib import corpus
 
 
+def extract_f0_features(audio_path, params):
+  """
+  Computes the mel filterbank used for the DTW and the pYIN F0 contour of one audio file.
+
+  :param str audio_path:
+  :param dict params: extraction parameters, see CompareF0ValuesJob.extraction_params
+  :return: dict with "mel", "f0", "voiced" and "sample_rate"
+  :rtype: dict[str,numpy.ndarray|int]
+  """
+  signal, sample_rate = soundfile.read(audio_path)
+  hop_length = int(params["step_len"] * sample_rate)
+  frame_length = int(params["window_len"] * sample_rate)
+  mel = librosa.feature.melspectrogram(
+    y=signal, sr=sample_rate,
+    n_mels=params["n_mels"],
+    hop_length=hop_length,
+    n_fft=frame_length,
+    fmin=params["fmin_ex"], fmax=params["fmax_ex"], center=params["center"]
+  )
+  f0, voiced, _ = librosa.pyin(y=signal, sr=sample_rate, hop_length=hop_length,
+    frame_length=frame_length, win_length=frame_length // 2,
+    fmin=params["fmin_pyin"], fmax=params["fmax_pyin"], center=params["center"], fill_na=0.0)
+  return {"mel": mel, "f0": f0, "voiced": voiced, "sample_rate": sample_rate}
+
+
+def cached_f0_features(audio_path, params, cache_dir):
+  """
+  Same as :func:`extract_f0_features`, but stored in cache_dir,
+  keyed by the audio path, its modification time and the extraction parameters.
+
+  :param str audio_path:
+  :param dict params:
+  :param str|None cache_dir: no caching if None
+  :rtype: dict[str,numpy.ndarray|int]
+  """
+  if cache_dir is None:
+    return extract_f0_features(audio_path, params)
+  audio_path = os.path.abspath(audio_path)
+  key = repr((audio_path, os.path.getmtime(audio_path), sorted(params.items())))
+  cache_file = os.path.join(cache_dir, hashlib.sha256(key.encode("utf-8")).hexdigest() + ".npz")
+  if os.path.exists(cache_file):
+    with numpy.load(cache_file) as cached:
+      features = {k: cached[k] for k in cached.files}
+    features["sample_rate"] = int(features["sample_rate"])
+    return features
+  features = extract_f0_features(audio_path, params)
+  os.makedirs(cache_dir, exist_ok=True)
+  # write to a temporary file first, other jobs might read the same cache concurrently
+  fd, tmp_file = tempfile.mkstemp(dir=cache_dir, suffix=".npz")
+  with os.fdopen(fd, "wb") as f:
+    numpy.savez(f, **features)
+  os.replace(tmp_file, cache_file)
+  return features
+
+
+def compare_f0(ref, test, dtw, check_voiced, all_frames=True):
+  """
+  :param dict ref: features of the reference, see :func:`extract_f0_features`
+  :param dict test: features of the test audio
+  :param bool dtw: align the frames with DTW over the mel features, otherwise frame by frame
+  :param bool check_voiced: only compare frames where both are voiced
+  :param bool all_frames: without DTW, compare all frames.
+    If False, only the first n_mels frames are compared, as CompareF0ValuesJob did originally.
+  :return: mae, ref pitches, test pitches, wrong voicing mappings, warping path
+  """
+  assert ref["sample_rate"] == test["sample_rate"], "Sample rates must match"
+  if dtw:
+    _, wp = librosa.sequence.dtw(ref["mel"], test["mel"])
+  else:
+    axis = -1 if all_frames else 0
+    assert ref["mel"].shape[axis] == test["mel"].shape[axis], "If no DTW sequences need same length"
+    wp = list(zip(range(ref["mel"].shape[axis]), range(test["mel"].shape[axis])))
+
+  path = numpy.asarray(wp).reshape(-1, 2)
+  voiced_ref = ref["voiced"][path[:, 0]]
+  voiced_test = test["voiced"][path[:, 1]]
+  selected = voiced_ref & voiced_test if check_voiced else numpy.ones(len(path), dtype=bool)
+  pitch_ref = ref["f0"][path[selected, 0]]
+  pitch_test = test["f0"][path[selected, 1]]
+  mae = 1200 / len(path) * float(numpy.sum(numpy.abs(numpy.log2(pitch_test / pitch_ref))))
+  wrong_mappings = int(numpy.count_nonzero(voiced_ref != voiced_test))
+  return mae, pitch_ref, pitch_test, wrong_mappings, wp
+
+
+def _compare_f0_segment(args):
+  """
+  Worker function for the process pool of CompareF0ValuesJob.
+  """
+  ref_audio, test_audio, params, cache_dir, dtw, check_voiced, all_frames = args
+  ref = cached_f0_features(ref_audio, params, cache_dir)
+  test = extract_f0_features(test_audio, params)
+  mae, pitch_ref, pitch_test, wrong_mappings, wp = compare_f0(ref, test, dtw, check_voiced, all_frames)
+  return mae, pitch_ref, pitch_test, wrong_mappings, wp, ref["mel"].shape[-1], test["mel"].shape[-1]
+
+
 class CompareF0ValuesJob(Job):
   """
   Extracts F0 for two given Corpora and calculates MAE over both
+
+  Without DTW, only the first n_mels frames are compared unless compare_all_frames is set,
+  which was the behavior of the original frame by frame comparison.
+
+  With cpu > 1 the segments are processed in parallel.
+  If reference_cache_dir is given, the F0 and mel features of the reference audio files are stored there
+  and reused by all jobs comparing against the same reference audio with the same parameters.
   """
 
-  def __init__(self, ref_corpus: tk.Path, test_corpus: tk.Path, segment_list: tk.Path, dtw: bool = True, check_voiced = True):
+  def __init__(
+    self,
+    ref_corpus: tk.Path,
+    test_corpus: tk.Path,
+    segment_list: tk.Path,
+    dtw: bool = True,
+    check_voiced = True,
+    cpu: int = 1,
+    reference_cache_dir: Optional[str] = None,
+    compare_all_frames: bool = False,
+  ):
 
     self.ref_corpus = ref_corpus
     self.test_corpus = test_corpus
     self.segment_list = segment_list
     self.dtw = dtw
     self.check_voiced = check_voiced
+    self.cpu = cpu
+    self.reference_cache_dir = reference_cache_dir
+    self.compare_all_frames = compare_all_frames
 
     self.rqmt = {
       "mem": 1,
@@ -45,8 +166,22 @@ class CompareF0ValuesJob(Job):
     self.out_total_wrong_mappings = self.output_var("total_wrong_mappings")
 
   def tasks(self):
-
-    yield Task("run", mini_task=True)
+    if self.cpu > 1:
+      yield Task("run", rqmt={**self.rqmt, "cpu": self.cpu})
+    else:
+      yield Task("run", mini_task=True)
+
+  def extraction_params(self):
+    return {
+      "step_len": self.step_len,
+      "window_len": self.window_len,
+      "fmin_pyin": self.fmin_pyin,
+      "fmax_pyin": self.fmax_pyin,
+      "fmin_ex": self.fmin_ex,
+      "fmax_ex": self.fmax_ex,
+      "center": self.center,
+      "n_mels": self.n_mels,
+    }
 
   def run(self):
 
@@ -60,6 +195,7 @@ class CompareF0ValuesJob(Job):
 
     with open(self.segment_list.get_path(), "r") as f:
       segment_list = f.read().splitlines()
+    segment_set = set(segment_list)
 
     bliss_1 = corpus.Corpus()
     bliss_1.load(self.ref_corpus.get_path())
@@ -69,76 +205,44 @@ class CompareF0ValuesJob(Job):
     recordings_1 = {}
     for recording in bliss_1.all_recordings():
       for segment in recording.segments:
-        if segment.fullname() in segment_list:
+        if segment.fullname() in segment_set:
           recordings_1[segment.fullname()] = recording.audio
 
     recordings_2 = {}
     for recording in bliss_2.all_recordings():
       for segment in recording.segments:
-        if segment.fullname() in segment_list:
+        if segment.fullname() in segment_set:
           recordings_2[segment.fullname()] = recording.audio
 
     assert len(recordings_1) == len(segment_list)
     assert len(segment_list) == len(recordings_2)
-    for segment in segment_list:
-      signal_1, sr_1 = soundfile.read(recordings_1[segment])
-      signal_2, sr_2 = soundfile.read(recordings_2[segment])
 
-      assert sr_1 == sr_2, "Sample rates must match"
-      sample_rate = sr_1
-
-      mel_filterbank_1 = librosa.feature.melspectrogram(
-        y=signal_1, sr=sample_rate,
-        n_mels=self.n_mels,
-        hop_length=int(self.step_len * sample_rate),
-        n_fft=int(self.window_len * sample_rate),
-        fmin=self.fmin_ex, fmax=self.fmax_ex, center=self.center
-      )
-      mel_filterbank_2 = librosa.feature.melspectrogram(
-        y=signal_2, sr=sample_rate,
-        n_mels=self.n_mels,
-        hop_length=int(self.step_len * sample_rate),
-        n_fft=int(self.window_len * sample_rate),
-        fmin=self.fmin_ex, fmax=self.fmax_ex, center=self.center
-      )
-
-      if self.dtw:
-        D, wp = librosa.sequence.dtw(mel_filterbank_1, mel_filterbank_2)
-      else:
-        assert len(mel_filterbank_1) == len(mel_filterbank_2), "If no DTW sequences need same length"
-        wp = list(zip(range(len(mel_filterbank_1)), range(len(mel_filterbank_2))))
-
-      f0_1, voiced_1, _ = librosa.pyin(y=signal_1, sr=sample_rate, hop_length=int(self.step_len * sample_rate),
-        frame_length=int(self.window_len * sample_rate), win_length=int(self.window_len * sample_rate) // 2,
-        fmin=self.fmin_pyin, fmax=self.fmax_pyin, center=self.center, fill_na=0.0)
-      f0_2, voiced_2, _ = librosa.pyin(y=signal_2, sr=sample_rate, hop_length=int(self.step_len * sample_rate),
-        frame_length=int(self.window_len * sample_rate), win_length=int(self.window_len * sample_rate) // 2,
-        fmin=self.fmin_pyin, fmax=self.fmax_pyin, center=self.center, fill_na=0.0)
-
-      scale = 1200 / len(wp)
-      sum = 0
-      pitch_ls_1 = []
-      pitch_ls_2 = []
-      wrong_mappings = 0
-      for t_1, t_2 in wp:
-        if (voiced_1[t_1] and voiced_2[t_2]) or not self.check_voiced:
-          pitch_ls_1.append(f0_1[t_1])
-          pitch_ls_2.append(f0_2[t_2])
-          sum += abs(numpy.log2((f0_2[t_2] / f0_1[t_1])))
-        if (voiced_1[t_1] and not voiced_2[t_2]) or (not voiced_1[t_1] and voiced_2[t_2]):
-          wrong_mappings += 1
-
-      mae = scale * sum
-      print("MAE     Real Data        Synth Data        Wrong Mappings", "Total Lengths (real/synth)")
-      print("%.2f " % mae, "%.2f+-%.2f" % (float(numpy.mean(pitch_ls_1)), float(numpy.std(pitch_ls_1))),
-        "   %.2f+-%.2f " % (float(numpy.mean(pitch_ls_2)), float(numpy.std(pitch_ls_2))), wrong_mappings, len(mel_filterbank_1), len(mel_filterbank_2))
-      mae_ls.append(mae)
-      mean_1_ls.append(numpy.mean(pitch_ls_1))
-      mean_2_ls.append(numpy.mean(pitch_ls_2))
-      std_1_ls.append(numpy.std(pitch_ls_1))
-      std_2_ls.append(numpy.std(pitch_ls_2))
-      wrong_mappings_ls.append(wrong_mappings)
-      mappings_ls.append(wp)
+    params = self.extraction_params()
+    work = [
+      (
+        recordings_1[segment], recordings_2[segment], params, self.reference_cache_dir, self.dtw, self.check_voiced,
+        self.compare_all_frames)
+      for segment in segment_list
+    ]
+    pool = multiprocessing.Pool(self.cpu) if self.cpu > 1 else None
+    try:
+      results = pool.imap(_compare_f0_segment, work) if pool is not None else map(_compare_f0_segment, work)
+      for mae, pitch_ls_1, pitch_ls_2, wrong_mappings, wp, len_1, len_2 in results:
+        print("MAE     Real Data        Synth Data        Wrong Mappings", "Total Lengths (real/synth)")
+        print("%.2f " % mae, "%.2f+-%.2f" % (float(numpy.mean(pitch_ls_1)), float(numpy.std(pitch_ls_1))),
+          "   %.2f+-%.2f " % (float(numpy.mean(pitch_ls_2)), float(numpy.std(pitch_ls_2))), wrong_mappings, len_1, len_2)
+        mae_ls.append(mae)
+        mean_1_ls.append(numpy.mean(pitch_ls_1))
+        mean_2_ls.append(numpy.mean(pitch_ls_2))
+        std_1_ls.append(numpy.std(pitch_ls_1))
+        std_2_ls.append(numpy.std(pitch_ls_2))
+        wrong_mappings_ls.append(wrong_mappings)
+        mappings_ls.append(wp)
+    finally:
+      # also stops the workers if consuming the results failed
+      if pool is not None:
+        pool.terminate()
+        pool.join()
 
     with open(self.out_maes.get_path(), "w") as f:
       for mae in mae_ls:
@@ -168,6 +272,15 @@ class CompareF0ValuesJob(Job):
 
     print("Average MAE: ", average_mae, "Total wrong mappings", total_wrong_mappings)
 
+  @classmethod
+  def hash(cls, parsed_args):
+    d = dict(parsed_args)
+    d.pop("cpu", None)
+    d.pop("reference_cache_dir", None)
+    if not d.get("compare_all_frames"):
+      d.pop("compare_all_frames", None)
+    return super().hash(d)
+
 
 class CompareEnergyValuesJob(Job):
 
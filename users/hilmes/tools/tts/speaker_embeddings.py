@@ -8,6 +8,7 @@ import random
 from typing import Iterator, Optional, Dict
 
 from i6_private.users.rossenbach.lib.hdf import SimpleHDFWriter
+from i6_experiments.users.rossenbach.lib.hdf import BufferedHDFWriter, HDFSequenceReader
 from i6_core.lib import corpus
 import collections
 
@@ -137,24 +138,14 @@ class DistributeSpeakerEmbeddings(Job):
 
     def run(self):
 
-        speaker_embedding_data = h5py.File(
-            tk.uncached_path(self.speaker_embedding_hdf), "r"
-        )
-        speaker_embedding_inputs = speaker_embedding_data["inputs"]
-        speaker_embedding_raw_tags = speaker_embedding_data["seqTags"]
-        speaker_embedding_lengths = speaker_embedding_data["seqLengths"]
-
         self.speaker_embedding_features = []
         self.speaker_embedding_tags = []
-        offset = 0
-        for tag, length in zip(speaker_embedding_raw_tags, speaker_embedding_lengths):
-            self.speaker_embedding_features.append(
-                speaker_embedding_inputs[offset : offset + length[0]]
-            )
-            self.speaker_embedding_tags.append(tag)
-            offset += length[0]
+        with HDFSequenceReader(tk.uncached_path(self.speaker_embedding_hdf)) as reader:
+            for tag, features in reader.iter_sequences():
+                self.speaker_embedding_features.append(features)
+                self.speaker_embedding_tags.append(tag)
 
-        self.hdf_writer = SimpleHDFWriter(
+        self.hdf_writer = BufferedHDFWriter(
             tk.uncached_path(self.out), dim=self.speaker_embedding_features[0].shape[-1]
         )
 
@@ -359,37 +350,26 @@ class SingularizeHDFPerSpeakerJob(Job):
 
     def run(self):
 
-        hdf_data = h5py.File(self.hdf_file.get_path(), "r")
-
-        inputs = hdf_data["inputs"]
-        raw_tags = hdf_data["seqTags"]
-        lengths = hdf_data["seqLengths"]
-
         bliss = corpus.Corpus()
         bliss.load(self.speaker_bliss.get_path())
 
         num_speakers = len(bliss.speakers)
-        tag_to_value = {}
-
-        offset = 0
-        dim = inputs[0 : lengths[0][0]][0].shape[-1]
-        for tag, length in zip(raw_tags, lengths):
-            tag_to_value[tag] = inputs[offset : offset + length[0]]
-            offset += length[0]
 
         index_to_value = {}
-        for recording in bliss.all_recordings():
-            for segment in recording.segments:
-                speaker_name = segment.speaker_name or recording.speaker_name
-                # not only check that we already have the speaker but also that we handle a bigger corpus (e.g.
-                # embeddings of dev but got the full corpus
-                if (
-                    speaker_name not in index_to_value.keys()
-                    and segment.fullname() in tag_to_value.keys()
-                ):
-                    index_to_value[speaker_name] = tag_to_value[segment.fullname()]
-            if len(index_to_value) == num_speakers:
-                break
+        with HDFSequenceReader(self.hdf_file.get_path()) as reader:
+            dim = reader.get_by_index(0).shape[-1]
+            for recording in bliss.all_recordings():
+                for segment in recording.segments:
+                    speaker_name = segment.speaker_name or recording.speaker_name
+                    # not only check that we already have the speaker but also that we handle a bigger corpus (e.g.
+                    # embeddings of dev but got the full corpus
+                    if (
+                        speaker_name not in index_to_value.keys()
+                        and segment.fullname() in reader
+                    ):
+                        index_to_value[speaker_name] = reader[segment.fullname()]
+                if len(index_to_value) == num_speakers:
+                    break
 
         hdf_writer = SimpleHDFWriter(self.out_hdf.get_path(), dim=dim)
 
@@ -423,30 +403,19 @@ class DistributeHDFByMappingJob(Job):
         yield Task("run", mini_task=True)
 
     def run(self):
-        hdf_data = h5py.File(self.hdf_file.get_path(), "r")
-
-        inputs = hdf_data["inputs"]
-        raw_tags = list(hdf_data["seqTags"])
-        lengths = hdf_data["seqLengths"]
-
         with open(self.mapping.get_path(), "rb") as f:
             mapping = pickle.load(f)  # type: Dict
 
-        tag_to_value = {}
-        tag_to_length = {}
-        offset = 0
-        dim = inputs[0 : lengths[0][0]][0].shape[-1]
-        # reconstruct hdf dict to distribute better in case length is not 1
-        for tag, length in zip(raw_tags, lengths):
-            tag_to_value[tag] = inputs[offset : offset + length[0]]
-            tag_to_length[tag] = length[0]
-            offset += length[0]
+        with HDFSequenceReader(self.hdf_file.get_path()) as reader:
+            dim = reader.get_by_index(0).shape[-1]
+            # each value is read once, also if many segments map to it
+            index_to_value = {index: reader[index] for index in set(mapping.values())}
 
         hdf_writer = SimpleHDFWriter(self.out_hdf.get_path(), dim=dim, ndim=2)
         for segment_tag, index in mapping.items():
             hdf_writer.insert_batch(
-                numpy.asarray([tag_to_value[index]]),
-                [tag_to_length[index]],
+                numpy.asarray([index_to_value[index]]),
+                [len(index_to_value[index])],
                 [segment_tag],
             )
         hdf_writer.close()
@@ -474,28 +443,11 @@ class AverageF0OverDurationJob(Job):
 
     def run(self):
 
-        f0_data = h5py.File(self.f0.get_path(), "r")
-        f0_inputs = f0_data["inputs"]
-        f0_raw_tags = f0_data["seqTags"]
-        f0_lengths = f0_data["seqLengths"]
-        f0_tag_to_value = {}
-        f0_tag_to_len = {}
-        offset = 0
-        for tag, length in zip(f0_raw_tags, f0_lengths):
-            f0_tag_to_value[tag.decode()] = f0_inputs[offset : offset + length[0]]
-            f0_tag_to_len[tag.decode()] = length[0]
-            offset += length[0]
-
-        duration_data = h5py.File(self.duration.get_path(), "r")
-        dur_inputs = duration_data["inputs"]
-        dur_raw_tags = duration_data["seqTags"]
-        dur_lengths = duration_data["seqLengths"]
-
-        dur_tag_to_value = {}
-        offset = 0
-        for tag, length in zip(dur_raw_tags, dur_lengths):
-            dur_tag_to_value[tag] = dur_inputs[offset : offset + length[0]]
-            offset += length[0]
+        with HDFSequenceReader(self.f0.get_path()) as reader:
+            f0_tag_to_value = dict(reader.iter_sequences())
+
+        with HDFSequenceReader(self.duration.get_path()) as reader:
+            dur_tag_to_value = dict(reader.iter_sequences())
 
         avrg_dur_tag_to_value = {}
         if self.phoneme_level:
@@ -1,8 +1,7 @@
 import numpy
 from sisyphus import tk, Job, Task
-from i6_private.users.rossenbach.lib.hdf import SimpleHDFWriter
-import h5py
-import sys
+from i6_experiments.users.rossenbach.lib.durations import viterbi_to_durations
+from i6_experiments.users.rossenbach.lib.hdf import BufferedHDFWriter, HDFSequenceReader
 
 
 class ViterbiToDurationsJob(Job):
@@ -28,90 +27,25 @@ class ViterbiToDurationsJob(Job):
     yield Task("run", rqmt=self.rqmt)
 
   def run(self):
-    # Load HDF data
-    input_dur_data = h5py.File(self.align.get_path(), "r")
-    num_seqs = -1
-    inputs = input_dur_data["inputs"]
-    seq_tags = input_dur_data["seqTags"]
-    lengths = input_dur_data["seqLengths"]
-    alignment, tags = self.load_normal_data(inputs, seq_tags, lengths, num_seqs)
+    # sequences are read in contiguous chunks, only the lengths of the dataset to check are needed
+    check = HDFSequenceReader(self.check.get_path()) if self.check is not None else None
 
-    durations_total = []
-
-    # sort based on tags
-    if self.check is not None:
-      check, check_tag = self.load_spect_data(self.check)
-
-    # Alignemnt to duration conversion
-    for alignment_idx, s in enumerate(alignment):
-      durations = []
-      for idx, p in enumerate(s):
+    # Alignment to duration conversion, directly dumped into the HDF
+    writer = BufferedHDFWriter(self.out_durations_hdf.get_path(), dim=1, ndim=2)
+    with HDFSequenceReader(self.align.get_path()) as alignment:
+      for alignment_idx, (tag, s) in enumerate(alignment.iter_sequences()):
         # Skip_token only appears now if 2 labels following each other are the same.
         #   Example [1,skip_token,1] -> [1,1]
-        if p == self.skip_token:
-          durations[-1] += 1
-          continue
-        if idx != 0 and s[idx] != s[idx - 1]:
-          durations.append(1)
-        elif idx != 0 and s[idx] == s[idx - 1]:
-          durations[-1] += 1
-        else:
-          durations.append(1)
-      # Check if lengths match if dataset is provided
-      if self.check is not None:
-        assert sum(durations) == len(check[alignment_idx]), (
-          f"durations {sum(durations)} and spectrogram length {len(check[alignment_idx])}"
-          f"do not match in length "
-        )
-      durations_total.append(durations)
-
-    # Dump into HDF
-    new_lengths = []
-    for seq in durations_total:
-      new_lengths.append([len(seq), 2, 2])
-    duration_sequence = numpy.hstack(durations_total).astype(numpy.int32)
-    dim = 1
-    writer = SimpleHDFWriter(self.out_durations_hdf.get_path(), dim=dim, ndim=2)
-    offset = 0
-    for tag, length in zip(tags, new_lengths):
-      in_data = duration_sequence[offset : offset + length[0]]
-      in_data = numpy.expand_dims(in_data, axis=1)
-      offset += length[0]
-      writer.insert_batch(numpy.asarray([in_data]), [in_data.shape[0]], [tag])
+        durations = viterbi_to_durations(s, self.skip_token)
+        # Check if lengths match if dataset is provided
+        if check is not None:
+          assert sum(durations) == check.lengths[alignment_idx], (
+            f"durations {sum(durations)} and spectrogram length {check.lengths[alignment_idx]}"
+            f"do not match in length "
+          )
+        in_data = numpy.expand_dims(durations, axis=1)
+        writer.insert_batch(numpy.asarray([in_data]), [in_data.shape[0]], [tag])
+    if check is not None:
+      check.close()
     print(f"Succesfully converted durations into {(self.out_durations_hdf.get_path())}")
     writer.close()
-
-  def load_normal_data(self, inputs, seq_tags, lengths, num_seqs):
-    sequences = []
-    tags = []
-    offset = 0
-    for tag, length in zip(seq_tags, lengths):
-      tag = tag if isinstance(tag, str) else tag.decode()
-      in_data = inputs[offset : offset + length[0]]
-      sequences.append(in_data)
-      offset += length[0]
-      tags.append(tag)
-      if len(sequences) == num_seqs:
-        break
-    return numpy.array(sequences), tags
-
-  def load_spect_data(self, input_path):
-    input_data = h5py.File(input_path.get_path(), "r")
-    num_seqs = -1
-    offset = 0
-    inputs = input_data["inputs"]
-    seq_tags = input_data["seqTags"]
-    lengths = input_data["seqLengths"]
-
-    # Load spectrogram data
-    data_seq = []
-    data_tag = []
-    for tag, length in zip(seq_tags, lengths):
-      tag = tag if isinstance(tag, str) else tag.decode()
-      in_data = inputs[offset : offset + length[0]]
-      data_seq.append(in_data)
-      offset += length[0]
-      data_tag.append(tag)
-      if len(data_seq) == num_seqs:
-        break
-    return numpy.array(data_seq), data_tag
@@ -90,17 +90,17 @@ def get_alignments(fpath):
 
 def get_segment_string(alignments):
     border_indicator = "flow-attribute"
-    segment_string = ""
+    segment_string = []
     for alignment in alignments:
         with open(alignment, 'r', encoding='latin-1') as file:
             for line in file:
                 if border_indicator in line:
-                    segment_string += "s"
+                    segment_string.append("s")
                 if "[SILENCE]" in line:
-                    segment_string += "0"
+                    segment_string.append("0")
                 elif border_indicator not in line:
-                    segment_string += "1"
-    return segment_string
+                    segment_string.append("1")
+    return "".join(segment_string)
 
 
 def compute_stats(segment_string, normalization='segment'):
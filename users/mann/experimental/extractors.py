@@ -22,6 +22,8 @@ import i6_core.lib.lexicon as lexicon
 import i6_core.util as util
 from i6_core.corpus.filter import FilterSegmentsByListJob
 
+from i6_experiments.users.berger.recipe.lexicon.index import LexiconIndex
+
 class ExtractHost(Job):
 
     def __init__(self, data, log_file_name='log.run.1', 
@@ -272,18 +274,11 @@ class TransformLexicon(Job):
         out_lex = lexicon.Lexicon()
         for phon, var in lex.phonemes.items():
             out_lex.add_phoneme(transform(phon), var)
-        for lemma in lex.lemma:
-            # lemma.orth = list(map(transform, lemma.orth))
-            phon = []
-            for p in lemma.phon:
-                p.content = transform_lex(p.content)
-                if all(ph.content != p.content for ph in phon):
-                    phon.append(p)
-            # lemma.phon = list(map(transform_lex, lemma.phon))
-            lemma.phon = phon
-
-            out_lex.add_lemma(lemma)
-        root = out_lex.to_xml()
+        out_lex.lemmata = lex.lemmata
+        # transforms every pronunciation once and merges the ones that became identical
+        index = LexiconIndex(out_lex)
+        index.map_pronunciations(transform_lex)
+        root = index.finalize().to_xml()
         with util.uopen(self.out_lexicon, 'wt', encoding='utf-8') as f:
             xmlstr = minidom.parseString(ET.tostring(root)).toprettyxml(indent="  ")
             f.write(xmlstr)
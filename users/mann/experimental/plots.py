@@ -1,7 +1,10 @@
 from sisyphus import Job, Task, tk
 
+import multiprocessing
+import multiprocessing.util
+import pickle
 import numpy as np
-from typing import List
+from typing import Dict, List, Optional
 import matplotlib
 matplotlib.use("Agg")
 import matplotlib.pyplot as plt
@@ -129,6 +132,65 @@ class AllophoneSequencer:
             ]
         return allo_seq
 
+def build_hdf_seq_index(hdf_path: str) -> Dict[str, Tuple[int, int]]:
+    """
+    :return: seqTag -> (frame offset, length) of every sequence in a RETURNN HDF file
+    """
+    import h5py
+    with h5py.File(hdf_path, "r") as f:
+        tags = [tag.decode("utf-8") if isinstance(tag, bytes) else tag for tag in f["seqTags"][...]]
+        lengths = f["seqLengths"][...]
+    if lengths.ndim == 2:
+        lengths = lengths[:, 0]
+    offsets = np.cumsum(lengths) - lengths
+    return {tag: (int(offset), int(length)) for tag, offset, length in zip(tags, offsets, lengths)}
+
+
+class HDFSeqIndexJob(Job):
+    """
+    Builds the seqTag -> (offset, length) index of a RETURNN HDF file once,
+    such that jobs which only read a few sequences of a large dump don't need a full pass over the file.
+    """
+
+    def __init__(self, hdf: tk.Path):
+        self.hdf = hdf
+        self.out_index = self.output_path("seq_index.pkl")
+
+    def tasks(self):
+        yield Task("run", mini_task=True)
+
+    def run(self):
+        with open(self.out_index.get_path(), "wb") as f:
+            pickle.dump(build_hdf_seq_index(self.hdf.get_path()), f)
+
+
+_worker_state = None
+
+
+def _init_plot_worker(job, allophones_path, alignment_path):
+    global _worker_state
+    import h5py
+    alignments = rc.open_file_archive(alignment_path)
+    alignments.setAllophones(allophones_path)
+    _worker_state = job, alignments, h5py.File(job.dumps.get_path(), "r")
+    # runs when a pool worker exits normally, i.e. after pool.close() and pool.join()
+    multiprocessing.util.Finalize(None, _close_plot_worker, exitpriority=10)
+
+
+def _close_plot_worker():
+    global _worker_state
+    if _worker_state is not None:
+        _worker_state[2].close()
+        _worker_state = None
+
+
+def _plot_segment(args):
+    job, alignments, dumps = _worker_state
+    seq_tag, offset, length, state_tying_dict = args
+    job.plot_segment(alignments, dumps["inputs"][offset:offset + length], seq_tag, state_tying_dict)
+    return seq_tag
+
+
 class PlotSoftAlignmentJob(Job):
     __sis_hash_exclude__ = { "hmm_partition": 3 }
 
@@ -142,7 +204,14 @@ class PlotSoftAlignmentJob(Job):
         occurrence_thresholds: float,
         segments: List[str],
         hmm_partition: int=3,
+        seq_index: Optional[tk.Path]=None,
+        num_workers: int=1,
     ):
+        """
+        :param seq_index: seqTag -> (offset, length) of the dumps, from :class:`HDFSeqIndexJob`,
+            otherwise the index is built from the seqLengths of the dumps
+        :param num_workers: number of processes which render the segments
+        """
         self.dumps = dumps
         self.alignment = alignment
         self.allophones = allophones
@@ -152,6 +221,8 @@ class PlotSoftAlignmentJob(Job):
         # self.bliss_corpus = bliss_corpus
         self.state_tying = state_tying
         self.hmm_partition = hmm_partition
+        self.seq_index = seq_index
+        self.num_workers = num_workers
 
         self.out_plots = {
             segment: self.output_path('plot.{}.png'.format(segment.replace("/", "_")))
@@ -163,53 +234,72 @@ class PlotSoftAlignmentJob(Job):
             for segment in segments
         }
     
+    @classmethod
+    def hash(cls, kwargs):
+        # the index and the number of workers don't change the plots
+        kwargs = {k: v for k, v in kwargs.items() if k not in ("seq_index", "num_workers")}
+        return super().hash(kwargs)
+
     def tasks(self):
-        yield Task("run", mini_task=True)
+        yield Task("run", rqmt={"cpu": self.num_workers, "mem": 4, "time": 1}, mini_task=self.num_workers == 1)
     
     def run(self):
-        # init alignment
-        alignments = rc.open_file_archive(self.alignment.get_path())
-        alignments.setAllophones(self.allophones.get_path())
-
         state_tying_dict = {}
         with open(self.state_tying.get_path(), "r") as f:
             for line in f:
                 allo_str, idx_str = line.split(" ")
                 state_tying_dict[allo_str] = int(idx_str)
-            
-        # init dumps
-        import h5py
-        with h5py.File(self.dumps.get_path(), 'r') as f:
-            end = 0
-            for seq_tag, (seq_length, _) in zip(f["seqTags"], f["seqLengths"]):
-                end += seq_length
-                seq_tag = seq_tag.decode("utf-8")
-                print(seq_tag)
-                if self.segments is not None and seq_tag not in self.segments:
-                    continue
-                begin = end - seq_length
-                bw_scores = f["inputs"][begin:end]
-                allophone_sequence, aligned_labels = self.get_allophones(alignments, seq_tag)
-                label_sequence = self.get_label_sequence(allophone_sequence, state_tying_dict)
-                bw_image = self.make_bw_image(
-                    bw_scores,
-                    allophone_sequence,
-                    label_sequence,
-                )
-                viterbi_image = self.make_viterbi_image(
-                    aligned_labels,
-                )
 
-                self.plot(
-                    bw_image,
-                    viterbi_image,
-                    allophone_sequence,
-                    seq_tag,
-                )
+        if self.seq_index is not None:
+            with open(self.seq_index.get_path(), "rb") as f:
+                seq_index = pickle.load(f)
+        else:
+            seq_index = build_hdf_seq_index(self.dumps.get_path())
+        segments = [seq_tag for seq_tag in self.segments if seq_tag in seq_index]
+        for seq_tag in self.segments:
+            if seq_tag not in seq_index:
+                print("Segment {} is not in the dumps, skipped".format(seq_tag))
+        args = [(seq_tag, *seq_index[seq_tag], state_tying_dict) for seq_tag in segments]
+
+        init_args = (self, self.allophones.get_path(), self.alignment.get_path())
+        if self.num_workers > 1 and len(args) > 1:
+            with multiprocessing.Pool(min(self.num_workers, len(args)), initializer=_init_plot_worker, initargs=init_args) as pool:
+                for seq_tag in pool.imap_unordered(_plot_segment, args):
+                    print(seq_tag)
+                # let the workers exit normally, such that they close their files
+                pool.close()
+                pool.join()
+        else:
+            _init_plot_worker(*init_args)
+            try:
+                for seq_tag in map(_plot_segment, args):
+                    print(seq_tag)
+            finally:
+                _close_plot_worker()
+
+    def plot_segment(self, alignments, bw_scores, seq_tag, state_tying_dict):
+        allophone_sequence, aligned_labels = self.get_allophones(alignments, seq_tag)
+        label_sequence = self.get_label_sequence(allophone_sequence, state_tying_dict)
+        bw_image = self.make_bw_image(
+            bw_scores,
+            allophone_sequence,
+            label_sequence,
+        )
+        viterbi_image = self.make_viterbi_image(
+            aligned_labels,
+        )
+
+        self.plot(
+            bw_image,
+            viterbi_image,
+            allophone_sequence,
+            seq_tag,
+        )
 
-                plt.figure()
-                plt.imshow(bw_scores.T)
-                plt.savefig(self.out_plots_raw[seq_tag].get_path())
+        fig = plt.figure()
+        plt.imshow(bw_scores.T)
+        fig.savefig(self.out_plots_raw[seq_tag].get_path())
+        plt.close(fig)
     
     def get_allophones(self, alignments, seq_tag) -> List[str]:
         """Code due to Simon Berger."""
@@ -316,6 +406,7 @@ class PlotSoftAlignmentJob(Job):
 
             ax.imshow(image, cmap="Blues", interpolation="nearest", aspect="auto", origin="lower")
         fig.savefig(self.out_plots[seq_tag].get_path())
+        plt.close(fig)
 
 
     @staticmethod
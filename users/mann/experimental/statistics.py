@@ -2,6 +2,8 @@ from sisyphus import *
 
 import sys, os
 import subprocess
+import time
+import numpy as np
 import matplotlib.pyplot as plt
 from itertools import filterfalse
 from tabulate import tabulate
@@ -119,6 +121,134 @@ class ContextualSilenceCounter:
             if self.word_end_count > 0:
                 self.word_end_count -= 1
 
+class AllophoneProperties:
+    """Silence, word-initial and word-final flags indexed by allophone id.
+
+    Ids are assigned in insertion order, so a table built from the allophone
+    list of a RASR cache uses the mixture indices of that cache as ids.
+    """
+    def __init__(self, allophones=()):
+        self.index = {}
+        self.silence = []
+        self.initial = []
+        self.final = []
+        self._arrays = None
+        for allo in allophones:
+            self.add(allo)
+
+    def add(self, allo):
+        idx = len(self.silence)
+        self.index.setdefault(allo, idx)
+        self.silence.append(ContextualSilenceCounter.is_silence(allo))
+        self.initial.append(ContextualSilenceCounter.is_lemma_start(allo))
+        self.final.append("@f" in allo)
+        self._arrays = None
+        return idx
+
+    def get_id(self, allo):
+        idx = self.index.get(allo)
+        if idx is None:
+            idx = self.add(allo)
+        return idx
+
+    def arrays(self):
+        if self._arrays is None:
+            self._arrays = tuple(
+                np.array(flags, dtype=bool)
+                for flags in (self.silence, self.initial, self.final)
+            )
+        return self._arrays
+
+
+class SegmentAlignment:
+    """Array representation of the alignment of a single segment."""
+    def __init__(self, allophone_ids, states, properties):
+        self.allophone_ids = np.asarray(allophone_ids, dtype=np.int64)
+        self.states = np.asarray(states, dtype=np.int64)
+        silence, initial, final = properties.arrays()
+        self.silence = silence[self.allophone_ids]
+        self.word_start = initial[self.allophone_ids]
+        self.speech_end = final[self.allophone_ids] & ~self.silence
+
+    @classmethod
+    def from_pairs(cls, pairs, properties):
+        ids = [properties.get_id(allo) for allo, _ in pairs]
+        states = [state for _, state in pairs]
+        return cls(ids, states, properties)
+
+    def __len__(self):
+        return len(self.allophone_ids)
+
+    def silence_runs(self):
+        """Lengths of all silence runs, same as SilenceCounter.counts."""
+        edges = np.diff(np.concatenate(([0], self.silence.view(np.int8), [0])))
+        return np.flatnonzero(edges == -1) - np.flatnonzero(edges == 1)
+
+    def word_transitions(self):
+        """Silence insertions and word transitions after a speech word end,
+        same as ContextualSilenceCounter including maybe_remove_last."""
+        after_word_end = self.speech_end[:-1]
+        sil_count = int(np.count_nonzero(after_word_end & self.silence[1:]))
+        word_end_count = int(np.count_nonzero(after_word_end & self.word_start[1:]))
+        if len(self) > 0 and self.silence[-1]:
+            sil_count = max(sil_count - 1, 0)
+            word_end_count = max(word_end_count - 1, 0)
+        return sil_count, word_end_count
+
+
+class AlignmentStatistics:
+    """Accumulates the statistics of AlignmentStatisticsJob,
+    SilenceAtSegmentBoundaries, PositionalSilenceCounter and
+    SilenceBetweenWords in a single pass over SegmentAlignment objects."""
+    def __init__(self):
+        self.counts = defaultdict(int)
+
+    def feed(self, segment):
+        c = self.counts
+        c["total"] += 1
+        c["total_states"] += len(segment)
+        if len(segment) == 0:
+            return
+        c["start"] += int(segment.silence[0])
+        c["end"] += int(segment.silence[-1])
+
+        runs = segment.silence_runs()
+        if len(runs) > 0:
+            c["prepended_silence"] += int(runs[0])
+            c["appended_silence"] += int(runs[-1])
+            c["total_silence"] += int(runs.sum())
+            c["start_loops"] += int(runs[0]) - 1
+            c["end_loops"] += int(runs[-1]) - 1
+            c["inner_loops"] += int(runs[1:-1].sum()) - len(runs) + 2
+            c["inner_count"] += len(runs) - 2
+            c["seg_count"] += 1
+
+        sil_count, word_end_count = segment.word_transitions()
+        c["silence_insertions"] += sil_count
+        c["word_transitions"] += word_end_count
+
+    @staticmethod
+    def normalize(counter):
+        def ratio(a, b):
+            return counter[a] / counter[b] if counter[b] else float("nan")
+        return {
+            "silence": {
+                key: counter[key] for key in
+                ["prepended_silence", "appended_silence", "total_silence", "total_states"]
+            },
+            "boundaries": {
+                "start": ratio("start", "total"),
+                "end": ratio("end", "total"),
+                "total": counter["total"],
+            },
+            "positional": {
+                "start_loops": ratio("start_loops", "seg_count"),
+                "end_loops": ratio("end_loops", "seg_count"),
+                "inner_loops": ratio("inner_loops", "inner_count"),
+            },
+            "silence_between_words": ratio("silence_insertions", "word_transitions"),
+        }
+
 def resolve_bundle(alignment):
     if not isinstance(alignment, (str, tk.Path)):
         return alignment
@@ -126,14 +256,77 @@ def resolve_bundle(alignment):
         alignment = {i: line.rstrip("\n") for i, line in enumerate(f, 1)}
     return alignment
 
+def read_segment_list(segment_path):
+    with open(segment_path, "r") as segment_file:
+        return [seg.rstrip("\n") for seg in segment_file]
+
+def run_archiver(exe, allophones, alignment, segment):
+    args = [exe,
+            '--allophone-file', allophones,
+            '--mode', 'show',
+            '--type', 'align',
+            alignment, segment]
+    res = subprocess.run(args,
+                        stdout=subprocess.PIPE)
+    return res.stdout.decode('utf-8').split('\n')
+
+def archiver_alignments(exe, allophones, alignment_path, segments):
+    """Yields the (allophone, state) sequence of each segment by running
+    the RASR archiver once per segment and parsing its text output."""
+    for seg in segments:
+        lines = run_archiver(exe, allophones, alignment_path, seg)
+        yield list(allophone_and_state_generator(lines))
+
+def cache_alignments(allophones, alignment_path, segments):
+    """Yields the (allophone, state) sequence of each segment by reading
+    the alignment cache in-process. The archive index is read only once."""
+    archive = sc.FileArchive(alignment_path)
+    archive.setAllophones(allophones)
+    for seg in segments:
+        if seg not in archive.ft:
+            # the archiver prints nothing for unknown segments
+            yield []
+            continue
+        yield [
+            (archive.allophones[mix], state)
+            for _, mix, state, _ in archive.read(seg, "align")
+        ]
+
+def cache_alignment_arrays(allophones, alignment_path, segments):
+    """Yields a SegmentAlignment for each segment of an alignment cache
+    without going through allophone strings."""
+    archive = sc.FileArchive(alignment_path)
+    archive.setAllophones(allophones)
+    properties = AllophoneProperties(archive.allophones)
+    for seg in segments:
+        if seg not in archive.ft:
+            yield SegmentAlignment([], [], properties)
+            continue
+        alignment = archive.read(seg, "align")
+        yield SegmentAlignment(
+            [mix for _, mix, _, _ in alignment],
+            [state for _, _, state, _ in alignment],
+            properties,
+        )
+
 class AlignmentStatisticsJob(Job):
+    """
+    Base class for statistics over RASR alignment caches.
 
-    def __init__(self, alignment, allophones, segments, concurrent, archiver_exe=None):
+    With reader="archiver" every segment is dumped by a separate call to the
+    RASR archiver, with reader="rasr_cache" the caches are decoded in-process.
+    Both readers yield the same allophone and state sequences, therefore the
+    reader does not enter the hash.
+    """
+
+    def __init__(self, alignment, allophones, segments, concurrent, archiver_exe=None, reader="archiver"):
+        assert reader in ["archiver", "rasr_cache"]
         # self.csp = csp
         self.alignment = alignment
         self.allophones = allophones
         self.segments = segments
         self.concurrent = concurrent
+        self.reader = reader
 
         self.exe = RasrCommand.select_exe(archiver_exe, "archiver")
         self.single_counts = {i: self.output_var("single_counts.{}".format(i)) for i in range(1, self.concurrent + 1)}
@@ -144,40 +337,50 @@ class AlignmentStatisticsJob(Job):
                     'gpu' : 0,
                     'mem' : 1}
 
+    @classmethod
+    def hash(cls, kwargs):
+        d = dict(kwargs)
+        d.pop("reader", None)
+        return super().hash(d)
+
     def tasks(self):
         yield Task('run', resume='run', rqmt=self.rqmt, args=range(1, self.concurrent + 1))
         yield Task('gather', resume='gather', mini_task=True)
     
     def archive(self, alignment, segment):
-        args = [self.exe,
-                '--allophone-file',
-                tk.uncached_path(self.allophones),
-                '--mode', 'show',
-                '--type', 'align',
-                alignment, segment]
-        res = subprocess.run(args,
-                            stdout=subprocess.PIPE)
-        lines = res.stdout.decode('utf-8').split('\n')
-        return lines
-    
+        return run_archiver(self.exe, tk.uncached_path(self.allophones), alignment, segment)
 
-    def run(self, task_id):
+    def segment_alignments(self, task_id):
+        """Yields the list of (allophone, state) pairs for every segment of the task."""
         alignment_path = tk.uncached_path(resolve_bundle(self.alignment)[task_id])
-        segment_path = tk.uncached_path(self.segments[task_id])
+        segments = read_segment_list(tk.uncached_path(self.segments[task_id]))
+        allophones = tk.uncached_path(self.allophones)
+        if self.reader == "rasr_cache":
+            return cache_alignments(allophones, alignment_path, segments)
+        return archiver_alignments(self.exe, allophones, alignment_path, segments)
+
+    def segment_arrays(self, task_id):
+        """Same as segment_alignments, but yields SegmentAlignment objects."""
+        if self.reader == "rasr_cache":
+            alignment_path = tk.uncached_path(resolve_bundle(self.alignment)[task_id])
+            segments = read_segment_list(tk.uncached_path(self.segments[task_id]))
+            yield from cache_alignment_arrays(tk.uncached_path(self.allophones), alignment_path, segments)
+            return
+        properties = AllophoneProperties()
+        for alignment in self.segment_alignments(task_id):
+            yield SegmentAlignment.from_pairs(alignment, properties)
 
+    def run(self, task_id):
         silence_counts = []
         state_count = 0
 
-        with open(segment_path, "r") as segment_file:
-            for seg in segment_file:
-                lines = self.archive(alignment_path, seg.rstrip("\n"))
+        for alignment in self.segment_alignments(task_id):
+            sil_counter = SilenceCounter()
+            for allo, state in alignment:
+                sil_counter.feed(allo)
+                state_count += 1
 
-                sil_counter = SilenceCounter()
-                for allo, state in allophone_and_state_generator(lines):
-                    sil_counter.feed(allo)
-                    state_count += 1
-
-                silence_counts.append(sil_counter.counts)
+            silence_counts.append(sil_counter.counts)
         
         res = dict(
             prepended_silence = sum(c[0] for c in silence_counts if len(c) > 0),
@@ -199,26 +402,18 @@ class AlignmentStatisticsJob(Job):
 class SilenceAtSegmentBoundaries(AlignmentStatisticsJob):
 
     def run(self, task_id):
-        alignment_path = tk.uncached_path(resolve_bundle(self.alignment)[task_id])
-        segment_path = tk.uncached_path(self.segments[task_id])
-
         silence_counts = defaultdict(int)
 
-        with open(segment_path, "r") as segment_file:
-            for seg in segment_file:
-                lines = self.archive(alignment_path, seg.rstrip("\n"))
-
-                allo_gen = StateParser(lines)
-                
-                first_allo, _ = next(allo_gen)
-                if "#" in first_allo:
-                    silence_counts["start"] += 1
-                
-                last_allo, _ = next(reversed(allo_gen))
-                if "#" in last_allo:
-                    silence_counts["end"] += 1
+        for alignment in self.segment_alignments(task_id):
+            first_allo, _ = alignment[0]
+            if "#" in first_allo:
+                silence_counts["start"] += 1
+            
+            last_allo, _ = alignment[-1]
+            if "#" in last_allo:
+                silence_counts["end"] += 1
 
-                silence_counts["total"] += 1
+            silence_counts["total"] += 1
         
         self.single_counts[task_id].set(dict(silence_counts))
     
@@ -240,20 +435,14 @@ class SilenceAtSegmentBoundaries(AlignmentStatisticsJob):
 class PositionalSilenceCounter(AlignmentStatisticsJob):
 
     def run(self, task_id):
-        alignment_path = tk.uncached_path(resolve_bundle(self.alignment)[task_id])
-        segment_path = tk.uncached_path(self.segments[task_id])
-
         silence_counts = []
 
-        with open(segment_path, "r") as segment_file:
-            for seg in segment_file:
-                lines = self.archive(alignment_path, seg.rstrip("\n"))
+        for alignment in self.segment_alignments(task_id):
+            sil_counter = SilenceCounter()
+            for allo, state in alignment:
+                sil_counter.feed(allo)
 
-                sil_counter = SilenceCounter()
-                for allo, state in allophone_and_state_generator(lines):
-                    sil_counter.feed(allo)
-
-                silence_counts.append(sil_counter.counts)
+            silence_counts.append(sil_counter.counts)
         
         res = dict(
             start_loops = sum(c[0] - 1 for c in silence_counts),
@@ -282,22 +471,16 @@ class PositionalSilenceCounter(AlignmentStatisticsJob):
 class SilenceBetweenWords(AlignmentStatisticsJob):
 
     def run(self, task_id):
-        alignment_path = tk.uncached_path(resolve_bundle(self.alignment)[task_id])
-        segment_path = tk.uncached_path(self.segments[task_id])
-
         silence_counts = defaultdict(int)
 
-        with open(segment_path, "r") as segment_file:
-            for seg in segment_file:
-                lines = self.archive(alignment_path, seg.rstrip("\n"))
+        for alignment in self.segment_alignments(task_id):
+            sil_counter = ContextualSilenceCounter()
+            for allo, state in alignment:
+                sil_counter.feed(allo)
+            sil_counter.maybe_remove_last()
 
-                sil_counter = ContextualSilenceCounter()
-                for allo, state in allophone_and_state_generator(lines):
-                    sil_counter.feed(allo)
-                sil_counter.maybe_remove_last()
-
-                silence_counts["silence_insertions"] += sil_counter.sil_count
-                silence_counts["word_transitions"]   += sil_counter.word_end_count
+            silence_counts["silence_insertions"] += sil_counter.sil_count
+            silence_counts["word_transitions"]   += sil_counter.word_end_count
         
         self.single_counts[task_id].set(
             dict(silence_counts)
@@ -312,6 +495,70 @@ class SilenceBetweenWords(AlignmentStatisticsJob):
         # normalize
         self.counts.set(counter["silence_insertions"] / counter["word_transitions"])
 
+
+class CombinedAlignmentStatisticsJob(AlignmentStatisticsJob):
+    """
+    Computes the statistics of AlignmentStatisticsJob, SilenceAtSegmentBoundaries,
+    PositionalSilenceCounter and SilenceBetweenWords in one pass over the alignment.
+    Segments without any silence do not enter the positional statistics.
+    """
+
+    def run(self, task_id):
+        stats = AlignmentStatistics()
+        for segment in self.segment_arrays(task_id):
+            stats.feed(segment)
+        self.single_counts[task_id].set(dict(stats.counts))
+
+    def gather(self):
+        counter = defaultdict(int)
+        for i in range(1, self.concurrent + 1):
+            cs = self.single_counts[i].get()
+            for key, value in cs.items():
+                counter[key] += value
+        self.counts.set(AlignmentStatistics.normalize(counter))
+
+
+class AlignmentReaderBenchmarkJob(Job):
+    """
+    Compares the archiver based and the in-process alignment reader
+    on one alignment cache. Reports wall time, segments per second and
+    whether both readers produce identical (allophone, state) sequences.
+    """
+
+    def __init__(self, alignment_cache, allophones, segments, archiver_exe=None):
+        self.alignment_cache = alignment_cache
+        self.allophones = allophones
+        self.segments = segments
+        self.exe = RasrCommand.select_exe(archiver_exe, "archiver")
+
+        self.report = self.output_var("report")
+
+    def tasks(self):
+        yield Task('run', mini_task=True)
+
+    def run(self):
+        alignment_path = tk.uncached_path(self.alignment_cache)
+        allophones = tk.uncached_path(self.allophones)
+        segments = read_segment_list(tk.uncached_path(self.segments))
+
+        readers = {
+            "archiver": lambda: archiver_alignments(self.exe, allophones, alignment_path, segments),
+            "rasr_cache": lambda: cache_alignments(allophones, alignment_path, segments),
+        }
+        alignments = {}
+        report = {"segments": len(segments)}
+        for name, reader in readers.items():
+            start = time.monotonic()
+            alignments[name] = list(reader())
+            elapsed = time.monotonic() - start
+            report[name] = {
+                "seconds": elapsed,
+                "segments_per_second": len(segments) / elapsed if elapsed > 0 else float("inf"),
+            }
+        report["speedup"] = report["archiver"]["seconds"] / max(report["rasr_cache"]["seconds"], 1e-9)
+        report["identical"] = alignments["archiver"] == alignments["rasr_cache"]
+        self.report.set(report)
+
 class AllophoneSequencer:
     def __init__(self, corpus, lexicon, state_tying, hmm_partition):
         self.corpus = corpus
@@ -389,9 +636,10 @@ class SkipCountsJob(AlignmentStatisticsJob):
         corpus,
         lexicon,
         concurrent,
-        archiver_exe=None
+        archiver_exe=None,
+        reader="archiver",
     ):
-        super().__init__(alignment, allophones, segments, concurrent, archiver_exe)
+        super().__init__(alignment, allophones, segments, concurrent, archiver_exe, reader)
         self.lexicon = lexicon
         self.corpus = corpus
     
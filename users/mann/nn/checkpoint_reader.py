@@ -0,0 +1,252 @@
+"""
+Reads tensors directly from the binary files of a TensorFlow checkpoint (tensor bundle format),
+without TensorFlow and without GPU.
+
+A checkpoint ``prefix`` consists of ``prefix.index``, an SSTable which maps every tensor name to its dtype, shape
+and location, and the data shards ``prefix.data-0000x-of-0000n``, which contain the raw little endian tensor data.
+"""
+
+import os
+import struct
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+
+_TABLE_MAGIC = 0xDB4775248B80FB57
+_FOOTER_SIZE = 48
+_BLOCK_TRAILER_SIZE = 5
+
+# tensorflow DataType enum -> numpy dtype
+_DTYPES = {
+    1: np.dtype("<f4"),  # DT_FLOAT
+    2: np.dtype("<f8"),  # DT_DOUBLE
+    3: np.dtype("<i4"),  # DT_INT32
+    4: np.dtype("u1"),  # DT_UINT8
+    5: np.dtype("<i2"),  # DT_INT16
+    6: np.dtype("i1"),  # DT_INT8
+    9: np.dtype("<i8"),  # DT_INT64
+    10: np.dtype("?"),  # DT_BOOL
+    17: np.dtype("<u2"),  # DT_UINT16
+    19: np.dtype("<f2"),  # DT_HALF
+    22: np.dtype("<u4"),  # DT_UINT32
+    23: np.dtype("<u8"),  # DT_UINT64
+}
+_DT_STRING = 7
+
+
+def _read_varint(buf, pos):
+    result = 0
+    shift = 0
+    while True:
+        b = buf[pos]
+        pos += 1
+        result |= (b & 0x7F) << shift
+        if not b & 0x80:
+            return result, pos
+        shift += 7
+
+
+def _parse_proto(buf) -> Dict[int, list]:
+    """
+    Minimal protobuf wire format parser, field number -> list of raw values
+    (int for varint/fixed fields, bytes for length delimited fields).
+    """
+    fields = {}
+    pos = 0
+    while pos < len(buf):
+        key, pos = _read_varint(buf, pos)
+        field, wire_type = key >> 3, key & 7
+        if wire_type == 0:
+            value, pos = _read_varint(buf, pos)
+        elif wire_type == 1:
+            (value,) = struct.unpack_from("<Q", buf, pos)
+            pos += 8
+        elif wire_type == 2:
+            length, pos = _read_varint(buf, pos)
+            value = bytes(buf[pos : pos + length])
+            pos += length
+        elif wire_type == 5:
+            (value,) = struct.unpack_from("<I", buf, pos)
+            pos += 4
+        else:
+            raise ValueError(f"unsupported protobuf wire type {wire_type}")
+        fields.setdefault(field, []).append(value)
+    return fields
+
+
+def _to_int64(value):
+    return value - (1 << 64) if value >= (1 << 63) else value
+
+
+class TensorEntry:
+    """
+    Location of one tensor in the data shards, parsed from a BundleEntryProto.
+    """
+
+    def __init__(self, name: str, proto: bytes):
+        fields = _parse_proto(proto)
+        self.name = name
+        self.tf_dtype = fields.get(1, [0])[0]
+        shape = _parse_proto(fields[2][0]) if 2 in fields else {}
+        self.shape = tuple(_to_int64(_parse_proto(dim).get(1, [0])[0]) for dim in shape.get(2, []))
+        self.shard_id = fields.get(3, [0])[0]
+        self.offset = fields.get(4, [0])[0]
+        self.size = fields.get(5, [0])[0]
+        self.is_sliced = 7 in fields
+
+    @property
+    def dtype(self) -> np.dtype:
+        if self.tf_dtype == _DT_STRING:
+            return np.dtype(object)
+        if self.tf_dtype not in _DTYPES:
+            raise NotImplementedError(f"tensor {self.name}: unsupported tensorflow dtype enum {self.tf_dtype}")
+        return _DTYPES[self.tf_dtype]
+
+
+class TFCheckpointReader:
+    """
+    Reader for the index and data files of a TensorFlow checkpoint.
+
+    Only the SSTable index is parsed on construction,
+    the tensors are read on demand from the data shards with a single read each.
+    Partitioned (sliced) variables are not supported.
+    """
+
+    def __init__(self, prefix: str):
+        """
+        :param prefix: checkpoint path without ``.index``, e.g. ``.../epoch.100``
+        """
+        if prefix.endswith(".index"):
+            prefix = prefix[: -len(".index")]
+        self.prefix = prefix
+        with open(prefix + ".index", "rb") as f:
+            index = f.read()
+        self.num_shards = 1
+        self.entries = {}  # type: Dict[str, TensorEntry]
+        for key, value in self._iter_table(index):
+            if key == b"":
+                header = _parse_proto(value)
+                self.num_shards = header.get(1, [1])[0]
+                assert header.get(2, [0])[0] == 0, "only little endian checkpoints are supported"
+                continue
+            name = key.decode("utf-8")
+            self.entries[name] = TensorEntry(name, value)
+
+    @staticmethod
+    def _read_block(table: bytes, handle: bytes) -> memoryview:
+        offset, pos = _read_varint(handle, 0)
+        size, pos = _read_varint(handle, pos)
+        compression = table[offset + size]
+        assert compression == 0, f"compressed SSTable blocks are not supported (type {compression})"
+        return memoryview(table)[offset : offset + size]
+
+    @staticmethod
+    def _iter_block(block: memoryview) -> Iterable[Tuple[bytes, memoryview]]:
+        (num_restarts,) = struct.unpack_from("<I", block, len(block) - 4)
+        end = len(block) - 4 - 4 * num_restarts
+        pos = 0
+        key = b""
+        while pos < end:
+            shared, pos = _read_varint(block, pos)
+            non_shared, pos = _read_varint(block, pos)
+            value_len, pos = _read_varint(block, pos)
+            key = key[:shared] + bytes(block[pos : pos + non_shared])
+            pos += non_shared
+            yield key, block[pos : pos + value_len]
+            pos += value_len
+
+    @classmethod
+    def _iter_table(cls, table: bytes) -> Iterable[Tuple[bytes, memoryview]]:
+        footer = table[-_FOOTER_SIZE:]
+        (magic,) = struct.unpack_from("<Q", footer, _FOOTER_SIZE - 8)
+        assert magic == _TABLE_MAGIC, "not a TensorFlow checkpoint index file"
+        _, pos = _read_varint(footer, 0)  # metaindex handle, not used
+        _, pos = _read_varint(footer, pos)
+        index_handle_start = pos
+        _, pos = _read_varint(footer, pos)
+        _, pos = _read_varint(footer, pos)
+        index_block = cls._read_block(table, footer[index_handle_start:pos])
+        for _, handle in cls._iter_block(index_block):
+            yield from cls._iter_block(cls._read_block(table, bytes(handle)))
+
+    def shard_path(self, shard_id: int) -> str:
+        return f"{self.prefix}.data-{shard_id:05d}-of-{self.num_shards:05d}"
+
+    def get_variable_to_shape_map(self) -> Dict[str, Tuple[int, ...]]:
+        return {name: entry.shape for name, entry in self.entries.items()}
+
+    def get_variable_to_dtype_map(self) -> Dict[str, np.dtype]:
+        return {name: entry.dtype for name, entry in self.entries.items()}
+
+    def get_tensor(self, name: str, mmap: bool = False) -> np.ndarray:
+        """
+        :param name: tensor name as in the checkpoint, e.g. ``output/W``
+        :param mmap: return a read-only memory map into the data shard instead of reading the data
+        """
+        entry = self.entries[name]
+        if entry.is_sliced:
+            raise NotImplementedError(f"tensor {name} is partitioned, sliced tensors are not supported")
+        dtype = entry.dtype
+        path = self.shard_path(entry.shard_id)
+        if entry.tf_dtype == _DT_STRING:
+            return self._read_string_tensor(path, entry)
+        count = int(np.prod(entry.shape, dtype=np.int64))
+        assert count * dtype.itemsize == entry.size, f"tensor {name}: size mismatch in the index"
+        if count == 0:
+            return np.zeros(entry.shape, dtype=dtype)
+        if mmap:
+            return np.memmap(path, dtype=dtype, mode="r", offset=entry.offset, shape=entry.shape)
+        with open(path, "rb") as f:
+            f.seek(entry.offset)
+            data = np.fromfile(f, dtype=dtype, count=count)
+        return data.reshape(entry.shape)
+
+    @staticmethod
+    def _read_string_tensor(path: str, entry: TensorEntry) -> np.ndarray:
+        # layout: varint64 length of every element, masked crc32c of the lengths, concatenated bytes
+        with open(path, "rb") as f:
+            f.seek(entry.offset)
+            buf = f.read(entry.size)
+        count = int(np.prod(entry.shape, dtype=np.int64))
+        lengths = []
+        pos = 0
+        for _ in range(count):
+            length, pos = _read_varint(buf, pos)
+            lengths.append(length)
+        pos += 4
+        values = np.empty(count, dtype=object)
+        for i, length in enumerate(lengths):
+            values[i] = buf[pos : pos + length]
+            pos += length
+        return values.reshape(entry.shape)
+
+    def dump_npy(self, out_dir: str, names: Optional[Iterable[str]] = None) -> Dict[str, str]:
+        """
+        Writes every (or every selected) tensor to ``out_dir/<tensor name>.npy``,
+        the files can be opened with ``np.load(path, mmap_mode="r")``.
+
+        :return: tensor name -> npy path
+        """
+        names = sorted(self.entries) if names is None else list(names)
+        missing = [name for name in names if name not in self.entries]
+        assert not missing, f"tensors not in checkpoint {self.prefix}: {missing}"
+        paths = {}
+        for name in names:
+            path = os.path.join(out_dir, name + ".npy")
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tensor = self.get_tensor(name, mmap=True)
+            np.save(path, tensor, allow_pickle=tensor.dtype == object)
+            paths[name] = path
+        return paths
+
+
+def list_npy_tensors(npy_dir: str) -> List[str]:
+    """
+    :return: tensor names of the npy files written by :func:`TFCheckpointReader.dump_npy`
+    """
+    names = []
+    for root, _, files in os.walk(npy_dir):
+        for file in files:
+            if file.endswith(".npy"):
+                names.append(os.path.relpath(os.path.join(root, file), npy_dir)[: -len(".npy")])
+    return sorted(names)
@@ -1,18 +1,27 @@
 from sisyphus import *
 
-import os, re
+import os, re, time
 import numpy as np
 import subprocess as sp
 
+from .checkpoint_reader import TFCheckpointReader, list_npy_tensors
+
 class InspectTFCheckpointJob(Job):
     """
-    Job that wraps returnn tf_inspect_checkpoint.py tool. Additionally parses the output and collects the
-    successfully parsed tensors in a dict that is accessible as a sisyphus "Value" object.
+    Job that reads the tensors of a TF checkpoint directly from its binary index and data files (on CPU,
+    without TensorFlow) and writes them as .npy files, which can be memory mapped with np.load(..., mmap_mode="r").
+    Additionally, the tensors are collected in a dict that is accessible as a sisyphus "Value" object.
+
+    The returnn tf_inspect_checkpoint.py text output is only used by :func:`benchmark_inspect_checkpoint`,
+    print_options, crnn_python_exe and crnn_root are kept for the hash.
     """
 
-    __sis_hash_exclude__ = {"assert_tensors_parsed": None}
+    __sis_hash_exclude__ = {"assert_tensors_parsed": None, "tensor_names": None}
 
-    def __init__(self, checkpoint, all_tensors=True, tensor_name=None, print_options=None, crnn_python_exe=None, crnn_root=None, assert_tensors_parsed=None):
+    def __init__(self, checkpoint, all_tensors=True, tensor_name=None, print_options=None, crnn_python_exe=None, crnn_root=None, assert_tensors_parsed=None, tensor_names=None):
+        """
+        :param tensor_names: only extract these tensors, instead of all tensors or tensor_name
+        """
         assert all_tensors == (tensor_name is None)
         self.tensors_parsed = assert_tensors_parsed or []
         self.crnn_python_exe   = crnn_python_exe if crnn_python_exe is not None else gs.CRNN_PYTHON_EXE
@@ -21,32 +30,46 @@ class InspectTFCheckpointJob(Job):
         self.all_tensors = all_tensors
         self.tensor_name = tensor_name
         self.print_options = print_options
+        if tensor_names is not None:
+            self.tensor_names = list(tensor_names)
+        else:
+            self.tensor_names = None if all_tensors else [tensor_name]
         self.tensors_raw = self.output_path("tensors.txt")
+        self.tensors_npy = self.output_path("tensors_npy", directory=True)
         self.tensors = self.output_var("tensors", pickle=True)
-        self.rqmts = {"gpu": 1, "time": 0.1}
+        self.rqmts = {"cpu": 1, "mem": 4, "time": 0.1}
     
     def tasks(self):
         yield Task('run', resume='run', rqmt=self.rqmts)
         yield Task('extract', mini_task=True)
     
     def run(self):
+        reader = TFCheckpointReader(str(self.checkpoint))
+        paths = reader.dump_npy(self.tensors_npy.get_path(), self.tensor_names)
+        with open(self.tensors_raw.get_path(), "w") as f:
+            for name in paths:
+                entry = reader.entries[name]
+                f.write(f"tensor_name: {name} dtype: {entry.dtype} shape: {list(entry.shape)}\n")
+
+    @staticmethod
+    def run_inspect_tool(checkpoint, crnn_python_exe, crnn_root, all_tensors=True, tensor_name=None, print_options=None):
+        """
+        Text output of returnn tf_inspect_checkpoint.py, as read by :func:`parse_tensors_text`.
+        """
         args = [
-            tk.uncached_path(self.crnn_python_exe),
-            os.path.join(tk.uncached_path(self.crnn_root), 'tools/tf_inspect_checkpoint.py'),
-            f'--file_name={self.checkpoint}'
+            tk.uncached_path(crnn_python_exe),
+            os.path.join(tk.uncached_path(crnn_root), 'tools/tf_inspect_checkpoint.py'),
+            f'--file_name={checkpoint}'
         ]
-        if self.all_tensors:
+        if all_tensors:
             args += ['--all_tensors']
-        if self.tensor_name:
-            args += [f'--tensor_name={self.tensor_name}']
-        if self.print_options:
-            args += [f'--print_options={self.print_options}']
+        if tensor_name:
+            args += [f'--tensor_name={tensor_name}']
+        if print_options:
+            args += [f'--print_options={print_options}']
         p = sp.Popen(args, stdout=sp.PIPE, stderr=sp.PIPE)
         output_raw, err = p.communicate()
-        output = output_raw.decode("utf-8")
-        print(f"{output}")
-        with open(self.tensors_raw.get_path(), "w") as f:
-            f.write(output)
+        return output_raw.decode("utf-8")
 
     @staticmethod
     def read_array(string):
@@ -63,11 +86,12 @@ class InspectTFCheckpointJob(Job):
             print("Eval call failed on '{}'".format(parsed_string))
             return None
     
-    def extract(self):
+    @staticmethod
+    def parse_tensors_text(path):
         prev_tensor_name = None
         buffer = ""
         tensors = {}
-        with open(self.tensors_raw.get_path(), "r") as f:
+        with open(path, "r") as f:
             for line in f:
                 if line.startswith("tensor_name:"):
                     if prev_tensor_name is not None:
@@ -76,8 +100,66 @@ class InspectTFCheckpointJob(Job):
                     buffer = ""
                     continue
                 buffer += line
-            value = InspectTFCheckpointJob.read_array(buffer)
             tensors[prev_tensor_name] = InspectTFCheckpointJob.read_array(buffer)
+        return tensors
+
+    def extract(self):
+        npy_dir = self.tensors_npy.get_path()
+        tensor_names = self.tensor_names if self.tensor_names is not None else list_npy_tensors(npy_dir)
+        tensors = {
+            name: np.load(os.path.join(npy_dir, name + ".npy"), allow_pickle=True)
+            for name in tensor_names
+        }
         assert all(tensor_name in tensors and tensors[tensor_name] is not None for tensor_name in self.tensors_parsed)
         self.tensors.set(tensors)
-            
\ No newline at end of file
+
+
+def create_synthetic_checkpoint(prefix, num_tensors=10, shape=(1024, 1024), seed=42):
+    """
+    Writes a checkpoint with random float32 variables, needs tensorflow.
+
+    :return: checkpoint prefix
+    """
+    import tensorflow as tf
+    rng = np.random.RandomState(seed)
+    with tf.Graph().as_default():
+        for i in range(num_tensors):
+            tf.compat.v1.Variable(rng.randn(*shape).astype("float32"), name=f"layer{i}/W")
+        saver = tf.compat.v1.train.Saver()
+        with tf.compat.v1.Session() as session:
+            session.run(tf.compat.v1.global_variables_initializer())
+            return saver.save(session, prefix)
+
+
+def benchmark_inspect_checkpoint(checkpoint, crnn_python_exe, crnn_root, out_dir, print_options=None):
+    """
+    Compares reading the binary checkpoint with running tf_inspect_checkpoint.py and parsing its text output.
+    The text output is rounded, so only the shapes are compared exactly.
+
+    :param str checkpoint: checkpoint prefix, e.g. from :func:`create_synthetic_checkpoint`
+    :param str out_dir: for the text output and the npy files
+    :return: seconds per variant
+    """
+    os.makedirs(out_dir, exist_ok=True)
+    times = {}
+
+    start = time.monotonic()
+    text_path = os.path.join(out_dir, "tensors.txt")
+    with open(text_path, "w") as f:
+        f.write(InspectTFCheckpointJob.run_inspect_tool(checkpoint, crnn_python_exe, crnn_root, print_options=print_options))
+    text_tensors = InspectTFCheckpointJob.parse_tensors_text(text_path)
+    times["text"] = time.monotonic() - start
+
+    start = time.monotonic()
+    reader = TFCheckpointReader(checkpoint)
+    reader.dump_npy(os.path.join(out_dir, "tensors_npy"))
+    times["binary"] = time.monotonic() - start
+
+    for name, value in text_tensors.items():
+        if value is None or name not in reader.entries:
+            continue
+        tensor = reader.get_tensor(name, mmap=True)
+        assert value.shape == tensor.shape, f"shape mismatch for {name}: {value.shape} vs {tensor.shape}"
+        if tensor.dtype.kind == "f":
+            assert np.allclose(value, tensor, rtol=1e-3, atol=1e-5), f"values differ for {name}"
+    return times
@@ -9,7 +9,7 @@ from i6_core import meta
 from .nn_system.base_system import NNSystem
 from .nn_system.trainer import SemiSupervisedTrainer
 from i6_experiments.users.mann.experimental.sequence_training import add_fastbw_configs
-from i6_experiments.users.mann.experimental.plots import PlotSoftAlignmentJob
+from i6_experiments.users.mann.experimental.plots import PlotSoftAlignmentJob, HDFSeqIndexJob
 from i6_core.lexicon.allophones import StoreAllophonesJob, DumpStateTyingJob
 
 def setup_datasets(system: NNSystem):
@@ -135,6 +135,8 @@ class HdfDumpster:
         segments,
         occurrence_thresholds=(5.0, 0.05)
     ):
+        # the index job is shared by all plot jobs over the same dumps
+        seq_index = HDFSeqIndexJob(bw_dumps).out_index
         plot_job = PlotSoftAlignmentJob(
             bw_dumps,
             alignment=meta.select_element(self.system.alignments, corpus, alignment),
@@ -142,7 +144,9 @@ class HdfDumpster:
             state_tying=self.system.get_state_tying_file(),
             segments=segments,
             occurrence_thresholds=occurrence_thresholds,
-            hmm_partition=self.system.crp[corpus].acoustic_model_config.hmm.states_per_phone
+            hmm_partition=self.system.crp[corpus].acoustic_model_config.hmm.states_per_phone,
+            seq_index=seq_index,
+            num_workers=min(len(segments), 4),
         )
 
         if name is None:
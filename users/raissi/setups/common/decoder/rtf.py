@@ -2,17 +2,169 @@ __all__ = ["ExtractSearchStatisticsJob"]
 
 import collections
 import gzip
+import hashlib
+import json
+import multiprocessing
+import os
+import tempfile
 import xml.etree.ElementTree as ET
 
 from sisyphus import *
 
 Path = setup_path(__package__)
 
+# increase whenever the content of the summaries changes, invalidates all cached summaries
+SUMMARY_VERSION = 1
+
+
+def _parse_segment(seg, summary):
+    """
+    Adds the statistics of a single <segment> element to the log summary
+
+    :param ET.Element seg:
+    :param dict summary:
+    """
+    for layer in seg.findall('./layer[@name="recognizer"]'):
+        frames = int(layer.find('./statistics/frames[@port="features"]').attrib["number"])
+        summary["frames"] += frames
+        summary["word_ends"] += frames * float(
+            layer.find('./search-space-statistics/statistic[@name="ending words after pruning"]/avg').text
+        )
+        summary["trees"] += frames * float(
+            layer.find('./search-space-statistics/statistic[@name="trees after  pruning"]/avg').text
+        )
+        summary["states"] += frames * float(
+            layer.find('./search-space-statistics/statistic[@name="states after pruning"]/avg').text
+        )
+        summary["recognizer_time"] += float(layer.find("./flf-recognizer-time").text)
+
+    for rescore in seg.findall("./flf-push-forward-rescoring-time"):
+        summary["rescoring_time"] += float(rescore.text)
+
+    seg_stats = {}
+    full_name = seg.attrib["full-name"]
+    for sss in seg.findall('./layer[@name="recognizer"]/search-space-statistics/statistic[@type="scalar"]'):
+        min_val = float(sss.findtext("./min", default="0"))
+        avg_val = float(sss.findtext("./avg", default="0"))
+        max_val = float(sss.findtext("./max", default="0"))
+        seg_stats[sss.attrib["name"]] = (min_val, avg_val, max_val)
+
+    features = seg.find('./layer[@name="recognizer"]/statistics/frames[@port="features"]')
+    seg_stats["frames"] = int(features.attrib["number"])
+
+    tf_fwd = seg.find(
+        './layer[@name="recognizer"]/information[@component="flf-lattice-tool.network.recognizer.feature-extraction.tf-fwd"]'
+    )
+    seg_stats["tf_fwd"] = float(tf_fwd.text.strip().split()[-1]) if tf_fwd is not None else 0.0
+    summary["seq_ss_statistics"][full_name] = seg_stats
+
+    evaluations = {}
+    for evaluation in seg.iter("evaluation"):
+        alignment = evaluation.find('statistic[@type="alignment"]')
+        evaluations[evaluation.attrib["name"]] = {
+            "errors": int(alignment.findtext("edit-operations")),
+            "ref-tokens": int(alignment.findtext('count[@event="token"][@source="reference"]')),
+            "score": float(alignment.findtext('score[@source="best"]')),
+        }
+    summary["eval_statistics"][full_name] = evaluations
+
+
+def parse_search_log(path):
+    """
+    Streams through a (gzipped) RASR search log and extracts a compact summary.
+    Only one <segment> element is kept in memory at a time.
+
+    :param str path:
+    :return: summary with the timing of the whole log, the frame weighted search space sums
+        and the per segment statistics
+    :rtype: dict
+    """
+    summary = {
+        "host": None,
+        "elapsed": None,
+        "user": None,
+        "system": None,
+        "frames": 0,
+        "word_ends": 0.0,
+        "trees": 0.0,
+        "states": 0.0,
+        "recognizer_time": 0.0,
+        "rescoring_time": 0.0,
+        "lm_time": 0.0,
+        "seq_ss_statistics": {},
+        "eval_statistics": {},
+    }
+    stack = []
+    with gzip.open(path, "rb") as f:
+        for event, elem in ET.iterparse(f, events=("start", "end")):
+            if event == "start":
+                stack.append(elem)
+                continue
+            stack.pop()
+            if elem.tag == "fwd-summary":
+                for lm_total in elem.findall("./total-run-time"):
+                    summary["lm_time"] += float(lm_total.text)
+            if elem.tag == "segment":
+                _parse_segment(elem, summary)
+            elif len(stack) == 1:
+                if elem.tag == "system-information" and summary["host"] is None:
+                    summary["host"] = elem.findtext("./name")
+                elif elem.tag == "timer" and summary["elapsed"] is None:
+                    summary["elapsed"] = float(elem.findtext("./elapsed"))
+                    summary["user"] = float(elem.findtext("./user"))
+                    summary["system"] = float(elem.findtext("./system"))
+            else:
+                continue
+            # processed elements are not needed anymore, detach them to keep the memory constant
+            if stack:
+                stack[-1].remove(elem)
+    assert summary["elapsed"] is not None, "no timer information found in %s" % path
+    return summary
+
+
+def cached_parse_search_log(path, cache_dir):
+    """
+    :func:`parse_search_log` with a summary cache in cache_dir.
+    The cache key contains the absolute path, modification time and size of the log,
+    so changed logs are parsed again.
+
+    :param str path:
+    :param str cache_dir:
+    :rtype: dict
+    """
+    stat = os.stat(path)
+    key = json.dumps([os.path.abspath(path), stat.st_mtime, stat.st_size, SUMMARY_VERSION])
+    cache_file = os.path.join(cache_dir, "%s.json.gz" % hashlib.sha256(key.encode("utf-8")).hexdigest())
+    if os.path.exists(cache_file):
+        with gzip.open(cache_file, "rt") as f:
+            return json.load(f)
+
+    summary = parse_search_log(path)
+    # write atomically, the cache directory might be shared between jobs
+    fd, tmp_file = tempfile.mkstemp(dir=cache_dir, suffix=".tmp")
+    with gzip.open(os.fdopen(fd, "wb"), "wt") as f:
+        json.dump(summary, f)
+    os.replace(tmp_file, cache_file)
+    return summary
+
+
+def _cached_parse_search_log(args):
+    return cached_parse_search_log(*args)
+
 
 class ExtractSearchStatisticsJob(Job):
-    def __init__(self, search_logs, corpus_duration):
+    def __init__(self, search_logs, corpus_duration, cpu=1, summary_cache_dir=None):
+        """
+        :param list[tk.Path] search_logs: gzipped RASR search logs
+        :param float corpus_duration: in hours
+        :param int cpu: number of logs parsed in parallel
+        :param str|None summary_cache_dir: directory for the per-log summaries, shared between jobs,
+            so that rerunning with different statistics does not parse unchanged logs again.
+            By default the summaries are stored in the job directory.
+        """
         self.search_logs = search_logs
         self.corpus_duration = corpus_duration
+        self.summary_cache_dir = summary_cache_dir
 
         self.elapsed_time = self.output_var("elapsed_time")
         self.user_time = self.output_var("user_time")
@@ -34,14 +186,12 @@ class ExtractSearchStatisticsJob(Job):
         self.seq_ss_statistics = self.output_var("seq_ss_statistics")
         self.eval_statistics = self.output_var("eval_statistics")
 
-        self.rqmt = {"cpu": 1, "mem": 2.0, "time": 0.5}
+        self.rqmt = {"cpu": cpu, "mem": 2.0, "time": 0.5}
 
     def tasks(self):
         yield Task("run", resume="run", rqmt=self.rqmt)
 
     def run(self):
-        queue_stats = collections.defaultdict(list)
-
         total_elapsed = 0.0
         total_user = 0.0
         total_system = 0.0
@@ -56,88 +206,28 @@ class ExtractSearchStatisticsJob(Job):
         seq_ss_statistics = {}
         eval_statistics = {}
 
-        for path in self.search_logs:
-            with gzip.open(tk.uncached_path(path), "rt") as f:
-                root = ET.fromstring(f.read())
-            host = root.findall("./system-information/name")[0].text
-            elapsed = float(root.findall("./timer/elapsed")[0].text)
-            user = float(root.findall("./timer/user")[0].text)
-            system = float(root.findall("./timer/system")[0].text)
-            total_elapsed += elapsed
-            total_user += user
-            total_system += system
-
-            for layer in root.findall('.//segment/layer[@name="recognizer"]'):
-                frames = int(
-                    layer.findall('./statistics/frames[@port="features"]')[0].attrib[
-                        "number"
-                    ]
-                )
-                total_frames += frames
-                total_word_ends += frames * float(
-                    layer.findall(
-                        './search-space-statistics/statistic[@name="ending words after pruning"]/avg'
-                    )[0].text
-                )
-                total_trees += frames * float(
-                    layer.findall(
-                        './search-space-statistics/statistic[@name="trees after  pruning"]/avg'
-                    )[0].text
-                )
-                total_states += frames * float(
-                    layer.findall(
-                        './search-space-statistics/statistic[@name="states after pruning"]/avg'
-                    )[0].text
-                )
-
-                recognizer_time += float(layer.findall("./flf-recognizer-time")[0].text)
-
-            for rescore in root.findall(".//segment/flf-push-forward-rescoring-time"):
-                rescoring_time += float(rescore.text)
-
-            for lm_total in root.findall(".//fwd-summary/total-run-time"):
-                lm_time += float(lm_total.text)
-
-            for seg in root.findall(".//segment"):
-                seg_stats = {}
-                full_name = seg.attrib["full-name"]
-                for sss in seg.findall(
-                    './layer[@name="recognizer"]/search-space-statistics/statistic[@type="scalar"]'
-                ):
-                    min_val = float(sss.findtext("./min", default="0"))
-                    avg_val = float(sss.findtext("./avg", default="0"))
-                    max_val = float(sss.findtext("./max", default="0"))
-                    seg_stats[sss.attrib["name"]] = (min_val, avg_val, max_val)
-                seq_ss_statistics[full_name] = seg_stats
-
-                features = seg.find(
-                    './layer[@name="recognizer"]/statistics/frames[@port="features"]'
-                )
-                seq_ss_statistics[full_name]["frames"] = int(features.attrib["number"])
-
-                tf_fwd = seg.find(
-                    './layer[@name="recognizer"]/information[@component="flf-lattice-tool.network.recognizer.feature-extraction.tf-fwd"]'
-                )
-                if tf_fwd is not None:
-                    seq_ss_statistics[full_name]["tf_fwd"] = float(
-                        tf_fwd.text.strip().split()[-1]
-                    )
-                else:
-                    seq_ss_statistics[full_name]["tf_fwd"] = 0.0
-
-                eval_statistics[full_name] = {}
-                for evaluation in seg.findall(".//evaluation"):
-                    stat_name = evaluation.attrib["name"]
-                    alignment = evaluation.find('statistic[@type="alignment"]')
-                    eval_statistics[full_name][stat_name] = {
-                        "errors": int(alignment.findtext("edit-operations")),
-                        "ref-tokens": int(
-                            alignment.findtext(
-                                'count[@event="token"][@source="reference"]'
-                            )
-                        ),
-                        "score": float(alignment.findtext('score[@source="best"]')),
-                    }
+        cache_dir = self.summary_cache_dir or "log_summaries"
+        os.makedirs(cache_dir, exist_ok=True)
+        args = [(tk.uncached_path(path), cache_dir) for path in self.search_logs]
+        with multiprocessing.Pool(self.rqmt["cpu"]) as pool:
+            summaries = pool.map(_cached_parse_search_log, args)
+
+        for summary in summaries:
+            total_elapsed += summary["elapsed"]
+            total_user += summary["user"]
+            total_system += summary["system"]
+            total_frames += summary["frames"]
+            total_word_ends += summary["word_ends"]
+            total_trees += summary["trees"]
+            total_states += summary["states"]
+            recognizer_time += summary["recognizer_time"]
+            rescoring_time += summary["rescoring_time"]
+            lm_time += summary["lm_time"]
+            for full_name, seg_stats in summary["seq_ss_statistics"].items():
+                seq_ss_statistics[full_name] = {
+                    stat: tuple(val) if isinstance(val, list) else val for stat, val in seg_stats.items()
+                }
+            eval_statistics.update(summary["eval_statistics"])
 
         for s in seq_ss_statistics.values():
             frames = s["frames"]
@@ -186,3 +276,9 @@ class ExtractSearchStatisticsJob(Job):
         self.ss_statistics.set(dict(ss_statistics.items()))
         self.seq_ss_statistics.set(seq_ss_statistics)
         self.eval_statistics.set(eval_statistics)
+
+    @classmethod
+    def hash(cls, kwargs):
+        kwargs.pop("cpu")
+        kwargs.pop("summary_cache_dir")
+        return super().hash(kwargs)
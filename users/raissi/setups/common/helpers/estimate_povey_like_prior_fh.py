@@ -17,6 +17,8 @@ from sisyphus import *
 
 from i6_core.lib.rasr_cache import FileArchive
 
+from i6_experiments.users.rossenbach.lib.hdf import HDFSequenceReader
+
 Path = setup_path(__package__)
 
 
@@ -24,14 +26,79 @@ Path = setup_path(__package__)
 # Monophone
 ###################################
 
-def get_batch_from_segments(segments, batchSize=10000):
-    index = 0
-    while True:
-        try:
-            yield segments[index * batchSize: (index + 1) * batchSize]
-            index += 1
-        except IndexError:
-            index = 0
+def get_segment_batches_from_hdf(hdfPath, maxFrames=10000):
+    """
+    Streams the segments of a feature HDF in padded batches, see SprintFeatureToHdf for the layouts.
+    Segments are grouped by length to minimize padding,
+    and each batch contains at most maxFrames frames including padding, unless a single segment is longer.
+
+    :param str hdfPath:
+    :param int maxFrames:
+    :return: generator of features (B, T, F) and lengths (B,)
+    """
+    with h5py.File(hdfPath, "r") as hf:
+        contiguous = "inputs" in hf
+    if contiguous:
+        yield from _get_segment_batches_from_contiguous_hdf(hdfPath, maxFrames)
+        return
+
+    with h5py.File(hdfPath, "r") as hf:
+        data = hf['streams']['features']['data']
+        # only the shapes are read upfront
+        names = list(data)
+        for batch in _batch_by_length([data[name].shape[0] for name in names], maxFrames):
+            yield _pad_segments([data[names[i]][...] for i in batch])
+
+
+def _get_segment_batches_from_contiguous_hdf(hdfPath, maxFrames, readFactor=16):
+    """
+    Reads consecutive segments with a single slice of up to readFactor * maxFrames frames,
+    and batches the segments of each slice by length.
+    """
+    with HDFSequenceReader(hdfPath) as reader:
+        for chunk in reader.iter_chunks(max_frames=readFactor * maxFrames):
+            segments = [seg for _, seg in chunk]
+            for batch in _batch_by_length([len(seg) for seg in segments], maxFrames):
+                yield _pad_segments([segments[i] for i in batch])
+
+
+def _batch_by_length(lengths, maxFrames):
+    """
+    :param list[int] lengths:
+    :param int maxFrames: max number of frames per batch including padding
+    :return: lists of indices, sorted by length
+    :rtype: list[list[int]]
+    """
+    batches = []
+    batch = []
+    for i in sorted(range(len(lengths)), key=lengths.__getitem__):
+        if batch and (len(batch) + 1) * lengths[i] > maxFrames:
+            batches.append(batch)
+            batch = []
+        batch.append(i)
+    if batch:
+        batches.append(batch)
+    return batches
+
+
+def _pad_segments(segments):
+    """
+    :param list[np.ndarray] segments: each (T_i, F)
+    :return: zero padded features (B, max T_i, F) and the lengths (B,)
+    """
+    seqLengths = np.array([len(seg) for seg in segments], dtype=np.int32)
+    features = np.zeros((len(segments), seqLengths.max(), segments[0].shape[1]), dtype=np.float32)
+    for i, seg in enumerate(segments):
+        features[i, :len(seg)] = seg
+    return features, seqLengths
+
+
+def get_frame_mask(seqLengths, maxLength):
+    """
+    :return: (B, T) boolean mask of the non-padded frames
+    """
+    return np.arange(maxLength)[None, :] < seqLengths[:, None]
+
 
 class EstimateMonophonePriors_(Job):
     tm = {"diphone": "diphone"}
@@ -59,37 +126,24 @@ class EstimateMonophonePriors_(Job):
     def tasks(self):
         yield Task('run', resume='run', rqmt=self.rqmt, args=range(1, (len(self.datasetIndices) + 1)))
 
-    def getSegmentFeaturesFromHdf(self, dataIndex):
-        hf = h5py.File(tk.uncached_path(self.dataPaths[dataIndex]))
-        segmentNames = list(hf['streams']['features']['data'])
-        segments = []
-        for name in segmentNames:
-            segments.append(hf['streams']['features']['data'][name])
-        return np.vstack(segments)
-
-    def getPosteriors(self, session, featureVector):
+    def getPosteriors(self, session, features, seqLengths):
         return session.run([("-").join([self.tensorMap['diphone'], 'output/output_batch_major:0'])],
-                           feed_dict={'extern_data/placeholders/data/data:0':
-                                          featureVector.reshape(1, featureVector.shape[0], featureVector.shape[1]),
-                                      'extern_data/placeholders/data/data_dim0_size:0': [featureVector.shape[0]]})
+                           feed_dict={'extern_data/placeholders/data/data:0': features,
+                                      'extern_data/placeholders/data/data_dim0_size:0': seqLengths})
 
     def calculateMeanPosteriors(self, session, taskId):
+        # sufficient statistics, accumulated in float64 to avoid drift over millions of frames
         sampleCount = 0
-        segments = self.getSegmentFeaturesFromHdf(self.datasetIndices[taskId - 1])
+        posteriorSum = np.zeros(self.nStates, dtype=np.float64)
+        dataPath = tk.uncached_path(self.dataPaths[self.datasetIndices[taskId - 1]])
 
-        for batch in get_batch_from_segments(segments, self.nBatch):
-            bSize = len(batch)
-            denom = sampleCount + bSize
-            if (len(batch) == 0):
-                break
-
-            p = self.getPosteriors(session, batch)
-
-            for i in range(len(batch)):
-                nominator = (sampleCount * self.centerPhonemeMeans) + (bSize * np.mean(p[0][0], axis=0))
-                self.centerPhonemeMeans = np.divide(nominator, denom)
-            sampleCount += bSize
+        for features, seqLengths in get_segment_batches_from_hdf(dataPath, self.nBatch):
+            p = self.getPosteriors(session, features, seqLengths)[0]
+            mask = get_frame_mask(seqLengths, p.shape[1])
+            posteriorSum += p[mask].sum(axis=0, dtype=np.float64)
+            sampleCount += int(seqLengths.sum())
 
+        self.centerPhonemeMeans = posteriorSum / max(sampleCount, 1)
         with open(tk.uncached_path(self.numSegments[taskId - 1]), "wb") as fp:
             pickle.dump(sampleCount, fp, protocol=pickle.HIGHEST_PROTOCOL)
 
@@ -152,11 +206,16 @@ class DumpXmlForMonophone(Job):
 
 class EstimateRasrDiphoneAndContextPriors(Job):
     tm = {"diphone": "diphone", "context": "context"}
-    __sis_hash_exclude__ = {"tensorMap": {"diphone": "center", "context": "context"}}
+    __sis_hash_exclude__ = {"tensorMap": {"diphone": "center", "context": "context"}, "maxRowsPerCall": None}
 
     def __init__(self, graphPath, model, dataPaths, datasetIndices, libraryPath,
                  nBatch=10000, nStateClasses=141, nPhones=47, nContexts=47, nStates=3, gpu=1, mem=8, time=20,
-                 tensorMap=tm):
+                 tensorMap=tm, maxRowsPerCall=None):
+        """
+        :param int|None maxRowsPerCall: bound for frames x nContexts of one evaluation of the label dependent outputs.
+            If None, all encoder frames of a batch are evaluated in one call,
+            and only split into halves if that call runs out of memory.
+        """
         self.graphPath = graphPath
         self.model = model
         self.dataPaths = dataPaths
@@ -172,60 +231,82 @@ class EstimateRasrDiphoneAndContextPriors(Job):
         self.nStates = nStates
         self.nBatch = nBatch
         self.tensorMap = tensorMap
+        self.maxRowsPerCall = maxRowsPerCall
         if not gpu: time *= 4
         self.rqmt = {'cpu': 2, 'gpu': gpu, 'mem': mem, 'time': float(time)}
 
     def tasks(self):
         yield Task('run', resume='run', rqmt=self.rqmt, args=range(1, (len(self.datasetIndices) + 1)))
 
-    def getSegmentFeaturesFromHdf(self, dataIndex):
-        hf = h5py.File(tk.uncached_path(self.dataPaths[dataIndex]))
-        print(self.dataPaths[dataIndex])
-        segmentNames = list(hf['streams']['features']['data'])
-        segments = []
-        for name in segmentNames:
-            segments.append(hf['streams']['features']['data'][name])
-        return np.vstack(segments)
-
-    def getEncoderOutput(self, session, featureVector):
+    def getEncoderOutput(self, session, features, seqLengths):
         return session.run(['encoder-output/output_batch_major:0'],
-                           feed_dict={'extern_data/placeholders/data/data:0':
-                                          featureVector.reshape(1, featureVector.shape[0], featureVector.shape[1]),
-                                      'extern_data/placeholders/data/data_dim0_size:0': [featureVector.shape[0]]})
-
-    def getPosteriorsOfBothOutputsWithEncoded(self, session, featureVector, classLabelVector):
+                           feed_dict={'extern_data/placeholders/data/data:0': features,
+                                      'extern_data/placeholders/data/data_dim0_size:0': seqLengths})
+
+    def getPosteriorsOfBothOutputsWithEncoded(self, session, encoderFrames, classLabels):
+        """
+        Evaluates the label dependent outputs for all given labels in one call,
+        by using the labels as batch dim and the encoder frames as time dim.
+
+        :param np.ndarray encoderFrames: (N, D) non-padded encoder frames,
+            the graph input is (N, len(classLabels), D), see maxRowsPerCall
+        :param list[int] classLabels: dense labels
+        :return: posteriors of both outputs, batch major (len(classLabels), N, ...)
+        """
+        nFrames = encoderFrames.shape[0]
         return session.run([("-").join([self.tensorMap['diphone'], 'output/output_batch_major:0']),
                             ("-").join([self.tensorMap['context'], 'output/output_batch_major:0'])],
                            feed_dict={'concat_fwd_6_bwd_6/concat_sources/concat:0':
-                                          featureVector.reshape(featureVector.shape[1], 1, featureVector.shape[2]),
+                                          np.broadcast_to(encoderFrames[:, None, :],
+                                                          (nFrames, len(classLabels), encoderFrames.shape[1])),
                                       'extern_data/placeholders/classes/classes:0': [
-                                          [classLabelVector] * featureVector.shape[1]]})
+                                          [label] * nFrames for label in classLabels]})
 
     def get_dense_label(self, pastLabel, centerPhoneme=0, stateId=0, futureLabel=0):
         return (((((centerPhoneme * self.nStates) + stateId) * self.nContexts) + pastLabel) * self.nContexts) + futureLabel
 
     def calculateMeanPosteriors(self, session, taskId):
+        # sufficient statistics, accumulated in float64 to avoid drift over millions of frames
         sampleCount = 0
-        segments = self.getSegmentFeaturesFromHdf(self.datasetIndices[taskId - 1])
-
-        for batch in get_batch_from_segments(segments, self.nBatch):
-            bSize = len(batch)
-            denom = sampleCount + bSize
-            if (len(batch) == 0):
-                break
-
-            encoderOutput = self.getEncoderOutput(session, batch)
-            for pastContextId in range(self.nContexts):
-                p = self.getPosteriorsOfBothOutputsWithEncoded(session, encoderOutput[0],
-                                                               self.get_dense_label(pastContextId))
-
-                di = (sampleCount * self.diphoneMeans[pastContextId]) + (bSize * np.mean(p[0][0], axis=0))
-                self.diphoneMeans[pastContextId] = np.divide(di, denom)
+        diphoneSums = None
+        contextSum = np.zeros(self.nContexts, dtype=np.float64)
+        dataPath = tk.uncached_path(self.dataPaths[self.datasetIndices[taskId - 1]])
+        print(dataPath)
+        classLabels = [self.get_dense_label(pastContextId) for pastContextId in range(self.nContexts)]
+        # None: all frames of a batch in one call
+        framesPerCall = None if self.maxRowsPerCall is None else max(1, self.maxRowsPerCall // len(classLabels))
+
+        for features, seqLengths in get_segment_batches_from_hdf(dataPath, self.nBatch):
+            encoderOutput = self.getEncoderOutput(session, features, seqLengths)[0]
+            encoderFrames = encoderOutput[get_frame_mask(seqLengths, encoderOutput.shape[1])]
+            nFrames = encoderFrames.shape[0]
+            start = 0
+            while start < nFrames:
+                end = nFrames if framesPerCall is None else min(start + framesPerCall, nFrames)
+                try:
+                    diphone, context = self.getPosteriorsOfBothOutputsWithEncoded(
+                        session, encoderFrames[start:end], classLabels)
+                except tf.errors.ResourceExhaustedError:
+                    if end - start <= 1:
+                        raise
+                    # fallback: smaller calls for the rest of the data
+                    framesPerCall = (end - start) // 2
+                    print("Out of memory for %d frames x %d labels, continue with %d frames per call" % (
+                        end - start, len(classLabels), framesPerCall))
+                    continue
+                # (nContexts, nStateClasses)
+                batchSums = diphone.sum(axis=1, dtype=np.float64)
+                diphoneSums = batchSums if diphoneSums is None else diphoneSums + batchSums
                 # context is not label dependent
-                if not pastContextId:
-                    ctx = (sampleCount * self.contextMeans) + (bSize * np.mean(p[1][0], axis=0))
-                    self.contextMeans = np.divide(ctx, denom)
-            sampleCount += bSize
+                contextSum += context[0].sum(axis=0, dtype=np.float64)
+                start = end
+            sampleCount += int(seqLengths.sum())
+
+        if diphoneSums is None:
+            diphoneSums = np.zeros((self.nContexts, len(self.diphoneMeans[0])), dtype=np.float64)
+        denom = max(sampleCount, 1)
+        self.diphoneMeans = {pastContextId: diphoneSums[pastContextId] / denom for pastContextId in range(self.nContexts)}
+        self.contextMeans = contextSum / denom
 
         with open(tk.uncached_path(self.numSegments[taskId - 1]), "wb") as fp:
             pickle.dump(sampleCount, fp, protocol=pickle.HIGHEST_PROTOCOL)
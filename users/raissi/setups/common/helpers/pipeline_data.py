@@ -6,10 +6,13 @@ from i6_core.lib.rasr_cache import FileArchive, FileArchiveBundle
 import h5py
 import itertools as it
 import numpy as np
+import os
 from enum import Enum
 
 from IPython import embed
 
+from i6_experiments.users.rossenbach.lib.hdf import BufferedHDFWriter
+
 Path = setup_path(__package__)
 
 
@@ -108,9 +111,20 @@ class PipelineStages:
 
 
 class SprintFeatureToHdf(Job):
+  """
+  Converts RASR feature caches into one HDF per cache.
+
+  layout "per_segment": one dataset per segment under streams/features/data/<name>
+  layout "contiguous": RETURNN HDFDataset format, i.e. all frames in a single chunked "inputs" dataset
+    with "seqTags" and "seqLengths" as index, segments are read with slices
+  """
+
+  __sis_hash_exclude__ = {"layout": "per_segment"}
 
-  def __init__(self, feature_caches):
+  def __init__(self, feature_caches, layout="per_segment"):
+    assert layout in ["per_segment", "contiguous"], "invalid layout: %s" % layout
     self.feature_caches = feature_caches
+    self.layout = layout
     self.hdf_files = [self.output_path('data.hdf.%d' % d, cached=False) for d in range(len(feature_caches))]
     self.rqmt = {'cpu': 1, 'mem': 8, 'time': 1.0}
 
@@ -118,6 +132,9 @@ class SprintFeatureToHdf(Job):
     yield Task('run', resume='run', rqmt=self.rqmt, args=range(1, (len(self.feature_caches) + 1)))
 
   def run(self, task_id):
+    if self.layout == "contiguous":
+      self.run_contiguous(task_id)
+      return
 
     seq_names = []
     string_dt = h5py.special_dtype(vlen=str)
@@ -146,3 +163,24 @@ class SprintFeatureToHdf(Job):
       feature_data.create_dataset(seq_names[-1].replace('/', '\\'), data=features)
 
     out.create_dataset('seq_names', data=[s.encode() for s in seq_names], dtype=string_dt)
+    out.close()
+
+  def run_contiguous(self, task_id):
+    feature_cache = FileArchive(tk.uncached_path(self.feature_caches[task_id - 1]))
+    out_path = self.hdf_files[task_id - 1].get_path()
+    if os.path.exists(out_path):
+      # the writer does not overwrite existing files, remove the output of an earlier attempt
+      os.remove(out_path)
+
+    writer = None
+    for file in feature_cache.ft:
+      info = feature_cache.ft[file]
+      if info.name.endswith('.attribs'):
+        continue
+      times, features = feature_cache.read(file, 'feat')
+      features = np.asarray(features, dtype=np.float32)
+      if writer is None:
+        writer = BufferedHDFWriter(out_path, dim=features.shape[1], ndim=2, chunk_frames=4096)
+      writer.insert_batch(features[None], [features.shape[0]], [info.name])
+    assert writer is not None, "no features found in %s" % self.feature_caches[task_id - 1]
+    writer.close()
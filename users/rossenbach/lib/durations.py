@@ -0,0 +1,164 @@
+"""
+NumPy kernels to convert frame-level alignments into (token, duration) sequences
+"""
+import numpy
+
+
+def run_length_encode(labels):
+  """
+  :param numpy.ndarray labels: (T,)
+  :return: run starts, run values and run lengths
+  :rtype: (numpy.ndarray, numpy.ndarray, numpy.ndarray)
+  """
+  labels = numpy.asarray(labels)
+  if len(labels) == 0:
+    empty = numpy.zeros((0,), dtype=numpy.int64)
+    return empty, labels[:0], empty
+  starts = numpy.flatnonzero(numpy.concatenate([[True], labels[1:] != labels[:-1]]))
+  lengths = numpy.diff(numpy.append(starts, len(labels)))
+  return starts, labels[starts], lengths
+
+
+def viterbi_to_durations(alignment, blank_token):
+  """
+  Converts a CTC/Viterbi label alignment to durations.
+  Blank frames are merged into the preceding label, and a label only starts a new token
+  if it differs from the previous frame, e.g. [1, blank, 1, 1] -> [2, 2].
+
+  :param numpy.ndarray alignment: (T,) or (T, 1)
+  :param int blank_token:
+  :return: durations per token, (num_tokens,)
+  :rtype: numpy.ndarray
+  """
+  alignment = numpy.asarray(alignment).reshape(-1)
+  if len(alignment) == 0:
+    return numpy.zeros((0,), dtype=numpy.int32)
+  assert alignment[0] != blank_token, "alignment must not start with the blank token"
+  is_start = alignment != blank_token
+  is_start[1:] &= alignment[1:] != alignment[:-1]
+  starts = numpy.flatnonzero(is_start)
+  return numpy.diff(numpy.append(starts, len(alignment))).astype(numpy.int32)
+
+
+def _viterbi_to_durations_loop(alignment, blank_token):
+  """
+  frame-wise reference implementation of :func:`viterbi_to_durations`, only used for the benchmark
+  """
+  durations = []
+  for idx, p in enumerate(alignment):
+    if p == blank_token:
+      durations[-1] += 1
+    elif idx != 0 and alignment[idx] == alignment[idx - 1]:
+      durations[-1] += 1
+    else:
+      durations.append(1)
+  return durations
+
+
+class AllophoneDurationTable:
+  """
+  Per allophone-index lookup tables for :func:`rasr_alignment_to_durations`,
+  computed once instead of splitting the allophone string for every frame.
+  """
+
+  def __init__(self, allophones, silence_token, boundary_token):
+    """
+    :param list[str] allophones: allophone string per allophone index, e.g. from FileArchive.allophones
+    :param str silence_token: is mapped to the boundary token
+    :param str boundary_token:
+    """
+    self.boundary_token = boundary_token
+    first_index = {}
+    phonemes = []
+    for allophone in allophones:
+      first_index.setdefault(allophone, len(first_index))
+      phoneme = allophone.split("{", 1)[0].rstrip()
+      phonemes.append(boundary_token if phoneme == silence_token else phoneme)
+    # identical allophone strings get the same id, so runs are determined on the strings
+    self.allophone_ids = numpy.array([first_index[allophone] for allophone in allophones], dtype=numpy.int64)
+    self.phonemes = numpy.array(phonemes, dtype=object)
+    self.word_initial = numpy.array(["@i" in allophone for allophone in allophones], dtype=bool)
+    self.is_boundary = numpy.array([phoneme == boundary_token for phoneme in phonemes], dtype=bool)
+    self.contains_boundary = numpy.array([boundary_token in phoneme for phoneme in phonemes], dtype=bool)
+
+
+def rasr_alignment_to_durations(times, allophone_indices, table, num_frames=None):
+  """
+  Converts a RASR allophone alignment to phoneme durations.
+  Silence is mapped to the boundary token, and a boundary token with duration 0 is inserted
+  at word starts which are not preceded by silence.
+
+  :param numpy.ndarray times: frame index of each alignment item
+  :param numpy.ndarray allophone_indices: allophone index of each alignment item
+  :param AllophoneDurationTable table:
+  :param int|None num_frames: end of the last token, len(times) if None
+  :return: durations and the matching labels
+  :rtype: (numpy.ndarray, list[str])
+  """
+  times = numpy.asarray(times, dtype=numpy.int64)
+  ids = table.allophone_ids[numpy.asarray(allophone_indices, dtype=numpy.int64)]
+  assert len(ids) > 0, "empty alignment"
+  starts, run_ids, run_lengths = run_length_encode(ids)
+  run_allophones = numpy.asarray(allophone_indices)[starts]
+
+  # insert a boundary before word starts if the previous label is not a boundary
+  insert = numpy.zeros(len(starts), dtype=bool)
+  insert[1:] = (
+    ~table.contains_boundary[run_allophones[:-1]]
+    & table.word_initial[run_allophones[1:]]
+    & ~table.is_boundary[run_allophones[1:]]
+  )
+  # a label change directly after an inserted boundary is only valid at a word start
+  invalid = numpy.zeros(len(starts), dtype=bool)
+  invalid[1:] = ~insert[1:] & insert[:-1] & (run_lengths[:-1] == 1)
+  assert not invalid.any(), "Check your data, this should not be reached!"
+
+  start_times = times[starts]
+  start_times[0] = 0
+  end = len(times) if num_frames is None else num_frames
+  run_durations = numpy.diff(numpy.append(start_times, end))
+
+  # interleave runs and inserted boundaries
+  num_tokens = len(starts) + int(insert.sum())
+  positions = numpy.arange(len(starts)) + numpy.cumsum(insert)
+  durations = numpy.zeros(num_tokens, dtype=numpy.int64)
+  durations[positions] = run_durations
+  labels = numpy.full(num_tokens, table.boundary_token, dtype=object)
+  labels[positions] = table.phonemes[run_allophones]
+  return durations, list(labels)
+
+
+def benchmark_viterbi_to_durations(num_seqs=1000, seq_len=500, num_labels=80):
+  """
+  Compares :func:`viterbi_to_durations` with the frame-wise python loop it replaces.
+
+  :param int num_seqs:
+  :param int seq_len:
+  :param int num_labels: the last label is used as blank
+  :return: frames per second per implementation
+  :rtype: dict[str,float]
+  """
+  import time
+  rng = numpy.random.RandomState(42)
+  blank = num_labels - 1
+  seqs = []
+  for _ in range(num_seqs):
+    # labels with random durations and some blank frames in between
+    labels = rng.randint(0, num_labels - 1, size=seq_len // 4)
+    seq = numpy.repeat(labels, rng.randint(1, 5, size=len(labels)))[:seq_len]
+    seq[1:][rng.rand(len(seq) - 1) < 0.1] = blank
+    seqs.append(seq)
+  num_frames = sum(len(seq) for seq in seqs)
+  results = {}
+  for name, func in [("loop", _viterbi_to_durations_loop), ("numpy", viterbi_to_durations)]:
+    start = time.monotonic()
+    outputs = [func(seq, blank) for seq in seqs]
+    results[name] = num_frames / (time.monotonic() - start)
+    if name == "loop":
+      reference = outputs
+  assert all(list(a) == list(b) for a, b in zip(reference, outputs))
+  return results
+
+
+if __name__ == "__main__":
+  print(benchmark_viterbi_to_durations())
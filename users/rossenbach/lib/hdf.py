@@ -142,8 +142,8 @@ class SimpleHDFWriter:
         assert shape[0] is None
         self._extra_num_time_steps[data_key] = self._datasets[data_key].shape[0]
       else:
-        self._datasets[data_key] = self._file['targets/data'].create_dataset(
-          data_key, shape=[d if d else 0 for d in shape], dtype=dtype, maxshape=shape)
+        self._datasets[data_key] = self._create_dataset(
+          self._file['targets/data'], data_key, shape=[d if d else 0 for d in shape], dtype=dtype, maxshape=shape)
         self._file['targets/size'].attrs[data_key] = [dim or 1, ndim]
         self._extra_num_time_steps[data_key] = 0
       self._prepared_extra.add(data_key)
@@ -153,6 +153,17 @@ class SimpleHDFWriter:
       self._seq_lengths.resize(1 + len(self._prepared_extra), axis=1)
     return bool(added_count)
 
+  def _create_dataset(self, group, name, shape, dtype, maxshape):
+    """
+    :param h5py.Group group:
+    :param str name:
+    :param tuple[int]|list[int] shape:
+    :param dtype:
+    :param tuple[int|None]|list[int|None] maxshape:
+    :rtype: h5py.Dataset
+    """
+    return group.create_dataset(name, shape, dtype=dtype, maxshape=maxshape)
+
   def _insert_h5_inputs(self, raw_data):
     """
     Inserts a record into the hdf5-file.
@@ -166,8 +177,8 @@ class SimpleHDFWriter:
       # Just expect that the same dataset already exists.
       self._datasets[name] = self._file[name]
     if name not in self._datasets:
-      self._datasets[name] = self._file.create_dataset(
-        name, raw_data.shape, raw_data.dtype, maxshape=tuple(None for _ in raw_data.shape))
+      self._datasets[name] = self._create_dataset(
+        self._file, name, raw_data.shape, raw_data.dtype, maxshape=tuple(None for _ in raw_data.shape))
     else:
       old_shape = self._datasets[name].shape
       self._datasets[name].resize(old_shape[0] + raw_data.shape[0], axis=0)
@@ -176,13 +187,14 @@ class SimpleHDFWriter:
     self._file.attrs['numTimesteps'] += raw_data.shape[0]
     self._file.attrs['numSeqs'] += 1
 
-  def _insert_h5_other(self, data_key, raw_data, dtype=None, add_time_dim=False, dim=None):
+  @staticmethod
+  def _to_extra_array(raw_data, dtype=None, add_time_dim=False):
     """
-    :param str data_key:
     :param numpy.ndarray|int|float|list[int] raw_data: shape=(time,data) or shape=(time,) or shape=()...
     :param str|None dtype:
     :param bool add_time_dim:
-    :param int|None dim:
+    :return: array with time axis
+    :rtype: numpy.ndarray
     """
     if isinstance(raw_data, (int, float, list, numpy.float32)):
       raw_data = numpy.array(raw_data)
@@ -192,22 +204,48 @@ class SimpleHDFWriter:
     assert raw_data.ndim > 0 and raw_data.shape[0] > 0
     if dtype:
       raw_data = raw_data.astype(dtype)
+    return raw_data
+
+  @staticmethod
+  def _extra_dim(raw_data):
+    """
+    :param numpy.ndarray raw_data:
+    :rtype: int
+    """
+    if raw_data.ndim > 1:
+      return raw_data.shape[-1]
+    return 1  # dummy
+
+  @staticmethod
+  def _extra_dtype(raw_data):
+    """
+    :param numpy.ndarray raw_data:
+    :return: dtype name as expected by :func:`_prepare_extra`
+    :rtype: str
+    """
+    if raw_data.dtype == object:
+      # Is this a string?
+      assert isinstance(raw_data.flat[0], (str, bytes))
+      return "string"
+    return raw_data.dtype.name
+
+  def _insert_h5_other(self, data_key, raw_data, dtype=None, add_time_dim=False, dim=None):
+    """
+    :param str data_key:
+    :param numpy.ndarray|int|float|list[int] raw_data: shape=(time,data) or shape=(time,) or shape=()...
+    :param str|None dtype:
+    :param bool add_time_dim:
+    :param int|None dim:
+    """
+    raw_data = self._to_extra_array(raw_data, dtype=dtype, add_time_dim=add_time_dim)
     if dim is None:
-      if raw_data.ndim > 1:
-        dim = raw_data.shape[-1]
-      else:
-        dim = 1  # dummy
+      dim = self._extra_dim(raw_data)
 
     # We assume that _insert_h5_inputs was called before.
     assert self._file.attrs['numSeqs'] > 0 and self._seq_lengths.shape[0] > 0
     seq_idx = self._file.attrs['numSeqs'] - 1
 
-    if raw_data.dtype == numpy.object:
-      # Is this a string?
-      assert isinstance(raw_data.flat[0], (str, bytes))
-      dtype = "string"
-    else:
-      dtype = raw_data.dtype.name
+    dtype = self._extra_dtype(raw_data)
     if self._prepare_extra({data_key: (dim, raw_data.ndim, dtype)}):
       # We added it now. Maybe other extra data keys were added before. The data_key_idx is different now.
       # Thus, seq_lengths might have become invalid. Reinit them.
@@ -236,27 +274,7 @@ class SimpleHDFWriter:
       Must be batch-major, and following the time, then the feature.
     """
     n_batch = len(seq_tag)
-    assert n_batch == inputs.shape[0]
-    assert inputs.ndim == self.ndim + 1  # one more for the batch-dim
-    if not isinstance(seq_len, dict):
-      seq_len = {0: seq_len}
-    assert isinstance(seq_len, dict)
-    assert all([isinstance(key, int) and isinstance(value, (list, numpy.ndarray)) for (key, value) in seq_len.items()])
-    if seq_len:
-      ndim_with_seq_len = max(seq_len.keys()) + 1
-    else:
-      ndim_with_seq_len = 0
-    sparse = ndim_with_seq_len == self.ndim
-    assert ndim_with_seq_len <= self.ndim
-    assert all([0 <= key < ndim_with_seq_len for key in seq_len.keys()])
-    assert len(seq_len) == ndim_with_seq_len
-    assert all([n_batch == len(value) for (key, value) in seq_len.items()])
-    assert all([max(value) == inputs.shape[key + 1] for (key, value) in seq_len.items()])
-    if self.dim and not sparse:
-      assert self.dim == inputs.shape[-1]
-    if extra:
-      assert all([n_batch == value.shape[0] for value in extra.values()]), (
-        "n_batch %i, extra shapes: %r" % (n_batch, {key: value.shape for (key, value) in extra.items()}))
+    seq_len, ndim_with_seq_len, sparse = self._check_batch(inputs, seq_len, seq_tag, extra)
 
     seqlen_offset = self._seq_lengths.shape[0]
     self._seq_lengths.resize(seqlen_offset + n_batch, axis=0)
@@ -264,18 +282,8 @@ class SimpleHDFWriter:
 
     for i in range(n_batch):
       self._seq_tags[seqlen_offset + i] = numpy.array(seq_tag[i], dtype=self._seq_tags.dtype)
-      # Note: Currently, our HDFDataset does not support to have multiple axes with dynamic length.
-      # Thus, we flatten all together, and calculate the flattened seq len.
-      # (Ignore this if there is only a single time dimension.)
-      flat_seq_len = int(numpy.prod([seq_len[axis][i] for axis in range(ndim_with_seq_len)]))
-      assert flat_seq_len > 0
-      flat_shape = [flat_seq_len]
-      if self.dim and not sparse:
-        flat_shape.append(self.dim)
-      self._seq_lengths[seqlen_offset + i, 0] = flat_seq_len
-      data = inputs[i]
-      data = data[tuple([slice(None, seq_len[axis][i]) for axis in range(ndim_with_seq_len)])]
-      data = numpy.reshape(data, flat_shape)
+      data = self._get_flat_seq(inputs, seq_len, ndim_with_seq_len, sparse, i)
+      self._seq_lengths[seqlen_offset + i, 0] = data.shape[0]
       self._insert_h5_inputs(data)
       if len(seq_len) > 1:
         # Note: Because we have flattened multiple axes with dynamic len into a single one,
@@ -295,6 +303,55 @@ class SimpleHDFWriter:
             {key: value.shape if isinstance(value, numpy.ndarray) else repr(value) for (key, value) in extra.items()}))
           raise
 
+  def _check_batch(self, inputs, seq_len, seq_tag, extra):
+    """
+    Checks the arguments of :func:`insert_batch`.
+
+    :return: seq_len as dict, number of axes with dynamic length, whether the inputs are sparse
+    :rtype: (dict[int,list[int]|numpy.ndarray], int, bool)
+    """
+    n_batch = len(seq_tag)
+    assert n_batch == inputs.shape[0]
+    assert inputs.ndim == self.ndim + 1  # one more for the batch-dim
+    if not isinstance(seq_len, dict):
+      seq_len = {0: seq_len}
+    assert isinstance(seq_len, dict)
+    assert all([isinstance(key, int) and isinstance(value, (list, numpy.ndarray)) for (key, value) in seq_len.items()])
+    if seq_len:
+      ndim_with_seq_len = max(seq_len.keys()) + 1
+    else:
+      ndim_with_seq_len = 0
+    sparse = ndim_with_seq_len == self.ndim
+    assert ndim_with_seq_len <= self.ndim
+    assert all([0 <= key < ndim_with_seq_len for key in seq_len.keys()])
+    assert len(seq_len) == ndim_with_seq_len
+    assert all([n_batch == len(value) for (key, value) in seq_len.items()])
+    assert all([max(value) == inputs.shape[key + 1] for (key, value) in seq_len.items()])
+    if self.dim and not sparse:
+      assert self.dim == inputs.shape[-1]
+    if extra:
+      assert all([n_batch == value.shape[0] for value in extra.values()]), (
+        "n_batch %i, extra shapes: %r" % (n_batch, {key: value.shape for (key, value) in extra.items()}))
+    return seq_len, ndim_with_seq_len, sparse
+
+  def _get_flat_seq(self, inputs, seq_len, ndim_with_seq_len, sparse, i):
+    """
+    Note: Currently, our HDFDataset does not support to have multiple axes with dynamic length.
+    Thus, we flatten all together, and calculate the flattened seq len.
+    (Ignore this if there is only a single time dimension.)
+
+    :return: data of the i-th sequence with shape (flat_seq_len,) or (flat_seq_len, dim)
+    :rtype: numpy.ndarray
+    """
+    flat_seq_len = int(numpy.prod([seq_len[axis][i] for axis in range(ndim_with_seq_len)]))
+    assert flat_seq_len > 0
+    flat_shape = [flat_seq_len]
+    if self.dim and not sparse:
+      flat_shape.append(self.dim)
+    data = inputs[i]
+    data = data[tuple([slice(None, seq_len[axis][i]) for axis in range(ndim_with_seq_len)])]
+    return numpy.reshape(data, flat_shape)
+
   def close(self):
     """
     Closes the file.
@@ -315,28 +372,314 @@ class SimpleHDFWriter:
       self.tmp_filename = None
 
 
+class BufferedHDFWriter(SimpleHDFWriter):
+  """
+  :class:`SimpleHDFWriter` which collects inserted sequences in memory and appends them with
+  a single resize and write per dataset once the buffer exceeds ``buffer_bytes``,
+  instead of resizing every dataset once per sequence.
+  The resulting file is the same as with :class:`SimpleHDFWriter`.
+
+  The data is only written on :func:`flush` or :func:`close`, so :func:`close` must be called.
+  """
+
+  def __init__(self, filename, dim, labels=None, ndim=None, extra_type=None, extend_existing_file=False,
+               buffer_bytes=64 * 1024 * 1024, chunk_frames=None, compression=None, compression_opts=None):
+    """
+    :param str filename:
+    :param int|None dim:
+    :param list[str]|None labels:
+    :param int ndim: counted without batch
+    :param dict[str,(int,int,str)]|None extra_type: key -> (dim,ndim,dtype)
+    :param bool extend_existing_file:
+    :param int buffer_bytes: flush once the buffered data exceeds this size
+    :param int|None chunk_frames: chunk size along the time axis for the data datasets, h5py default if None
+    :param str|None compression: e.g. "gzip" or "lzf", applied to numeric data datasets
+    :param int|None compression_opts:
+    """
+    self.buffer_bytes = buffer_bytes
+    self.chunk_frames = chunk_frames
+    self.compression = compression
+    self.compression_opts = compression_opts
+    self._buffer = []  # type: typing.List[typing.Tuple[str, numpy.ndarray, typing.Dict[str, numpy.ndarray]]]
+    self._buffer_size = 0
+    super().__init__(
+      filename, dim=dim, labels=labels, ndim=ndim, extra_type=extra_type, extend_existing_file=extend_existing_file)
+
+  def _create_dataset(self, group, name, shape, dtype, maxshape):
+    kwargs = {}
+    if self.chunk_frames:
+      kwargs["chunks"] = (self.chunk_frames,) + tuple(max(d, 1) for d in shape[1:])
+    if self.compression and numpy.dtype(dtype).kind in "biuf":
+      kwargs["compression"] = self.compression
+      kwargs["compression_opts"] = self.compression_opts
+    return group.create_dataset(name, shape, dtype=dtype, maxshape=maxshape, **kwargs)
+
+  def insert_batch(self, inputs, seq_len, seq_tag, extra=None):
+    """
+    See :func:`SimpleHDFWriter.insert_batch`.
+    """
+    n_batch = len(seq_tag)
+    seq_len, ndim_with_seq_len, sparse = self._check_batch(inputs, seq_len, seq_tag, extra)
+    for i in range(n_batch):
+      data = self._get_flat_seq(inputs, seq_len, ndim_with_seq_len, sparse, i)
+      seq_extra = {}
+      if len(seq_len) > 1:
+        seq_extra["sizes"] = self._to_extra_array(
+          [seq_len[axis][i] for axis in range(ndim_with_seq_len)], dtype="int32")
+      if extra:
+        for key, value in extra.items():
+          seq_extra[key] = self._to_extra_array(value[i])
+      self._buffer.append((seq_tag[i], data, seq_extra))
+      self._buffer_size += data.nbytes + sum(value.nbytes for value in seq_extra.values())
+    if self._buffer_size >= self.buffer_bytes:
+      self.flush()
+
+  def _append(self, name, group, data):
+    """
+    :param str name: key in self._datasets
+    :param h5py.Group group: group to create the dataset in if it does not exist yet
+    :param numpy.ndarray data:
+    :return: offset of the appended data
+    :rtype: int
+    """
+    if name not in self._datasets:
+      self._datasets[name] = self._create_dataset(
+        group, name, data.shape, data.dtype, maxshape=tuple(None for _ in data.shape))
+      offset = 0
+    else:
+      offset = self._datasets[name].shape[0]
+      self._datasets[name].resize(offset + data.shape[0], axis=0)
+    self._datasets[name][offset:] = data
+    return offset
+
+  def flush(self):
+    """
+    Writes all buffered sequences to the file.
+    """
+    if not self._buffer:
+      return
+    tags, inputs, extras = zip(*self._buffer)
+    n_seqs = len(tags)
+    seqlen_offset = self._seq_lengths.shape[0]
+
+    extra_keys = sorted(set(key for seq_extra in extras for key in seq_extra))
+    for key in extra_keys:
+      assert all(key in seq_extra for seq_extra in extras), "extra data %r must be given for all sequences" % key
+      first = extras[0][key]
+      if self._prepare_extra({key: (self._extra_dim(first), first.ndim, self._extra_dtype(first))}):
+        # seqLengths columns only stay consistent if extra keys are added at the beginning
+        assert seqlen_offset == 0 or self.extend_existing_file
+
+    seq_lengths = numpy.zeros((n_seqs, self._seq_lengths.shape[1]), dtype=self._seq_lengths.dtype)
+    seq_lengths[:, 0] = [data.shape[0] for data in inputs]
+    for key in extra_keys:
+      data_key_idx = sorted(self._prepared_extra).index(key) + 1
+      seq_lengths[:, data_key_idx] = [seq_extra[key].shape[0] for seq_extra in extras]
+
+    self._seq_lengths.resize(seqlen_offset + n_seqs, axis=0)
+    self._seq_lengths[seqlen_offset:] = seq_lengths
+    self._seq_tags.resize(seqlen_offset + n_seqs, axis=0)
+    self._seq_tags[seqlen_offset:] = numpy.array(tags, dtype=self._seq_tags.dtype)
+
+    if self.extend_existing_file and "inputs" not in self._datasets:
+      self._datasets["inputs"] = self._file["inputs"]
+    self._append("inputs", self._file, numpy.concatenate(inputs, axis=0))
+    self._file.attrs['numTimesteps'] += int(seq_lengths[:, 0].sum())
+    self._file.attrs['numSeqs'] += n_seqs
+
+    for key in extra_keys:
+      data = numpy.concatenate([seq_extra[key] for seq_extra in extras], axis=0)
+      self._append(key, self._file['targets/data'], data)
+      self._extra_num_time_steps[key] += data.shape[0]
+
+    self._buffer = []
+    self._buffer_size = 0
+
+  def close(self):
+    """
+    Flushes the remaining sequences and closes the file.
+    """
+    if self._file:
+      self.flush()
+    super().close()
+
+
+def benchmark_hdf_writers(num_seqs=100000, max_seq_len=20, dim=1, **buffered_kwargs):
+  """
+  Writes the same random short sequences with :class:`SimpleHDFWriter`
+  and :class:`BufferedHDFWriter`, one sequence per insert_batch call as done in the duration jobs.
+
+  :param int num_seqs:
+  :param int max_seq_len:
+  :param int dim:
+  :param buffered_kwargs: passed to :class:`BufferedHDFWriter`
+  :return: seconds per writer
+  :rtype: dict[str,float]
+  """
+  import os
+  import tempfile
+  import time
+  rng = numpy.random.RandomState(42)
+  lengths = rng.randint(1, max_seq_len + 1, size=num_seqs)
+  seqs = [rng.randint(0, 100, size=(length, dim)).astype("int32") for length in lengths]
+  tags = ["seq-%i" % i for i in range(num_seqs)]
+  results = {}
+  with tempfile.TemporaryDirectory() as tmp_dir:
+    for name, writer_cls, kwargs in [
+        ("simple", SimpleHDFWriter, {}), ("buffered", BufferedHDFWriter, buffered_kwargs)]:
+      start = time.monotonic()
+      writer = writer_cls(os.path.join(tmp_dir, "%s.hdf" % name), dim=dim, ndim=2, **kwargs)
+      for tag, seq in zip(tags, seqs):
+        writer.insert_batch(seq[None], [seq.shape[0]], [tag])
+      writer.close()
+      results[name] = time.monotonic() - start
+  return results
+
+
+class HDFSequenceReader:
+  """
+  Read access to the "inputs" of a RETURNN HDF file without loading all of it into memory.
+
+  The tag -> (offset, length) index is built once from "seqTags" and "seqLengths".
+  Single sequences can be accessed by tag or index, and :func:`iter_chunks` reads
+  consecutive sequences in contiguous blocks of bounded size.
+  """
+
+  def __init__(self, hdf_filename):
+    """
+    :param str hdf_filename:
+    """
+    self.filename = hdf_filename
+    self._file = h5py.File(hdf_filename, "r")
+    self.attrs = dict(self._file.attrs)  # e.g. inputPattSize, numLabels
+    self._inputs = self._file["inputs"]
+    lengths = self._file["seqLengths"][...]
+    if lengths.ndim == 2:
+      lengths = lengths[:, 0]
+    self.lengths = lengths.astype(numpy.int64)
+    self.offsets = numpy.zeros_like(self.lengths)
+    numpy.cumsum(self.lengths[:-1], out=self.offsets[1:])
+    self.tags = [tag if isinstance(tag, str) else tag.decode() for tag in self._file["seqTags"][...]]
+    assert len(self.tags) == len(self.lengths)
+    self._tag_to_idx = {tag: idx for idx, tag in enumerate(self.tags)}
+
+  def __enter__(self):
+    return self
+
+  def __exit__(self, exc_type, exc_val, exc_tb):
+    self.close()
+
+  def __len__(self):
+    return len(self.tags)
+
+  def __contains__(self, tag):
+    return tag in self._tag_to_idx
+
+  def __getitem__(self, tag):
+    """
+    :param str tag:
+    :rtype: numpy.ndarray
+    """
+    return self.get_by_index(self._tag_to_idx[tag])
+
+  def index(self, tag):
+    """
+    :param str tag:
+    :return: position of the sequence in the file
+    :rtype: int
+    """
+    return self._tag_to_idx[tag]
+
+  def get_by_index(self, idx):
+    """
+    :param int idx:
+    :rtype: numpy.ndarray
+    """
+    offset = self.offsets[idx]
+    return self._inputs[offset:offset + self.lengths[idx]]
+
+  def iter_chunks(self, max_frames=1000000, indices=None):
+    """
+    Reads consecutive sequences with a single read per chunk.
+    A chunk holds at most max_frames frames, unless a single sequence is longer.
+
+    :param int max_frames:
+    :param list[int]|None indices: sorted subset of sequence indices to read, all if None
+    :return: generator of lists of (tag, data)
+    :rtype: typing.Iterator[list[(str, numpy.ndarray)]]
+    """
+    if indices is None:
+      indices = range(len(self))
+    chunk = []
+    for idx in indices:
+      end = self.offsets[idx] + self.lengths[idx]
+      if chunk and end - self.offsets[chunk[0]] > max_frames:
+        yield self._read_chunk(chunk)
+        chunk = []
+      chunk.append(idx)
+    if chunk:
+      yield self._read_chunk(chunk)
+
+  def _read_chunk(self, indices):
+    """
+    :param list[int] indices: sorted sequence indices
+    :rtype: list[(str, numpy.ndarray)]
+    """
+    begin = self.offsets[indices[0]]
+    block = self._inputs[begin:self.offsets[indices[-1]] + self.lengths[indices[-1]]]
+    return [
+      (self.tags[idx], block[self.offsets[idx] - begin:self.offsets[idx] - begin + self.lengths[idx]])
+      for idx in indices]
+
+  def iter_sequences(self, max_frames=1000000):
+    """
+    :param int max_frames: see :func:`iter_chunks`
+    :return: generator of (tag, data) in file order
+    :rtype: typing.Iterator[(str, numpy.ndarray)]
+    """
+    for chunk in self.iter_chunks(max_frames=max_frames):
+      yield from chunk
+
+  def close(self):
+    if self._file:
+      self._file.close()
+      self._file = None
+
+
 def load_default_data(hdf_filename):
     """
     opens a hdf file an reads the default "data" as numpy array plus the list of sequence tags
 
+    Note that this keeps the whole file in memory, use :class:`HDFSequenceReader` for large files.
+
     :param hdf_filename:
     :return: tuple of numpy.array data and data tags
     """
-    input_data = h5py.File(hdf_filename, "r")
-    inputs = input_data["inputs"]
-    seq_tags = input_data["seqTags"]
-    lengths = input_data["seqLengths"]
+    data_seqs, data_tags = load_default_data_seqs(hdf_filename)
+    return numpy.array(list(data_seqs)), data_tags
+
+
+def load_default_data_seqs(hdf_filename):
+    """
+    Like :func:`load_default_data`, but the data is always a 1D object array with one array per sequence,
+    also when all sequences have the same length (where numpy.array() would stack them)
+    or different lengths (where numpy.array() fails in recent numpy versions).
 
-    # Load data
+    :param hdf_filename:
+    :return: tuple of numpy.array (dtype object) data and data tags
+    """
     data_seqs = []
     data_tags = []
-    offset = 0
+    with HDFSequenceReader(hdf_filename) as reader:
+      for tag, in_data in reader.iter_sequences():
+        data_seqs.append(in_data)
+        data_tags.append(tag)
+
+    data = numpy.empty(len(data_seqs), dtype=object)
+    for i, in_data in enumerate(data_seqs):
+      data[i] = in_data
+    return data, data_tags
 
-    for tag, length in zip(seq_tags, lengths):
-      tag = tag if isinstance(tag, str) else tag.decode()
-      in_data = inputs[offset : offset + length[0]]
-      data_seqs.append(in_data)
-      offset += length[0]
-      data_tags.append(tag)
 
-    return numpy.array(data_seqs), data_tags
+if __name__ == "__main__":
+  print(benchmark_hdf_writers())
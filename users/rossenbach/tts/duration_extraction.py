@@ -2,10 +2,10 @@ import numpy
 from sisyphus import tk, Job, Task
 from typing import Optional, Union
 
-from i6_core.lib.hdf import get_returnn_simple_hdf_writer
 from i6_core.lib import lexicon
 
-from i6_experiments.users.rossenbach.lib.hdf import load_default_data
+from i6_experiments.users.rossenbach.lib.durations import viterbi_to_durations
+from i6_experiments.users.rossenbach.lib.hdf import BufferedHDFWriter, HDFSequenceReader
 
 
 class ViterbiAlignmentToDurationsJob(Job):
@@ -26,7 +26,7 @@ class ViterbiAlignmentToDurationsJob(Job):
         """
         :param Path viterbi_alignment: Path to the alignment HDF produced by CTC/Viterbi
         :param Path bliss_lexicon: used to determine the epsilon and do some verification
-        :param tk.Path|None returnn_root:
+        :param tk.Path|None returnn_root: not used anymore, kept for hash compatibility
         :param blank_token: Value of the blank token in CTC, or the phoneme string of the lexicon.
             Will use the last phoneme-inventory index if not provided.
         :param tk.Path|None dataset_to_check:
@@ -43,10 +43,6 @@ class ViterbiAlignmentToDurationsJob(Job):
         yield Task("run", rqmt=self.rqmt)
 
     def run(self):
-        # Load HDF data
-        alignment, tags = load_default_data(self.viterbi_alignment_hdf.get_path())
-        durations_total = []
-
         lex = lexicon.Lexicon()
         lex.load(self.bliss_lexicon.get_path())
         if isinstance(self.blank_token, str):
@@ -57,47 +53,26 @@ class ViterbiAlignmentToDurationsJob(Job):
             assert self.blank_token is None
             skip_token = len(lex.phonemes) - 1
 
-        # sort based on tags
-        if self.check is not None:
-            check, check_tag = load_default_data(self.check.get_path())
+        # sequences are read in contiguous chunks, only the lengths of the dataset to check are needed
+        check = HDFSequenceReader(self.check.get_path()) if self.check is not None else None
 
-        # Alignemnt to duration conversion
-        for alignment_idx, s in enumerate(alignment):
-            durations = []
-            for idx, p in enumerate(s):
+        # Alignment to duration conversion, directly dumped into the HDF
+        writer = BufferedHDFWriter(self.out_durations_hdf.get_path(), dim=1, ndim=2)
+        with HDFSequenceReader(self.viterbi_alignment_hdf.get_path()) as alignment:
+            for alignment_idx, (tag, s) in enumerate(alignment.iter_sequences()):
                 # Skip_token only appears now if 2 labels following each other are the same.
                 #   Example [1,skip_token,1] -> [1,1]
-                if p == skip_token:
-                    durations[-1] += 1
-                    continue
-                if idx != 0 and s[idx] != s[idx - 1]:
-                    durations.append(1)
-                elif idx != 0 and s[idx] == s[idx - 1]:
-                    durations[-1] += 1
-                else:
-                    durations.append(1)
-            # Check if lengths match if dataset is provided
-            if self.check is not None:
-                assert sum(durations) == len(check[alignment_idx]), (
-                    f"durations {sum(durations)} and spectrogram length {len(check[alignment_idx])}"
-                    f"do not match in length "
-                )
-            durations_total.append(durations)
-
-        # Dump into HDF
-        new_lengths = []
-        for seq in durations_total:
-            new_lengths.append([len(seq), 2, 2])
-        duration_sequence = numpy.hstack(durations_total).astype(numpy.int32)
-        dim = 1
-        hdf_writer = get_returnn_simple_hdf_writer(self.returnn_root)
-        writer = hdf_writer(self.out_durations_hdf.get_path(), dim=dim, ndim=2)
-        offset = 0
-        for tag, length in zip(tags, new_lengths):
-            in_data = duration_sequence[offset : offset + length[0]]
-            in_data = numpy.expand_dims(in_data, axis=1)
-            offset += length[0]
-            writer.insert_batch(numpy.asarray([in_data]), [in_data.shape[0]], [tag])
+                durations = viterbi_to_durations(s, skip_token)
+                # Check if lengths match if dataset is provided
+                if check is not None:
+                    assert sum(durations) == check.lengths[alignment_idx], (
+                        f"durations {sum(durations)} and spectrogram length {check.lengths[alignment_idx]}"
+                        f"do not match in length "
+                    )
+                in_data = numpy.expand_dims(durations, axis=1)
+                writer.insert_batch(numpy.asarray([in_data]), [in_data.shape[0]], [tag])
+        if check is not None:
+            check.close()
         print(f"Succesfully converted durations into {(self.out_durations_hdf.get_path())}")
         writer.close()
 
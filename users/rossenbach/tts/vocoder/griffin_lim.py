@@ -16,6 +16,111 @@ from sisyphus import Job, Task, tk
 from i6_core.lib import corpus as bliss_corpus
 
 
+class BatchedGriffinLim:
+    """
+    Griffin-Lim phase reconstruction for a batch of zero-padded magnitude spectrograms.
+
+    STFT and ISTFT are implemented with numpy.fft using the same conventions as
+    librosa in :class:`PhaseReconstructor` (centered frames, constant padding, periodic Hann window).
+    The window is computed once, the window sum-square normalization once per number of frames,
+    and each utterance is normalized with the one of its own number of frames.
+    After every ISTFT the samples behind the end of each utterance are set to zero,
+    so each utterance is reconstructed as if it was processed on its own.
+    """
+
+    def __init__(self, n_fft, hop_length, win_length, iterations):
+        """
+        :param int n_fft:
+        :param int hop_length:
+        :param int win_length:
+        :param int iterations:
+        """
+        from scipy import signal
+        self.n_fft = n_fft
+        self.hop_length = hop_length
+        self.iterations = iterations
+        window = signal.get_window("hann", win_length, fftbins=True)
+        left = (n_fft - win_length) // 2
+        self.window = np.pad(window, (left, n_fft - win_length - left))
+        self._window_sumsquares = {}  # n_frames -> np.ndarray
+
+    def stft(self, waveforms):
+        """
+        :param np.ndarray waveforms: (B, L)
+        :return: (B, n_fft/2+1, 1 + L // hop_length)
+        :rtype: np.ndarray
+        """
+        pad = self.n_fft // 2
+        padded = np.pad(waveforms, ((0, 0), (pad, pad)))
+        n_frames = 1 + waveforms.shape[1] // self.hop_length
+        index = self.hop_length * np.arange(n_frames)[:, None] + np.arange(self.n_fft)[None, :]
+        frames = padded[:, index] * self.window  # (B, T, n_fft)
+        return np.fft.rfft(frames, axis=-1).transpose(0, 2, 1)
+
+    def _overlap_add(self, frames):
+        """
+        :param np.ndarray frames: (B, T, n_fft)
+        :return: (B, n_fft + hop_length * (T - 1))
+        :rtype: np.ndarray
+        """
+        n_batch, n_frames, _ = frames.shape
+        hop = self.hop_length
+        n_blocks = -(-self.n_fft // hop)
+        frames = np.pad(frames, ((0, 0), (0, 0), (0, n_blocks * hop - self.n_fft)))
+        frames = frames.reshape(n_batch, n_frames, n_blocks, hop)
+        out = np.zeros((n_batch, n_frames + n_blocks - 1, hop))
+        for k in range(n_blocks):
+            out[:, k:k + n_frames] += frames[:, :, k]
+        return out.reshape(n_batch, -1)[:, :self.n_fft + hop * (n_frames - 1)]
+
+    def _window_sumsquare(self, n_frames):
+        if n_frames not in self._window_sumsquares:
+            squared = np.broadcast_to(self.window ** 2, (1, n_frames, self.n_fft))
+            self._window_sumsquares[n_frames] = self._overlap_add(squared)[0]
+        return self._window_sumsquares[n_frames]
+
+    def istft(self, spectra, num_samples):
+        """
+        :param np.ndarray spectra: (B, n_fft/2+1, T)
+        :param np.ndarray num_samples: (B,) samples of each utterance, the rest is set to zero
+        :return: (B, hop_length * (T - 1))
+        :rtype: np.ndarray
+        """
+        n_frames = spectra.shape[2]
+        frames = np.fft.irfft(spectra.transpose(0, 2, 1), n=self.n_fft, axis=-1) * self.window
+        waveforms = self._overlap_add(frames)
+        # normalize each utterance by the window sum-square of its own number of frames
+        num_frames = num_samples // self.hop_length + 1
+        window_sumsquare = np.ones_like(waveforms)
+        for n in np.unique(num_frames):
+            utterance_window_sumsquare = self._window_sumsquare(n)
+            window_sumsquare[num_frames == n, :len(utterance_window_sumsquare)] = utterance_window_sumsquare
+        nonzero = window_sumsquare > np.finfo(window_sumsquare.dtype).tiny
+        waveforms[nonzero] /= window_sumsquare[nonzero]
+        pad = self.n_fft // 2
+        waveforms = waveforms[:, pad:pad + self.hop_length * (n_frames - 1)]
+        waveforms[np.arange(waveforms.shape[1])[None, :] >= num_samples[:, None]] = 0.0
+        return waveforms
+
+    def __call__(self, spectrograms):
+        """
+        :param list[np.ndarray] spectrograms: each of shape (n_fft/2+1, T_i)
+        :return: one waveform per spectrogram
+        :rtype: list[np.ndarray]
+        """
+        num_frames = np.array([spec.shape[1] for spec in spectrograms])
+        num_samples = self.hop_length * (num_frames - 1)
+        magnitudes = np.zeros((len(spectrograms), spectrograms[0].shape[0], num_frames.max()))
+        for i, spec in enumerate(spectrograms):
+            magnitudes[i, :, :spec.shape[1]] = np.abs(spec)
+        angles = np.exp(2j * np.pi * np.random.rand(*magnitudes.shape))
+        waveforms = self.istft(magnitudes * angles, num_samples)
+        for i in range(self.iterations):
+            angles = np.exp(1j * np.angle(self.stft(waveforms)))
+            waveforms = self.istft(magnitudes * angles, num_samples)
+        return [waveforms[i, :num_samples[i]] for i in range(len(spectrograms))]
+
+
 class PhaseReconstructor():
 
     def __init__(self, out_folder,
@@ -57,10 +162,18 @@ class PhaseReconstructor():
 
 
         self.reconstruct_function = None
+        self.batched_griffin_lim = None
         if self.backend in ['legacy', 'numpy']:
             self.reconstruct_function = self.griffin_lim
         elif self.backend in ['librosa']:
             self.reconstruct_function = self.librosa_griffin_lim
+        elif self.backend in ['batched']:
+            self.batched_griffin_lim = BatchedGriffinLim(
+                n_fft=self.n_fft,
+                hop_length=int(self.sample_rate*self.window_shift),
+                win_length=int(self.sample_rate*self.window_size),
+                iterations=self.iterations)
+            self.reconstruct_function = self.single_batched_griffin_lim
         else:
             assert False, "invalid backend: %s" % self.backend
 
@@ -96,7 +209,7 @@ class PhaseReconstructor():
         Based on https://github.com/librosa/librosa/issues/434
         """
         angles = np.exp(2j * np.pi * np.random.rand(*spectrogram.shape))
-        complex_spectrogram = np.abs(spectrogram).astype(np.complex)
+        complex_spectrogram = np.abs(spectrogram).astype(complex)
         waveform = self._istft(complex_spectrogram * angles)
         for i in range(self.iterations):
             angles = np.exp(1j * np.angle(self._stft(waveform)))
@@ -111,6 +224,14 @@ class PhaseReconstructor():
                                   win_length=int(self.sample_rate*self.window_size),)
 
 
+    def single_batched_griffin_lim(self, spectrogram):
+        """
+        :param np.ndarray spectrogram:
+        :return: waveform
+        :rtype: np.ndarray
+        """
+        return self.batched_griffin_lim([spectrogram])[0]
+
     def convert(self, data_tuple):
         """
         perform the conversion, possibly multithreaded
@@ -118,9 +239,30 @@ class PhaseReconstructor():
         :param tuple(str, np.array) data_tuple:
         :return:
         """
-        tag = data_tuple[0]
+        tag, lin_spec = self._prepare(*data_tuple)
+        waveform = self.reconstruct_function(lin_spec)
+        return self._finalize(tag, lin_spec, waveform)
+
+    def convert_batch(self, data_tuples):
+        """
+        perform the conversion for multiple utterances at once, only for the "batched" backend
+
+        :param list[tuple(str, np.array)] data_tuples: should be of similar length to avoid padding
+        :return: one result per utterance, see :func:`convert`
+        :rtype: list
+        """
+        assert self.batched_griffin_lim is not None, "convert_batch needs the batched backend"
+        prepared = [self._prepare(tag, lin_spec) for tag, lin_spec in data_tuples]
+        waveforms = self.batched_griffin_lim([lin_spec for _, lin_spec in prepared])
+        return [self._finalize(tag, lin_spec, waveform) for (tag, lin_spec), waveform in zip(prepared, waveforms)]
+
+    def _prepare(self, tag, lin_spec):
+        """
+        :param str tag:
+        :param np.array lin_spec:
+        :return: tag and spectrogram with n_fft/2+1 bins
+        """
         print("reconstructing phase for %s" % tag)
-        lin_spec = data_tuple[1]
 
         # in compliance with the bliss format, create folders if tag is seperated by slashes
         if "/" in tag:
@@ -134,12 +276,19 @@ class PhaseReconstructor():
         if lin_spec.shape[0] == spec_width:
             lin_spec = np.pad(lin_spec, ((1,0),(0,0)), mode='constant', constant_values=0)
         elif lin_spec.shape[0] == spec_width + 1:
-            lin_spec = lin_spec[0, :] = 0
+            lin_spec = lin_spec.copy()
+            lin_spec[0, :] = 0
         else:
             assert False, "invalid feature shape %i in data, n_fft/2 is %i" % (lin_spec.shape[0], spec_width)
+        return tag, lin_spec
 
-        waveform = self.reconstruct_function(lin_spec)
-
+    def _finalize(self, tag, lin_spec, waveform):
+        """
+        :param str tag:
+        :param np.array lin_spec:
+        :param np.array waveform:
+        :return: recording, path or error
+        """
         if self.preemphasis != 0:
             waveform = self.inv_preemphasis(waveform)
 
@@ -149,7 +298,11 @@ class PhaseReconstructor():
         elif self.file_format == "ogg":
             path = os.path.join(self.out_folder, '%s.ogg' % tag)
 
-            save_ogg(waveform, path, self.sample_rate, self.peak_normalization)
+            if self.batched_griffin_lim is not None:
+                # encode within the (long-lived) worker process instead of spawning ffmpeg per file
+                save_ogg_soundfile(waveform, path, self.sample_rate, self.peak_normalization)
+            else:
+                save_ogg(waveform, path, self.sample_rate, self.peak_normalization)
             data, sr = soundfile.read(path)
 
             target_len = self.window_shift * (lin_spec.shape[1] - 2)
@@ -224,16 +377,45 @@ def save_ogg(wav, path, sr, peak_normalization=True):
     p1.terminate()
 
 
+def save_ogg_soundfile(wav, path, sr, peak_normalization=True):
+    """
+    Same as :func:`save_ogg`, but encodes in-process with libsndfile (Vorbis) instead of running ffmpeg.
+
+    :param wav:
+    :param path:
+    :param sr:
+    :return:
+    """
+    if peak_normalization:
+        wav *= 32767 / max(0.01, np.max(np.abs(wav)))
+    else:
+        wav *= 32767
+    soundfile.write(path, wav.astype(np.int16), sr, format="OGG", subtype="VORBIS")
+
+
+def length_sorted_batches(spectrograms, batch_size):
+    """
+    :param list[tuple(str, np.array)] spectrograms: (tag, (F, T))
+    :param int batch_size:
+    :return: lists of indices into spectrograms, utterances of similar length are in the same batch
+    :rtype: list[list[int]]
+    """
+    order = sorted(range(len(spectrograms)), key=lambda i: spectrograms[i][1].shape[1])
+    return [order[i:i + batch_size] for i in range(0, len(order), batch_size)]
+
+
 class HDFPhaseReconstruction(Job):
 
     __sis_hash_exclude__ = {"peak_normalization": True}
 
     def __init__(self, hdf_file, backend, iterations, sample_rate, window_shift, window_size, preemphasis, file_format, peak_normalization=True,
-                 time_rqmt=8, mem_rqmt=8, cpu_rqmt=4):
+                 time_rqmt=8, mem_rqmt=8, cpu_rqmt=4, batch_size=32):
         """
 
         :param tk.Path hdf_file:
-        :param str backend:
+        :param str backend: "legacy"/"numpy" or "librosa" for per-utterance reconstruction,
+            "batched" for reconstructing batch_size utterances of similar length at once
+        :param int batch_size: only used for the "batched" backend
         :param int iterations:
         :param int sample_rate:
         :param float window_shift:
@@ -250,8 +432,11 @@ class HDFPhaseReconstruction(Job):
         self.file_format = file_format
         self.peak_normalization = peak_normalization
 
+        self.batch_size = batch_size
+
         self.out_folder = self.output_path("corpus", directory=True)
         self.out_corpus = self.output_path("corpus/corpus.xml.gz")
+        self.out_throughput = self.output_var("throughput")
 
         self.rqmt = {'time': time_rqmt, 'mem': mem_rqmt, 'cpu': cpu_rqmt}
 
@@ -290,6 +475,20 @@ class HDFPhaseReconstruction(Job):
         # single threaded and then distribute to the workers for conversion
 
         p = multiprocessing.Pool(self.rqmt['cpu'])
+        start_times = os.times()
+        audio_seconds = 0.0
+
+        def process(spectrograms):
+            if self.backend == "batched":
+                batches = length_sorted_batches(spectrograms, self.batch_size)
+                batch_results = p.map(converter.convert_batch, [[spectrograms[i] for i in batch] for batch in batches])
+                # restore the original order
+                recordings = [None] * len(spectrograms)
+                for batch, results in zip(batches, batch_results):
+                    for i, recording in zip(batch, results):
+                        recordings[i] = recording
+                return recordings
+            return p.map(converter.convert, spectrograms)
 
         loaded_spectograms = []
         offset = 0
@@ -298,10 +497,11 @@ class HDFPhaseReconstruction(Job):
             loaded_spectograms.append((tag, np.asarray(rl_inputs[offset:offset + length[0]]).T))
             offset += length[0]
             if len(loaded_spectograms) > 512:
-                recordings = p.map(converter.convert, loaded_spectograms)
+                recordings = process(loaded_spectograms)
 
                 for recording in recordings:
                     corpus.add_recording(recording)
+                    audio_seconds += recording.segments[0].end
 
                 # force gc for minimal memory requirement
                 del loaded_spectograms
@@ -310,10 +510,26 @@ class HDFPhaseReconstruction(Job):
 
         # process rest in the buffer
         if len(loaded_spectograms) > 0:
-            recordings = p.map(converter.convert, loaded_spectograms)
+            recordings = process(loaded_spectograms)
             # put all recordings to the corpus
             for recording in recordings:
                 corpus.add_recording(recording)
+                audio_seconds += recording.segments[0].end
+
+        # worker CPU time is only accounted for after the workers terminated
+        p.close()
+        p.join()
+        end_times = os.times()
+        cpu_seconds = sum(
+            getattr(end_times, field) - getattr(start_times, field)
+            for field in ["user", "system", "children_user", "children_system"])
+        throughput = {
+            "audio_seconds": audio_seconds,
+            "cpu_seconds": cpu_seconds,
+            "audio_seconds_per_cpu_second": audio_seconds / cpu_seconds if cpu_seconds > 0 else float("inf"),
+        }
+        print("Throughput: %r" % throughput)
+        self.out_throughput.set(throughput)
 
         corpus.name = tag.split("/")[0]
         corpus.dump("corpus.xml")
@@ -329,4 +545,5 @@ class HDFPhaseReconstruction(Job):
     def hash(cls, kwargs):
         kwargs.pop('time_rqmt')
         kwargs.pop('mem_rqmt')
+        kwargs.pop('batch_size')
         return super().hash(kwargs)
\ No newline at end of file
@@ -92,7 +92,7 @@ class AugmentBPEAlignmentJob(Job):
   def __init__(self, bpe_align_hdf, phoneme_align_hdf, bpe_blank_idx, phoneme_blank_idx,
                bpe_vocab, phoneme_vocab, phoneme_lexicon, segment_file, time_red_phon_align, time_red_bpe_align,
                time_rqtm=1, mem_rqmt=2, returnn_python_exe=None,
-               returnn_root=None):
+               returnn_root=None, num_workers=1):
     self.returnn_python_exe = (returnn_python_exe if returnn_python_exe is not None else gs.RETURNN_PYTHON_EXE)
     self.returnn_root = (returnn_root if returnn_root is not None else gs.RETURNN_ROOT)
 
@@ -108,14 +108,16 @@ class AugmentBPEAlignmentJob(Job):
 
     self.time_rqmt = time_rqtm
     self.mem_rqtm = mem_rqmt
+    self.num_workers = num_workers
 
     self.out_align = self.output_path("out_align")
     self.out_vocab = self.output_path("out_vocab")
     self.out_skipped_seqs = self.output_path("out_skipped_seqs")
     self.out_skipped_seqs_var = self.output_var("out_skipped_seqs_var")
+    self.out_report = self.output_path("out_report")
 
   def tasks(self):
-    yield Task("run", rqmt={"cpu": 1, "mem": self.mem_rqtm, "time": self.time_rqmt})
+    yield Task("run", rqmt={"cpu": self.num_workers, "mem": self.mem_rqtm, "time": self.time_rqmt})
 
   def run(self):
     command = [
@@ -126,6 +128,7 @@ class AugmentBPEAlignmentJob(Job):
       "--phoneme_lexicon", self.phoneme_lexicon, "--out_align", self.out_align.get_path(),
       "--out_vocab", self.out_vocab.get_path(), "--out_skipped_seqs", self.out_skipped_seqs.get_path(),
       "--segment_file", self.segment_file.get_path(), "--bpe_upsampling_factor", str(self.bpe_upsampling_factor),
+      "--out_report", self.out_report.get_path(), "--num_workers", str(self.num_workers),
       "--returnn_root", self.returnn_root
     ]
 
@@ -136,11 +139,16 @@ class AugmentBPEAlignmentJob(Job):
       skipped_seqs = eval(f.read())
       self.out_skipped_seqs_var.set(skipped_seqs)
 
+  @classmethod
+  def hash(cls, kwargs):
+    kwargs.pop("num_workers")
+    return super().hash(kwargs)
+
 
 class AlignmentStatisticsJob(Job):
   def __init__(self, alignment, seq_list_filter_file=None, blank_idx=0, silence_idx=None,
                time_rqmt=2, returnn_python_exe=None,
-               returnn_root=None):
+               returnn_root=None, cpu_rqmt=1):
     self.returnn_python_exe = (returnn_python_exe if returnn_python_exe is not None else gs.RETURNN_PYTHON_EXE)
     self.returnn_root = (returnn_root if returnn_root is not None else gs.RETURNN_ROOT)
 
@@ -162,24 +170,19 @@ class AlignmentStatisticsJob(Job):
     self.out_99_percentile_var = self.output_var("percentile_99")
 
     self.time_rqmt = time_rqmt
+    self.cpu_rqmt = cpu_rqmt
 
   def tasks(self):
-    yield Task("run", rqmt={"cpu": 1, "mem": 4, "time": self.time_rqmt})
+    yield Task("run", rqmt={"cpu": self.cpu_rqmt, "mem": 4, "time": self.time_rqmt})
 
   def run(self):
-    command = [
-      self.returnn_python_exe,
-      os.path.join(tools_dir, "segment_statistics.py"),
-      tk.uncached_path(self.alignment),
-      "--blank-idx", str(self.blank_idx), "--sil-idx", str(self.silence_idx),
-      "--returnn-root", self.returnn_root
-    ]
-
-    if self.seq_list_filter_file:
-      command += ["--seq-list-filter-file", str(self.seq_list_filter_file)]
-
-    create_executable("rnn.sh", command)
-    subprocess.check_call(["./rnn.sh"])
+    from i6_experiments.users.schmitt.alignment.segment_statistics import calc_segment_statistics
+    stats = calc_segment_statistics(
+      tk.uncached_path(self.alignment), blank_idx=self.blank_idx, sil_idx=self.silence_idx,
+      segment_file=str(self.seq_list_filter_file) if self.seq_list_filter_file else None,
+      num_workers=self.cpu_rqmt)
+    stats.print_summary()
+    stats.write()
 
     with open("label_dep_mean_lens", "r") as f:
       label_dep_means = json.load(f)
@@ -212,6 +215,11 @@ class AlignmentStatisticsJob(Job):
     # shutil.move("label_dep_vars", self.out_label_dep_vars.get_path())
     shutil.move("mean_non_sil_len", self.out_mean_non_sil_len.get_path())
 
+  @classmethod
+  def hash(cls, kwargs):
+    kwargs.pop("cpu_rqmt")
+    return super().hash(kwargs)
+
 
 class AlignmentSplitSilenceJob(Job):
   def __init__(self, hdf_align_path, segment_file, sil_idx, blank_idx, max_len,
@@ -227,22 +235,14 @@ class AlignmentSplitSilenceJob(Job):
     self.out_align = self.output_path("out_align")
 
   def tasks(self):
-    yield Task("run", rqmt={"cpu": 1, "mem": 4, "time": 1, "gpu": 1})
+    yield Task("run", rqmt={"cpu": 1, "mem": 4, "time": 1})
 
   def run(self):
-    command = [
-      self.returnn_python_exe,
-      os.path.join(tools_dir, "alignment_split_silence.py"),
-      self.hdf_align_path.get_path(),
-      "--segment_file", tk.uncached_path(self.segment_file),
-      "--sil_idx", str(self.sil_idx), "--blank_idx", str(self.blank_idx), "--max_len", str(self.max_len.get()),
-      "--returnn_root", self.returnn_root
-    ]
-
-    create_executable("rnn.sh", command)
-    subprocess.check_call(["./rnn.sh"])
-
-    shutil.move("out_alignment", self.out_align.get_path())
+    from i6_experiments.users.schmitt.alignment.transforms import SplitSilence, transform_alignment_hdf
+    transform_alignment_hdf(
+      self.hdf_align_path.get_path(), self.out_align.get_path(),
+      [SplitSilence(sil_idx=self.sil_idx, blank_idx=self.blank_idx, max_len=float(self.max_len.get()))],
+      segment_file=tk.uncached_path(self.segment_file))
 
 
 class ReduceAlignmentJob(Job):
@@ -261,28 +261,18 @@ class ReduceAlignmentJob(Job):
     self.out_skipped_seqs_var = self.output_var("skipped_seqs_var")
 
   def tasks(self):
-    yield Task("run", rqmt={"cpu": 1, "mem": 4, "time": 1, "gpu": 1})
+    yield Task("run", rqmt={"cpu": 1, "mem": 4, "time": 1})
 
   def run(self):
-    command = [
-      self.returnn_python_exe,
-      os.path.join(tools_dir, "reduce_alignment.py"),
-      self.hdf_align_path.get_path(),
-      "--segment_file", tk.uncached_path(self.segment_file),
-      "--sil_idx", str(self.sil_idx), "--blank_idx", str(self.blank_idx),
-      "--reduction_factor", str(self.reduction_factor),
-      "--returnn_root", self.returnn_root
-    ]
-
-    create_executable("rnn.sh", command)
-    subprocess.check_call(["./rnn.sh"])
+    from i6_experiments.users.schmitt.alignment.transforms import ReduceAlignment, transform_alignment_hdf
+    skipped_seqs = transform_alignment_hdf(
+      self.hdf_align_path.get_path(), self.out_align.get_path(),
+      [ReduceAlignment(blank_idx=self.blank_idx, reduction_factor=self.reduction_factor)],
+      segment_file=tk.uncached_path(self.segment_file))
 
-    shutil.move("out_alignment", self.out_align.get_path())
-    shutil.move("skipped_seqs", self.out_skipped_seqs.get_path())
-
-    with open(self.out_skipped_seqs.get_path(), "r") as f:
-      skipped_seqs = eval(f.read())
-      self.out_skipped_seqs_var.set(skipped_seqs)
+    with open(self.out_skipped_seqs.get_path(), "w+") as f:
+      f.write(str(skipped_seqs))
+    self.out_skipped_seqs_var.set(skipped_seqs)
 
 
 class DumpNonBlanksFromAlignmentJob(Job):
@@ -303,23 +293,14 @@ class DumpNonBlanksFromAlignmentJob(Job):
     yield Task("run", rqmt={"cpu": 1, "mem": 4, "time": self.time_rqmt})
 
   def run(self):
-    command = [
-      self.returnn_python_exe,
-      os.path.join(tools_dir, "alignment_dump_non_blanks.py"),
-      self.alignment.get_path(),
-      "--blank_idx", str(self.blank_idx),
-      "--returnn-root", self.returnn_root
-    ]
+    from i6_experiments.users.schmitt.alignment.transforms import RemoveBlanks, transform_alignment_hdf
+    skipped_seqs = transform_alignment_hdf(
+      self.alignment.get_path(), self.out_labels.get_path(), [RemoveBlanks(blank_idx=self.blank_idx)])
+    print("NUM ONLY BLANK: ", len(skipped_seqs))
 
-    create_executable("rnn.sh", command)
-    subprocess.check_call(["./rnn.sh"])
-
-    shutil.move("out_labels", self.out_labels.get_path())
-    shutil.move("skipped_seqs", self.out_skipped_seqs.get_path())
-
-    with open(self.out_skipped_seqs.get_path(), "r") as f:
-      skipped_seqs = eval(f.read())
-      self.out_skipped_seqs_var.set(skipped_seqs)
+    with open(self.out_skipped_seqs.get_path(), "w+") as f:
+      f.write(str(skipped_seqs))
+    self.out_skipped_seqs_var.set(skipped_seqs)
 
   @classmethod
   def hash(cls, kwargs):
@@ -345,21 +326,52 @@ class RemoveLabelFromAlignmentJob(Job):
     yield Task("run", rqmt={"cpu": 1, "mem": 4, "time": self.time_rqmt})
 
   def run(self):
-    command = [
-      self.returnn_python_exe,
-      os.path.join(tools_dir, "alignment_remove_label.py"),
-      self.alignment.get_path(),
-      "--blank_idx", str(self.blank_idx), "--remove_idx", str(self.remove_idx),
-      "--returnn-root", self.returnn_root
-    ]
+    from i6_experiments.users.schmitt.alignment.transforms import RemoveLabel, transform_alignment_hdf
+    transform_alignment_hdf(
+      self.alignment.get_path(), self.out_alignment.get_path(),
+      [RemoveLabel(blank_idx=self.blank_idx, remove_idx=self.remove_idx, remove_only_middle=self.remove_only_middle)])
+
+
+class ChainAlignmentTransformsJob(Job):
+  """
+  Applies several transforms of :mod:`i6_experiments.users.schmitt.alignment.transforms`
+  (e.g. split silence, then reduce) in a single pass over the alignment HDF.
+  """
+
+  def __init__(self, alignment, transforms, segment_file=None, time_rqmt=2):
+    """
+    :param Path alignment:
+    :param list[AlignmentTransform] transforms: applied in order, options must be plain values
+    :param Path|None segment_file:
+    :param int time_rqmt:
+    """
+    self.alignment = alignment
+    self.transforms = transforms
+    self.segment_file = segment_file
 
-    if self.remove_only_middle:
-      command += ["--remove_only_middle"]
+    self.time_rqmt = time_rqmt
 
-    create_executable("rnn.sh", command)
-    subprocess.check_call(["./rnn.sh"])
+    self.out_alignment = self.output_path("out_alignment")
+    self.out_skipped_seqs = self.output_path("skipped_seqs")
+    self.out_skipped_seqs_var = self.output_var("skipped_seqs_var")
+
+  def tasks(self):
+    yield Task("run", rqmt={"cpu": 1, "mem": 4, "time": self.time_rqmt})
+
+  def run(self):
+    from i6_experiments.users.schmitt.alignment.transforms import transform_alignment_hdf
+    skipped_seqs = transform_alignment_hdf(
+      self.alignment.get_path(), self.out_alignment.get_path(), self.transforms,
+      segment_file=tk.uncached_path(self.segment_file) if self.segment_file is not None else None)
+
+    with open(self.out_skipped_seqs.get_path(), "w+") as f:
+      f.write(str(skipped_seqs))
+    self.out_skipped_seqs_var.set(skipped_seqs)
 
-    shutil.move("out_alignment", self.out_alignment.get_path())
+  @classmethod
+  def hash(cls, kwargs):
+    kwargs.pop("time_rqmt")
+    return super().hash(kwargs)
 
 
 class DumpAlignmentFromTxtJob(Job):
@@ -0,0 +1,293 @@
+"""
+Segment statistics of transducer alignments, in-process replacement for
+experiments/swb/transducer/tools/segment_statistics.py with the same output files.
+
+The segment lengths of a whole chunk of sequences are computed at once from the non-blank positions,
+and all statistics are kept in accumulators (sums, bincounts), which can be merged,
+so the HDF can be processed in shards by several processes.
+"""
+
+import json
+
+import numpy as np
+
+
+_long_seg_thresholds = (20, 30, 40, 60, 80)
+
+
+class SegmentStatistics:
+  """
+  Mergeable accumulator of the segment statistics.
+  A segment ends at a non-blank label and starts after the previous non-blank label.
+  """
+
+  def __init__(self, blank_idx, sil_idx=None):
+    """
+    :param int blank_idx:
+    :param int|None sil_idx:
+    """
+    self.blank_idx = blank_idx
+    self.sil_idx = sil_idx
+    self.num_seqs = 0
+    self.num_blank_frames = 0
+    self.num_label_segs = 0
+    self.num_sil_segs = 0
+    self.num_init_sil_segs = 0
+    self.num_final_sil_segs = 0
+    self.init_sil_seg_len = 0
+    self.final_sil_seg_len = 0
+    self.inter_sil_seg_len = 0
+    self.label_seg_len = 0
+    self.max_seg_len = 0
+    self.num_last_idx_blank = 0
+    self.num_seqs_with_long_segs = {threshold: 0 for threshold in _long_seg_thresholds}
+    self.label_seg_len_sums = np.zeros((0,), dtype=np.int64)
+    self.label_num_segs = np.zeros((0,), dtype=np.int64)
+    self.label_order = []  # labels in the order of their first occurrence
+    self.non_sil_len_counts = np.zeros((0,), dtype=np.int64)  # seg len -> count
+    self.sil_len_counts = np.zeros((0,), dtype=np.int64)
+
+  def add_chunk(self, seqs):
+    """
+    :param list[np.ndarray] seqs: alignments, (T,) each
+    """
+    if not seqs:
+      return
+    lengths = np.array([len(seq) for seq in seqs], dtype=np.int64)
+    data = np.concatenate(seqs)
+    starts = np.cumsum(lengths) - lengths
+    self.num_seqs += len(seqs)
+    self.num_last_idx_blank += int(np.sum(data[starts[lengths > 0] + lengths[lengths > 0] - 1] == self.blank_idx))
+
+    non_blank_pos = np.flatnonzero(data != self.blank_idx)
+    seq_idx = np.searchsorted(starts + lengths, non_blank_pos, side="right")
+    pos = non_blank_pos - starts[seq_idx]
+    labels = data[non_blank_pos].astype(np.int64)
+    is_first = np.ones(len(pos), dtype=bool)
+    is_first[1:] = seq_idx[1:] != seq_idx[:-1]
+    is_last = np.ones(len(pos), dtype=bool)
+    is_last[:-1] = is_first[1:]
+    prev_pos = np.zeros(len(pos), dtype=np.int64)
+    prev_pos[1:] = pos[:-1]
+    prev_pos[is_first] = 0
+    # like the original script: +1 whenever the previous position is 0, which is always the case for the first segment
+    seg_len = pos - prev_pos + (prev_pos == 0)
+    is_sil = labels == self.sil_idx if self.sil_idx is not None else np.zeros(len(labels), dtype=bool)
+
+    self.num_blank_frames += len(data) - len(non_blank_pos)
+    self.num_sil_segs += int(is_sil.sum())
+    self.num_label_segs += int((~is_sil).sum())
+    if len(seg_len):
+      self.max_seg_len = max(self.max_seg_len, int(seg_len.max()))
+    for threshold in _long_seg_thresholds:
+      self.num_seqs_with_long_segs[threshold] += len(np.unique(seq_idx[seg_len > threshold]))
+
+    init_sil = is_sil & is_first
+    final_sil = is_sil & is_last & ~is_first
+    self.num_init_sil_segs += int(init_sil.sum())
+    self.num_final_sil_segs += int(final_sil.sum())
+    self.init_sil_seg_len += int(seg_len[init_sil].sum())
+    self.final_sil_seg_len += int(seg_len[final_sil].sum())
+    self.inter_sil_seg_len += int(seg_len[is_sil & ~init_sil & ~final_sil].sum())
+    self.label_seg_len += int(seg_len[~is_sil].sum())
+
+    self.label_seg_len_sums = _add_counts(self.label_seg_len_sums, np.bincount(labels, weights=seg_len))
+    self.label_num_segs = _add_counts(self.label_num_segs, np.bincount(labels))
+    self._add_label_order(labels)
+    self.non_sil_len_counts = _add_counts(self.non_sil_len_counts, np.bincount(seg_len[~is_sil]))
+    self.sil_len_counts = _add_counts(self.sil_len_counts, np.bincount(seg_len[is_sil]))
+
+  def _add_label_order(self, labels):
+    seen = set(self.label_order)
+    unique_labels, first_idx = np.unique(labels, return_index=True)
+    for label in unique_labels[np.argsort(first_idx)]:
+      if int(label) not in seen:
+        self.label_order.append(int(label))
+
+  def merge(self, other):
+    """
+    Adds the statistics of the following sequences in other.
+
+    :param SegmentStatistics other:
+    """
+    for key in [
+        "num_seqs", "num_blank_frames", "num_label_segs", "num_sil_segs", "num_init_sil_segs",
+        "num_final_sil_segs", "init_sil_seg_len", "final_sil_seg_len", "inter_sil_seg_len", "label_seg_len",
+        "num_last_idx_blank"]:
+      setattr(self, key, getattr(self, key) + getattr(other, key))
+    self.max_seg_len = max(self.max_seg_len, other.max_seg_len)
+    for threshold in _long_seg_thresholds:
+      self.num_seqs_with_long_segs[threshold] += other.num_seqs_with_long_segs[threshold]
+    for key in ["label_seg_len_sums", "label_num_segs", "non_sil_len_counts", "sil_len_counts"]:
+      setattr(self, key, _add_counts(getattr(self, key), getattr(other, key)))
+    seen = set(self.label_order)
+    self.label_order += [label for label in other.label_order if label not in seen]
+
+  @property
+  def mean_label_len(self):
+    return self.label_seg_len / self.num_label_segs
+
+  def get_label_dependent_mean_seg_lens(self):
+    """
+    :return: label -> mean segment length, labels without segments get the mean non-silence length
+    :rtype: dict[int,float]
+    """
+    means = {
+      label: float(self.label_seg_len_sums[label]) / int(self.label_num_segs[label]) for label in self.label_order}
+    means.update({idx: self.mean_label_len for idx in range(self.blank_idx) if idx not in means})
+    return means
+
+  def write(self, plot=True):
+    """
+    Writes the files of segment_statistics.py into the current directory:
+    statistics, mean_non_sil_len, label_dep_mean_lens, percentile_{90,95,99} and the histograms.
+    """
+    num_inter_sil_segs = self.num_sil_segs - self.num_init_sil_segs - self.num_final_sil_segs
+    mean_init_sil_len = self.init_sil_seg_len / self.num_init_sil_segs if self.num_init_sil_segs > 0 else 0
+    mean_final_sil_len = self.final_sil_seg_len / self.num_final_sil_segs if self.num_final_sil_segs > 0 else 0
+    mean_inter_sil_len = self.inter_sil_seg_len / num_inter_sil_segs if self.inter_sil_seg_len > 0 else 0
+    mean_total_sil_len = (self.init_sil_seg_len + self.final_sil_seg_len + self.inter_sil_seg_len) / self.num_seqs
+    mean_total_label_len = self.label_seg_len / self.num_seqs
+    mean_seq_len = (self.num_blank_frames + self.num_sil_segs + self.num_label_segs) / self.num_seqs
+
+    with open("statistics", "w+") as f:
+      f.write("Segment statistics: \n\n")
+      f.write("\tSilence: \n")
+      f.write("\t\tInitial:\n")
+      f.write("\t\t\tMean length: %f \n" % mean_init_sil_len)
+      f.write("\t\t\tNum segments: %f \n" % self.num_init_sil_segs)
+      f.write("\t\tIntermediate:\n")
+      f.write("\t\t\tMean length: %f \n" % mean_inter_sil_len)
+      f.write("\t\t\tNum segments: %f \n" % num_inter_sil_segs)
+      f.write("\t\tFinal:\n")
+      f.write("\t\t\tMean length: %f \n" % mean_final_sil_len)
+      f.write("\t\t\tNum segments: %f \n" % self.num_final_sil_segs)
+      f.write("\t\tTotal per sequence:\n")
+      f.write("\t\t\tMean length: %f \n" % mean_total_sil_len)
+      f.write("\t\t\tNum segments: %f \n" % self.num_sil_segs)
+      f.write("\n")
+      f.write("\tNon-silence: \n")
+      f.write("\t\tMean length per segment: %f \n" % self.mean_label_len)
+      f.write("\t\tMean length per sequence: %f \n" % mean_total_label_len)
+      f.write("\t\tNum segments: %f \n" % self.num_label_segs)
+      f.write("\n")
+      f.write("Overall maximum segment length: %d \n" % self.max_seg_len)
+      f.write("\n")
+      f.write("\n")
+      f.write("Sequence statistics: \n\n")
+      f.write("\tMean length: %f \n" % mean_seq_len)
+      f.write("\tNum sequences: %f \n" % self.num_seqs)
+
+    with open("mean_non_sil_len", "w+") as f:
+      f.write(str(float(self.mean_label_len)))
+
+    with open("label_dep_mean_lens", "w+") as f:
+      json.dump(self.get_label_dependent_mean_seg_lens(), f)
+
+    # like in the original script, the percentiles of the last non-empty subset are kept
+    percentile_subsets = [(0, (0, 50), "non_sil_histogram.pdf"), (12, (10, 50), "non_sil_histogram_over_11.pdf"),
+                          (30, (30, 100), "non_sil_histogram_over_29.pdf"),
+                          (80, (80, 150), "non_sil_histogram_over_80.pdf")]
+    for min_len, hist_range, filename in percentile_subsets:
+      seg_lens, counts = _nonzero_counts(self.non_sil_len_counts, min_len)
+      if min_len > 0 and len(seg_lens) == 0:
+        continue
+      quantiles = _quantiles(seg_lens, counts, [.90, .95, .99])
+      for n, q in zip([90, 95, 99], quantiles):
+        with open("percentile_%s" % n, "w+") as f:
+          f.write(str(q))
+      if plot:
+        _plot_histogram(seg_lens, counts, 30, hist_range, quantiles, filename)
+
+    if plot:
+      seg_lens, counts = _nonzero_counts(self.sil_len_counts)
+      _plot_histogram(seg_lens, counts, 40, (0, 100), _quantiles(seg_lens, counts, [.90, .95, .99]), "sil_histogram.pdf")
+
+  def print_summary(self):
+    print("Num seqs: %d, seqs ending with blank: %d" % (self.num_seqs, self.num_last_idx_blank))
+    for threshold in _long_seg_thresholds:
+      print("Seqs with segments longer than %d frames: %d" % (threshold, self.num_seqs_with_long_segs[threshold]))
+
+
+def _add_counts(a, b):
+  """
+  Adds two count arrays of possibly different lengths.
+  """
+  if len(a) < len(b):
+    a, b = b, a
+  a = a.copy()
+  a[:len(b)] += b.astype(a.dtype)
+  return a
+
+
+def _nonzero_counts(counts, min_value=0):
+  values = np.flatnonzero(counts)
+  values = values[values >= min_value]
+  return values, counts[values]
+
+
+def _quantiles(values, counts, qs):
+  """
+  Same as np.quantile over the expanded data, which is only created from the counts here.
+  """
+  if len(values) == 0:
+    return []
+  data = np.repeat(values, counts)
+  return [float(np.quantile(data, q)) for q in qs]
+
+
+def _plot_histogram(values, counts, bins, hist_range, quantiles, filename):
+  import matplotlib
+  matplotlib.use("Agg")
+  import matplotlib.pyplot as plt
+  plt.hist(values, bins=bins, range=hist_range, weights=counts)
+  ax = plt.gca()
+  for q in quantiles:
+    ax.axvline(q, color="r")
+  plt.savefig(filename)
+  plt.close()
+
+
+def _calc_shard_statistics(args):
+  hdf_file, indices, blank_idx, sil_idx, max_frames = args
+  from i6_experiments.users.rossenbach.lib.hdf import HDFSequenceReader
+  stats = SegmentStatistics(blank_idx=blank_idx, sil_idx=sil_idx)
+  with HDFSequenceReader(hdf_file) as reader:
+    for chunk in reader.iter_chunks(max_frames=max_frames, indices=indices):
+      stats.add_chunk([data for _, data in chunk])
+  return stats
+
+
+def calc_segment_statistics(hdf_file, blank_idx, sil_idx=None, segment_file=None, num_workers=1, max_frames=1000000):
+  """
+  :param str hdf_file: alignment HDF
+  :param int blank_idx:
+  :param int|None sil_idx:
+  :param str|None segment_file: only use these sequences
+  :param int num_workers: the sequences are split into this many shards, each processed by its own process
+  :param int max_frames: frames read at once
+  :rtype: SegmentStatistics
+  """
+  from i6_experiments.users.rossenbach.lib.hdf import HDFSequenceReader
+  from i6_core.util import uopen
+
+  with HDFSequenceReader(hdf_file) as reader:
+    indices = list(range(len(reader)))
+    if segment_file is not None:
+      with uopen(segment_file, "rt") as f:
+        segments = set(line.strip() for line in f)
+      indices = [idx for idx in indices if reader.tags[idx] in segments]
+
+  shards = [list(shard) for shard in np.array_split(np.array(indices, dtype=np.int64), max(num_workers, 1))]
+  shard_args = [(hdf_file, shard, blank_idx, sil_idx, max_frames) for shard in shards if len(shard) > 0]
+  if num_workers > 1:
+    import multiprocessing
+    with multiprocessing.Pool(num_workers) as pool:
+      shard_stats = pool.map(_calc_shard_statistics, shard_args)
+  else:
+    shard_stats = [_calc_shard_statistics(args) for args in shard_args]
+
+  stats = SegmentStatistics(blank_idx=blank_idx, sil_idx=sil_idx)
+  for shard_stat in shard_stats:
+    stats.merge(shard_stat)
+  return stats
@@ -0,0 +1,187 @@
+"""
+Pure NumPy post-processing of transducer alignments (sparse label sequences with blanks),
+as replacement for the RETURNN scripts in experiments/swb/transducer/tools.
+
+Each transform maps a single alignment to a new one (or None to skip the sequence),
+and :func:`transform_alignment_hdf` applies a chain of transforms in a single pass over the HDF file.
+"""
+
+import numpy as np
+
+
+class AlignmentTransform:
+  """
+  Base class, maps a (T,) label sequence to a new sequence or None if the sequence should be skipped.
+  """
+
+  def __call__(self, data):
+    """
+    :param np.ndarray data: (T,)
+    :rtype: np.ndarray|None
+    """
+    raise NotImplementedError
+
+  def get_out_dim(self, dim):
+    """
+    :param int dim: label dim of the input alignment
+    :rtype: int
+    """
+    return dim
+
+
+class SplitSilence(AlignmentTransform):
+  """
+  Splits silence segments which are longer than max_len frames into several silence segments,
+  like alignment_split_silence.py.
+  A segment of a label ends at the label and starts after the previous non-blank label.
+  """
+
+  def __init__(self, sil_idx, blank_idx, max_len):
+    self.sil_idx = sil_idx
+    self.blank_idx = blank_idx
+    self.max_len = max_len
+
+  def __call__(self, data):
+    data = np.array(data)
+    max_len = np.floor(self.max_len)
+    seg_ends = np.flatnonzero(data != self.blank_idx)
+    seg_starts = np.concatenate([[-1], seg_ends[:-1]])
+    is_sil = data[seg_ends] == self.sil_idx
+    prev_bounds = seg_starts[is_sil]
+    num_splits = ((seg_ends[is_sil] - prev_bounds) / max_len).astype(np.int64)
+    # j + 1 for j in range(num_splits) per silence segment
+    split_idx = np.arange(num_splits.sum()) - np.repeat(np.cumsum(num_splits) - num_splits, num_splits) + 1
+    new_bounds = np.floor(np.repeat(prev_bounds, num_splits) + max_len * split_idx).astype(np.int64)
+    data[new_bounds] = self.sil_idx
+    return data
+
+
+class ReduceAlignment(AlignmentTransform):
+  """
+  Reduces the time resolution by reduction_factor, like reduce_alignment.py.
+  Every label is moved to the first free frame at or after its reduced position.
+  Labels which do not fit at the end replace the last blanks.
+  Sequences with more labels than reduced frames are skipped.
+  """
+
+  def __init__(self, blank_idx, reduction_factor):
+    self.blank_idx = blank_idx
+    self.reduction_factor = reduction_factor
+
+  def __call__(self, data):
+    data = np.asarray(data)
+    red_len = -(-len(data) // self.reduction_factor)
+    label_pos = np.flatnonzero(data != self.blank_idx)
+    if red_len < len(label_pos):
+      return None
+    labels = data[label_pos]
+    # p_k = max(slot_k, p_(k-1) + 1) = k + max_(j<=k) (slot_j - j)
+    k = np.arange(len(labels))
+    new_pos = k + np.maximum.accumulate(label_pos // self.reduction_factor - k) if len(labels) else k
+    num_overflow = int(np.sum(new_pos >= red_len))
+    red_data = np.full(red_len + num_overflow, self.blank_idx, dtype=data.dtype)
+    red_data[new_pos] = labels
+    if num_overflow:
+      # the overflowing labels take the place of the last blanks
+      blank_pos = np.flatnonzero(red_data == self.blank_idx)[-num_overflow:]
+      red_data = np.delete(red_data, blank_pos)
+    assert len(red_data) == red_len
+    return red_data
+
+
+class RemoveBlanks(AlignmentTransform):
+  """
+  Keeps only the non-blank labels, like alignment_dump_non_blanks.py.
+  Sequences with only blanks are skipped. The blank is expected to be the last label.
+  """
+
+  def __init__(self, blank_idx):
+    self.blank_idx = blank_idx
+
+  def __call__(self, data):
+    data = np.asarray(data)
+    labels = data[data != self.blank_idx]
+    return labels if len(labels) > 0 else None
+
+  def get_out_dim(self, dim):
+    return dim - 1
+
+
+class RemoveLabel(AlignmentTransform):
+  """
+  Replaces a label by blank, like alignment_remove_label.py.
+  With remove_only_middle, only occurrences between the first and last other label are replaced.
+  """
+
+  def __init__(self, blank_idx, remove_idx, remove_only_middle=False):
+    self.blank_idx = blank_idx
+    self.remove_idx = remove_idx
+    self.remove_only_middle = remove_only_middle
+
+  def __call__(self, data):
+    data = np.array(data)
+    is_remove = data == self.remove_idx
+    other_pos = np.flatnonzero(~is_remove & (data != self.blank_idx))
+    assert len(other_pos) > 0, "no labels left after removing the label"
+    if self.remove_only_middle:
+      positions = np.arange(len(data))
+      is_remove &= (positions > other_pos[0]) & (positions < other_pos[-1])
+    data[is_remove] = self.blank_idx
+    return data
+
+
+def apply_transforms(data, transforms):
+  """
+  :param np.ndarray data:
+  :param list[AlignmentTransform] transforms:
+  :return: transformed data or None if any of the transforms skips the sequence
+  :rtype: np.ndarray|None
+  """
+  for transform in transforms:
+    data = transform(data)
+    if data is None:
+      return None
+  return data
+
+
+def transform_alignment_hdf(in_hdf, out_hdf, transforms, segment_file=None, max_frames=1000000):
+  """
+  Applies the transforms to all (or the listed) sequences of an alignment HDF in a single read/write pass.
+
+  :param str in_hdf:
+  :param str out_hdf:
+  :param list[AlignmentTransform] transforms:
+  :param str|None segment_file: only process these sequences, in file order
+  :param int max_frames: frames read at once
+  :return: tags of the skipped sequences
+  :rtype: list[str]
+  """
+  from i6_experiments.users.rossenbach.lib.hdf import BufferedHDFWriter, HDFSequenceReader
+  from i6_core.util import uopen
+
+  skipped_tags = []
+  with HDFSequenceReader(in_hdf) as reader:
+    dim = int(reader.attrs["inputPattSize"])
+    for transform in transforms:
+      dim = transform.get_out_dim(dim)
+    indices = None
+    if segment_file is not None:
+      with uopen(segment_file, "rt") as f:
+        segments = set(line.strip() for line in f)
+      indices = [idx for idx, tag in enumerate(reader.tags) if tag in segments]
+
+    writer = BufferedHDFWriter(out_hdf, dim=dim, ndim=1)
+    for chunk in reader.iter_chunks(max_frames=max_frames, indices=indices):
+      for tag, data in chunk:
+        new_data = apply_transforms(data, transforms)
+        if new_data is None:
+          skipped_tags.append(tag)
+          continue
+        seq_len = len(new_data)
+        writer.insert_batch(
+          np.expand_dims(new_data, axis=0).astype("int32"),
+          seq_len={0: np.array([seq_len], dtype="int32")},
+          seq_tag=[tag],
+          extra={"seq_sizes": np.array([[seq_len]], dtype="int32")})
+    writer.close()
+  return skipped_tags
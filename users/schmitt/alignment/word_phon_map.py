@@ -0,0 +1,158 @@
+"""
+Mapping of a word sequence to the pronunciations which make up a phoneme sequence,
+as used to augment BPE alignments with silence (experiments/swb/transducer/tools/augment_bpe_align.py).
+
+The pronunciations of every word are stored in a trie over phoneme ids, and the search keeps one hypothesis
+per number of consumed phonemes (dynamic programming) instead of expanding all combinations of pronunciations.
+"""
+
+import gzip
+import xml.etree.ElementTree as ET
+
+
+def parse_lexicon_file(lexicon_file):
+  """
+  Streaming replacement of parse_lexicon(ET.fromstring(...)) in augment_bpe_align.py.
+
+  :param str lexicon_file: Bliss lexicon, optionally gzipped
+  :return: orth -> list of pronunciations (space separated phonemes), for lemmata with orth and phon
+  :rtype: dict[str,list[str]]
+  """
+  result = {}
+  with open(lexicon_file, "rb") as f:
+    is_gzip = f.read(2) == b"\x1f\x8b"
+  open_func = gzip.open if is_gzip else open
+  with open_func(lexicon_file, "rb") as f:
+    for _, elem in ET.iterparse(f, events=("end",)):
+      if elem.tag != "lemma":
+        continue
+      orths = [orth.text for orth in elem.iter("orth")]
+      prons = [pron.text for pron in elem.iter("phon")]
+      if orths and prons:
+        for orth in orths:
+          result[orth] = prons
+      elem.clear()
+  return result
+
+
+class PronunciationTrie:
+  """
+  Trie over the phoneme ids of the pronunciations of a single word.
+  """
+
+  def __init__(self):
+    self.children = {}  # type: dict[int,PronunciationTrie]
+    self.prons = []  # type: list[tuple[int,str]]  # (index in the lexicon, pronunciation) ending here
+
+  def add(self, phon_ids, pron_idx, pron):
+    node = self
+    for phon_id in phon_ids:
+      node = node.children.setdefault(phon_id, PronunciationTrie())
+    node.prons.append((pron_idx, pron))
+
+  def matches(self, phon_ids, start):
+    """
+    :param list[int] phon_ids:
+    :param int start:
+    :return: (index in the lexicon, pronunciation, end position) of all pronunciations which match at start
+    :rtype: list[(int,str,int)]
+    """
+    result = []
+    node = self
+    pos = start
+    while True:
+      result += [(pron_idx, pron, pos) for pron_idx, pron in node.prons]
+      if pos >= len(phon_ids) or phon_ids[pos] not in node.children:
+        break
+      node = node.children[phon_ids[pos]]
+      pos += 1
+    return result
+
+
+class WordPhonemeMatcher:
+  """
+  Finds the pronunciation of each word such that the concatenation equals the phoneme sequence.
+  Gives the same mapping as the exhaustive (non-greedy) search in augment_bpe_align.py:
+  all hypotheses which consumed the same number of phonemes have the same future,
+  so only the first of them (in the order of the exhaustive search) is kept.
+  """
+
+  def __init__(self, lexicon, special_tokens=("[NOISE]", "[VOCALIZEDNOISE]", "[LAUGHTER]")):
+    """
+    :param dict[str,list[str]] lexicon: orth -> pronunciations, e.g. from :func:`parse_lexicon_file`
+    :param tuple[str] special_tokens: words which are mapped to the phoneme of the same name
+    """
+    self.special_tokens = special_tokens
+    self.phon_to_id = {}  # type: dict[str,int]
+    self.tries = {}  # type: dict[str,PronunciationTrie]
+    for orth, prons in lexicon.items():
+      trie = PronunciationTrie()
+      for pron_idx, pron in enumerate(prons):
+        trie.add(self.phon_ids(pron.split()), pron_idx, pron)
+      self.tries[orth] = trie
+
+  def phon_ids(self, phonemes):
+    """
+    :param list[str] phonemes:
+    :rtype: list[int]
+    """
+    return [self.phon_to_id.setdefault(phon, len(self.phon_to_id)) for phon in phonemes]
+
+  def match(self, words, phonemes):
+    """
+    :param list[str] words:
+    :param list[str] phonemes: phoneme sequence without blank and silence
+    :return: pronunciation per word, or None and the reason why there is no mapping
+    :rtype: (list[str]|None, str|None)
+    """
+    phon_ids = [self.phon_to_id.get(phon, -1) for phon in phonemes]
+    # consumed phonemes -> pronunciations so far, in the order of the exhaustive search
+    hyps = {0: []}
+    for word in words:
+      new_hyps = {}
+      if word in self.special_tokens:
+        for pos, prons in hyps.items():
+          if pos < len(phonemes) and phonemes[pos] == word and pos + 1 not in new_hyps:
+            new_hyps[pos + 1] = prons + [word]
+      else:
+        if word not in self.tries:
+          return None, "word not in lexicon"
+        trie = self.tries[word]
+        for pos, prons in hyps.items():
+          for _, pron, end in sorted(trie.matches(phon_ids, pos)):
+            if end not in new_hyps:
+              new_hyps[end] = prons + [pron]
+      if not new_hyps:
+        return None, "no matching pronunciation"
+      hyps = new_hyps
+    if len(phonemes) not in hyps:
+      return None, "phonemes not consumed"
+    return hyps[len(phonemes)], None
+
+  def match_greedy(self, words, phonemes):
+    """
+    Greedy variant of augment_bpe_align.py, which takes the longest matching pronunciation of each word.
+    Only used to report the difference to :func:`match`.
+
+    :rtype: (list[str]|None, str|None)
+    """
+    phon_ids = [self.phon_to_id.get(phon, -1) for phon in phonemes]
+    pos = 0
+    result = []
+    for word in words:
+      if word in self.special_tokens:
+        if pos >= len(phonemes) or phonemes[pos] != word:
+          return None, "no matching pronunciation"
+        result.append(word)
+        pos += 1
+        continue
+      if word not in self.tries:
+        return None, "word not in lexicon"
+      matches = self.tries[word].matches(phon_ids, pos)
+      if not matches:
+        return None, "no matching pronunciation"
+      _, pron, pos = max(matches, key=lambda match: (match[2], match[0]))
+      result.append(pron)
+    if pos != len(phonemes):
+      return None, "phonemes not consumed"
+    return result, None
@@ -7,31 +7,58 @@ import shutil
 import subprocess
 
 
+def gzip_dir(dirname):
+  """
+  Gzips every file in the dir (not recursive), like ``gzip <dir>/*``.
+
+  :param str dirname:
+  """
+  import gzip
+  for fn in os.listdir(dirname):
+    path = "%s/%s" % (dirname, fn)
+    if fn.endswith(".gz") or not os.path.isfile(path):
+      continue
+    with open(path, "rb") as f_in, gzip.open(path + ".gz", "wb") as f_out:
+      shutil.copyfileobj(f_in, f_out)
+    shutil.copystat(path, path + ".gz")
+    os.remove(path)
+
+
 class CalculateWordErrorRateJob(Job):
-  def __init__(self, refs, hyps):
+  """
+  Same WER as RETURNN's calculate-word-error-rate.py (with --expect_full), but computed in-process, see :mod:`.wer`.
+  """
+
+  def __init__(self, refs, hyps, num_workers=1):
     """
     :param Path refs: Python txt format, seq->txt, whole words
     :param Path hyps: Python txt format, seq->txt, whole words
+    :param int num_workers: number of processes for the alignment, does not influence the hash
     """
     self.refs = refs
     self.hyps = hyps
+    self.num_workers = num_workers
     self.output_wer = self.output_path("wer.txt")
 
+  @classmethod
+  def hash(cls, parsed_args):
+    parsed_args = dict(parsed_args)
+    parsed_args.pop("num_workers")
+    return super().hash(parsed_args)
+
   def run(self):
-    import subprocess
-    args = [
-      "%s/returnn/tools/calculate-word-error-rate.py" % tk.gs.BASE_DIR,
-      "--expect_full",
-      "--hyps", self.hyps.get_path(),
-      "--refs", self.refs.get_path(),
-      "--out", self.output_wer.get_path()]
-    print("$ %s" % " ".join(args))
-    subprocess.check_call(args)
-    wer = float(open(self.output_wer.get_path()).read())
-    print("WER: %f %%" % wer)
+    from .wer import calc_wer
+    refs = eval(generic_open(self.refs.get_path()).read())
+    hyps = eval(generic_open(self.hyps.get_path()).read())
+    assert isinstance(refs, dict) and isinstance(hyps, dict)
+    counts = calc_wer(refs, hyps, expect_full=True, num_workers=self.num_workers)
+    print(counts)
+    with generic_open(self.output_wer.get_path(), "w") as f:
+      f.write("%f\n" % counts.wer)
+    print("WER: %f %%" % counts.wer)
 
   def tasks(self):
-    yield Task('run', rqmt={'cpu': 1, 'mem': 1, 'time': 0.1}, mini_task=True)
+    yield Task('run', rqmt={'cpu': self.num_workers, 'mem': 1, 'time': 0.1}, mini_task=self.num_workers == 1)
 
 
 class ScliteJob(Job):
@@ -154,7 +181,7 @@ class ScliteJob(Job):
         continue
       print(sclite_stdout_line.decode("utf8"))
 
-    raise NotImplementedError  # TODO gzip results...
+    gzip_dir(self.output_sclite_dir.get_path())
 
   def tasks(self):
     yield Task('run', rqmt={'cpu': 1, 'mem': 1, 'time': 0.1}, mini_task=True)
@@ -186,15 +213,21 @@ class ScliteHubScoreJob(Job):
     assert name in cls.RefsStmFiles, "make sure you fill this dict before usage"
     return cls(name=name, stm=cls.RefsStmFiles[name], hyps=hyps)
 
-  def __init__(self, name, stm, hyps):
+  def __init__(self, name, stm, hyps, native_scoring=False, num_workers=1):
     """
     :param str name: "hub5e_00", "hub5e_01" or "rt03s"
     :param Path stm: reference file (STM format)
     :param Path hyps: Python txt format, seq->txt, whole words
+    :param bool native_scoring: EXPERIMENTAL: compute the WERs in-process (see :mod:`.wer`)
+      instead of with hubscr.pl. This was not yet validated against hubscr.pl on real data
+      (e.g. GLM contexts are only matched as plain words), so the results can differ.
+    :param int num_workers: number of processes for the native scoring, does not influence the hash
     """
     assert self.GlmFile, "make sure you set this before usage"
     self.name = name
     self.hyps = hyps
+    self.native_scoring = native_scoring
+    self.num_workers = num_workers
     self._ref_stm = stm
     self._glm = self.GlmFile
     self.ResultsSubsets = self.ResultsSubsets  # copy to self such that it pickles it
@@ -209,17 +242,120 @@ class ScliteHubScoreJob(Job):
     self.output_results_txts_list = [self.output_results_txts[subset] for subset in self.ResultsSubsets[name]]
     self.output_wer = self.output_path("wer.txt")  # overall WER%
 
+  @classmethod
+  def hash(cls, parsed_args):
+    parsed_args = dict(parsed_args)
+    if not parsed_args["native_scoring"]:
+      parsed_args.pop("native_scoring")  # keep hash as before
+    parsed_args.pop("num_workers")
+    return super().hash(parsed_args)
+
   @staticmethod
-  def create_ctm(name, ref_stm_filename, source_filename, target_filename):
+  def read_segments(name, ref_stm_filename, source_filename):
+    """
+    Maps the (ref) STM segments to the hyps.
+
+    :param str name: e.g. "hub5_00"
+    :param str ref_stm_filename:
+    :param str source_filename: Python txt format
+    :return: per STM segment: (tag, start, end, flags, ref txt, full seq tag, hyp words without [NOISE] etc)
+    :rtype: list[(str,decimal.Decimal,decimal.Decimal,str,str,str,list[str])]
+    """
+    corpus_name_map = {"hub5e_00": "hub5_00", "hub5e_01": "hub5_01"}
+    import re
+    from decimal import Decimal
+
+    py_txt = eval(generic_open(source_filename).read())
+    assert isinstance(py_txt, dict) and len(py_txt) > 0
+    example_key, example_value = next(iter(py_txt.items()))
+    assert isinstance(example_key, str) and isinstance(example_value, str)
+
+    segments = []
+    seq_idx_in_tag = None
+    last_tag = None
+    last_end = None
+    first_seq = True
+    have_extended = False
+    extended_seq_tag = None
+
+    for line in generic_open(ref_stm_filename).read().splitlines():
+      line = line.strip()
+      if not line:
+        continue
+      # Example extended STM entry (added by ourselves):
+      # _full_seq_tag "..."
+      if line.startswith(";; _full_seq_tag "):
+        if first_seq:
+          have_extended = True
+        else:
+          assert have_extended
+        assert not extended_seq_tag  # should have used (and reset) this
+        m = re.match("^;; _full_seq_tag \"(.*)\"$", line)
+        assert m, "unexpected line: %r" % line
+        extended_seq_tag, = m.groups()
+        continue
+      if line.startswith(";;"):  # comments, or other meta info
+        continue
+      # Example STM entry (one seq):
+      # en_4156a 1 en_4156_A 301.85 302.48 <O,en,F,en-F>  oh yeah
+      m = re.match(
+        "^([a-zA-Z0-9_]+)\\s+1\\s+([a-zA-Z0-9_]+)\\s+([0-9.]+)\\s+([0-9.]+)\\s+<([a-zA-Z0-9,\\-]+)>(.*)$", line)
+      assert m, "unexpected line: %r" % line
+      tag, tag2, start_s, end_s, flags, txt = m.groups()
+      txt = txt.strip()
+      first_seq = False
+      if txt == "ignore_time_segment_in_scoring":
+        continue
+      if not txt:
+        continue
+      start = Decimal(start_s)
+      end = Decimal(end_s)
+      duration = end - start
+      assert duration > 0.
+      if tag != last_tag:
+        seq_idx_in_tag = 1
+        last_tag = tag
+      else:
+        assert start >= last_end - Decimal("0.01"), "line: %r" % line  # allow minimal overlap
+        seq_idx_in_tag += 1
+      last_end = end
+
+      if extended_seq_tag:
+        full_seq_tag = extended_seq_tag
+        extended_seq_tag = None
+      else:
+        full_seq_tag = "%s/%s/%i" % (corpus_name_map.get(name, name), tag, seq_idx_in_tag)
+      assert full_seq_tag in py_txt, "line: %r" % line
+      hyp_raw_txt = py_txt.pop(full_seq_tag)
+      words = hyp_raw_txt.split() if hyp_raw_txt else []
+      # remove special symbols like [NOISE]
+      words = [
+        w for w in words
+        if (w[:1] != "[" and w[-1:] != "]")]
+      segments.append((tag, start, end, flags, txt, full_seq_tag, words))
+
+    assert not extended_seq_tag  # should have used (and reset) this
+
+    if not have_extended:
+      # There are some errors in the STM file. Just skip them.
+      allowed_remaining = {"hub5_00/sw_4601a/28", "hub5_00/sw_4601a/29"}
+      for tag in allowed_remaining:
+        if tag in py_txt:
+          py_txt.pop(tag)
+    assert not py_txt
+    return segments
+
+  @classmethod
+  def create_ctm(cls, name, ref_stm_filename, source_filename, target_filename, segments=None):
     """
     :param str name: e.g. "hub5_00"
     :param str ref_stm_filename:
     :param str source_filename: Python txt format
     :param str target_filename: ctm file
+    :param list|None segments: from :func:`read_segments`, if already read
     :return: target_filename
     :rtype: str
     """
-    corpus_name_map = {"hub5e_00": "hub5_00", "hub5e_01": "hub5_01"}
     # Example CTM:
     """
     ;; <name> <track> <start> <duration> <word> <confidence> [<n-best>]
@@ -229,100 +365,23 @@ class ScliteHubScoreJob(Job):
     ;; hub5_00/en_4156a/2 (304.710000-306.720000)
     en_4156a 1 304.710000 0.201000 well 0.99
     """
-    import re
-    import decimal
     from decimal import Decimal
 
-    py_txt = eval(generic_open(source_filename).read())
-    assert isinstance(py_txt, dict) and len(py_txt) > 0
-    example_key, example_value = next(iter(py_txt.items()))
-    assert isinstance(example_key, str) and isinstance(example_value, str)
+    if segments is None:
+      segments = cls.read_segments(name=name, ref_stm_filename=ref_stm_filename, source_filename=source_filename)
 
-    # Read (ref) STM file, and write out (hyp) CTM file at the same time.
     with generic_open(target_filename, "w") as f:
       f.write(";; <name> <track> <start> <duration> <word> <confidence> [<n-best>]\n")
-
-      seq_idx_in_tag = None
-      last_tag = None
-      last_end = None
-      first_seq = True
-      have_extended = False
-      extended_seq_tag = None
-
-      for line in generic_open(ref_stm_filename).read().splitlines():
-        line = line.strip()
-        if not line:
-          continue
-        # Example extended STM entry (added by ourselves):
-        # _full_seq_tag "..."
-        if line.startswith(";; _full_seq_tag "):
-          if first_seq:
-            have_extended = True
-          else:
-            assert have_extended
-          assert not extended_seq_tag  # should have used (and reset) this
-          m = re.match("^;; _full_seq_tag \"(.*)\"$", line)
-          assert m, "unexpected line: %r" % line
-          extended_seq_tag, = m.groups()
-          continue
-        if line.startswith(";;"):  # comments, or other meta info
-          continue
-        # Example STM entry (one seq):
-        # en_4156a 1 en_4156_A 301.85 302.48 <O,en,F,en-F>  oh yeah
-        m = re.match(
-          "^([a-zA-Z0-9_]+)\\s+1\\s+([a-zA-Z0-9_]+)\\s+([0-9.]+)\\s+([0-9.]+)\\s+<([a-zA-Z0-9,\\-]+)>(.*)$", line)
-        assert m, "unexpected line: %r" % line
-        tag, tag2, start_s, end_s, flags, txt = m.groups()
-        txt = txt.strip()
-        first_seq = False
-        if txt == "ignore_time_segment_in_scoring":
-          continue
-        if not txt:
-          continue
-        start = Decimal(start_s)
-        end = Decimal(end_s)
-        duration = end - start
-        assert duration > 0.
-        if tag != last_tag:
-          seq_idx_in_tag = 1
-          last_tag = tag
-        else:
-          assert start >= last_end - Decimal("0.01"), "line: %r" % line  # allow minimal overlap
-          seq_idx_in_tag += 1
-        last_end = end
-
-        if extended_seq_tag:
-          full_seq_tag = extended_seq_tag
-          extended_seq_tag = None
-        else:
-          full_seq_tag = "%s/%s/%i" % (corpus_name_map.get(name, name), tag, seq_idx_in_tag)
-        assert full_seq_tag in py_txt, "line: %r" % line
-        hyp_raw_txt = py_txt.pop(full_seq_tag)
-        words = hyp_raw_txt.split() if hyp_raw_txt else []
-        # remove special symbols like [NOISE]
-        words = [
-          w for w in words
-          if (w[:1] != "[" and w[-1:] != "]")]
-
+      for tag, start, end, flags, txt, full_seq_tag, words in segments:
         f.write(";; %s (%s-%s)\n" % (tag, start, end))
         f.write(";; full tag: %s\n" % full_seq_tag)
         f.write(";; ref: %s\n" % txt)
         if words:
           # Dummy word durations.
-          word_duration = duration / len(words)
+          word_duration = (end - start) / len(words)
           for i in range(len(words)):
             f.write("%s 1 %.3f %.3f %s\n" % (
               tag, start + Decimal("0.01") + i * word_duration, word_duration * Decimal("0.9"), words[i]))
-
-    assert not extended_seq_tag  # should have used (and reset) this
-
-    if not have_extended:
-      # There are some errors in the STM file. Just skip them.
-      allowed_remaining = {"hub5_00/sw_4601a/28", "hub5_00/sw_4601a/29"}
-      for tag in allowed_remaining:
-        if tag in py_txt:
-          py_txt.pop(tag)
-    assert not py_txt
     return target_filename
 
   @staticmethod
@@ -387,9 +446,36 @@ class ScliteHubScoreJob(Job):
       hyps_symlink_name += ".gz"
     if not os.path.exists(hyps_symlink_name):
       os.symlink(self.hyps.get_path(), hyps_symlink_name)
+    segments = self.read_segments(
+      name=self.name, ref_stm_filename=stm_filename, source_filename=self.hyps.get_path())
     ctm_filename = self.create_ctm(
       name=self.name, ref_stm_filename=stm_filename,
-      source_filename=self.hyps.get_path(), target_filename="%s/%s" % (sclite_out_dir, self.name))
+      source_filename=self.hyps.get_path(), target_filename="%s/%s" % (sclite_out_dir, self.name),
+      segments=segments)
+    if self.native_scoring:
+      results = self.score_native(stm_filename, segments)
+    else:
+      results = self.score_hubscr(stm_filename, ctm_filename)
+    print("Results:", results)
+    with generic_open(self.output_results_txt.get_path(), "w") as f:
+      f.write("%r\n" % (results,))
+    with generic_open(self.output_wer.get_path(), "w") as f:
+      f.write("%f\n" % results["Overall"])
+    for subset in self.ResultsSubsets[self.name]:
+      with generic_open(self.output_results_txts[subset].get_path(), "w") as f:
+        dataset_name = "%s: %s" % (self.name, subset) if subset != "Overall" else self.name
+        wer = results[subset]
+        f.write("{'dataset': %r, 'keys': ['wer'], 'wer': %f}\n" % (dataset_name, wer))
+
+    gzip_dir(sclite_out_dir)
+
+  def score_hubscr(self, stm_filename, ctm_filename):
+    """
+    :param str stm_filename:
+    :param str ctm_filename:
+    :return: subset -> WER%, from the .lur file
+    :rtype: dict[str,float]
+    """
     args = [
       "%s/SCTK/bin/hubscr.pl" % tk.gs.BASE_DIR,
       "-p", "%s/SCTK/bin" % tk.gs.BASE_DIR,
@@ -409,21 +495,23 @@ class ScliteHubScoreJob(Job):
       if b"Segments For Channel" in sclite_stdout_line:
         continue
       print(sclite_stdout_line.decode("utf8"))
+    return self.parse_lur_file("%s.filt.lur" % ctm_filename)
 
-    results = self.parse_lur_file("%s.filt.lur" % ctm_filename)
-    print("Results:", results)
-    with generic_open(self.output_results_txt.get_path(), "w") as f:
-      f.write("%r\n" % (results,))
-    with generic_open(self.output_wer.get_path(), "w") as f:
-      f.write("%f\n" % results["Overall"])
-    for subset in self.ResultsSubsets[self.name]:
-      with generic_open(self.output_results_txts[subset].get_path(), "w") as f:
-        dataset_name = "%s: %s" % (self.name, subset) if subset != "Overall" else self.name
-        wer = results[subset]
-        f.write("{'dataset': %r, 'keys': ['wer'], 'wer': %f}\n" % (dataset_name, wer))
-
-    for fn in os.listdir(sclite_out_dir):
-      self.sh("gzip %s/%s" % (sclite_out_dir, fn))
+  def score_native(self, stm_filename, segments):
+    """
+    :param str stm_filename:
+    :param list segments: from :func:`read_segments`
+    :return: subset -> WER%, rounded as in the .lur file
+    :rtype: dict[str,float]
+    """
+    print("Warning: native scoring is experimental, the results can differ from hubscr.pl")
+    from .wer import Glm, read_stm_labels, score_stm_segments, lur_wers
+    results = score_stm_segments(
+      [(flags, txt, words) for _, _, _, flags, txt, _, words in segments],
+      labels=read_stm_labels(stm_filename), glm=Glm(self._glm), num_workers=self.num_workers)
+    for subset, counts in sorted(results.items()):
+      print("%s: %r" % (subset, counts))
+    return lur_wers(results)
 
   def tasks(self):
-    yield Task('run', rqmt={'cpu': 1, 'mem': 1, 'time': 0.1}, mini_task=True)
+    yield Task('run', rqmt={'cpu': self.num_workers, 'mem': 1, 'time': 0.1}, mini_task=self.num_workers == 1)
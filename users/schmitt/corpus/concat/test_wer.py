@@ -0,0 +1,99 @@
+"""
+Regression test of the native WER scoring (:mod:`.wer`) on a small synthetic STM/hyp set,
+with S/D/I counts verified by hand (sclite costs: sub 4, del 3, ins 3).
+This is not a comparison against the output of SCTK hubscr.pl.
+"""
+
+import pytest
+
+# .wer imports sisyphus (via .utils) at module level
+pytest.importorskip("sisyphus")
+
+from .wer import (
+  SCLITE_COSTS, Glm, WordErrorCounts, align, calc_wer, compare_with_lur, lur_wers, parse_stm_text,
+  read_stm_labels, score_stm_segments, _to_hyp_tokens, _to_ref_tokens)
+
+STM = """\
+;; CATEGORY "0" "" ""
+;; LABEL "O" "Overall" "Overall"
+;; CATEGORY "1" "Corpus" ""
+;; LABEL "AA" "SubsetA" ""
+;; LABEL "BB" "SubsetB" ""
+"""
+
+GLM = """\
+* name "test.glm"
+* case_sensitive = 'F'
+;; comment
+i'm => i am / [ ] __ [ ]
+gonna => { gonna / going to } / [ ] __ [ ]  ;; multi-word alternation
+ok => okay / [ ] __ [ thanks ]
+"""
+
+# flags, ref, hyp, expected (num_ref, num_sub, num_del, num_ins)
+SEGMENTS = [
+  ("O,aa", "hello world foo", "hello word foo bar", (3, 1, 0, 1)),
+  ("O,aa", "(uh) i am going home", "I'm going", (4, 0, 1, 0)),  # GLM, optional word
+  ("O,aa", "okay thanks", "ok thanks", (2, 0, 0, 0)),  # GLM rule with right context
+  ("O,aa", "okay", "ok", (1, 1, 0, 0)),  # context does not match
+  ("O,bb", "{ going to / gonna } be there", "gonna be here", (3, 1, 0, 0)),  # multi-word alternation in ref
+  ("O,bb", "okay { uh-huh / mhm / @ } bye", "okay mhm mhm bye", (3, 0, 0, 1)),  # optional alternation
+  ("O,bb", "the cat sat", "", (3, 0, 3, 0)),
+  ("O,bb", "i am going to go", "i am gonna go", (5, 0, 0, 0)),  # multi-word alternation in hyp (via GLM)
+]
+
+EXPECTED_SUBSETS = {
+  "Overall": (24, 3, 4, 2),
+  "SubsetA": (10, 2, 1, 1),
+  "SubsetB": (14, 1, 3, 1),
+}
+
+
+def _counts_tuple(counts):
+  return counts.num_ref, counts.num_sub, counts.num_del, counts.num_ins
+
+
+@pytest.fixture
+def glm(tmp_path):
+  glm_file = tmp_path / "test.glm"
+  glm_file.write_text(GLM)
+  return Glm(str(glm_file))
+
+
+@pytest.fixture
+def stm_file(tmp_path):
+  stm_file = tmp_path / "test.stm"
+  stm_file.write_text(STM)
+  return str(stm_file)
+
+
+@pytest.mark.parametrize("flags, ref, hyp, expected", SEGMENTS)
+def test_align_segment(glm, flags, ref, hyp, expected):
+  counts = align(_to_ref_tokens(parse_stm_text(ref), glm), _to_hyp_tokens(hyp.split(), glm), SCLITE_COSTS)
+  assert _counts_tuple(counts) == expected
+
+
+@pytest.mark.parametrize("num_workers", [1, 2])
+def test_score_stm_segments(glm, stm_file, num_workers):
+  results = score_stm_segments(
+    [(flags, ref, hyp.split()) for flags, ref, hyp, _ in SEGMENTS],
+    labels=read_stm_labels(stm_file), glm=glm, num_workers=num_workers)
+  assert {subset: _counts_tuple(counts) for subset, counts in results.items()} == EXPECTED_SUBSETS
+  assert lur_wers(results) == {"Overall": 37.5, "SubsetA": 40.0, "SubsetB": 35.7}
+
+
+def test_compare_with_lur():
+  results = {
+    subset: WordErrorCounts(num_ref=n, num_sub=s, num_del=d, num_ins=i)
+    for subset, (n, s, d, i) in EXPECTED_SUBSETS.items()}
+  assert compare_with_lur(results, {"Overall": 37.5, "SubsetA": 40.0, "SubsetB": 35.7}) == {}
+  assert compare_with_lur(results, {"Overall": 37.6, "SubsetA": 40.0, "SubsetC": 1.0}) == {
+    "Overall": (37.5, 37.6), "SubsetC": (None, 1.0)}
+  assert compare_with_lur(results, {"Overall": 37.6}, tolerance=0.2) == {}
+
+
+def test_calc_wer():
+  counts = calc_wer({"a": "hello world foo", "b": "x y"}, {"a": "hello word foo bar", "b": ""})
+  assert _counts_tuple(counts) == (5, 1, 2, 1)
+  with pytest.raises(AssertionError):
+    calc_wer({"a": "x"}, {})
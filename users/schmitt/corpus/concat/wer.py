@@ -0,0 +1,540 @@
+"""
+In-process word error rate scoring, as replacement for RETURNN's calculate-word-error-rate.py
+and as an experimental alternative to the WER numbers of SCTK sclite/hubscr.pl (.lur tables).
+
+Every sequence is aligned with a weighted Levenshtein alignment, where each row of the dynamic programming
+(one reference word against all hypothesis words) is computed with NumPy.
+Sequences are scored in parallel by a process pool.
+
+Reference words can be optionally deletable (``(word)`` in STM files) or alternations (``{ a / b c / @ }``),
+where every alternative can have several words, and a GLM file can map words before scoring,
+like csrfilt.sh in hubscr.pl does.
+Alternations in the hypothesis (from the GLM) are aligned by trying all their combinations
+(up to :data:`MAX_HYP_PATHS`).
+
+The scoring of STM references is experimental: it was only checked against hand-verified counts,
+not yet against the .lur tables of hubscr.pl on real data.
+"""
+
+import itertools
+import multiprocessing
+import random
+import re
+
+import numpy as np
+
+from .utils import generic_open
+
+# (substitution, deletion, insertion) costs
+UNIT_COSTS = (1, 1, 1)
+SCLITE_COSTS = (4, 3, 3)  # sclite defaults
+
+# the alignment cost is (weighted cost) * _ERR_BASE + (number of errors),
+# such that paths with equal weighted cost are ranked by the number of errors
+_ERR_BASE = 1 << 24
+
+# max number of combinations of the multi-word alternations of a hypothesis,
+# further alternations use their first alternative
+MAX_HYP_PATHS = 256
+
+
+class WordErrorCounts:
+  """
+  Error counts of one or many sequences.
+  """
+
+  def __init__(self, num_ref=0, num_sub=0, num_del=0, num_ins=0, num_seqs=0):
+    self.num_ref = num_ref
+    self.num_sub = num_sub
+    self.num_del = num_del
+    self.num_ins = num_ins
+    self.num_seqs = num_seqs
+
+  def __add__(self, other):
+    """
+    :param WordErrorCounts other:
+    :rtype: WordErrorCounts
+    """
+    return WordErrorCounts(
+      self.num_ref + other.num_ref, self.num_sub + other.num_sub, self.num_del + other.num_del,
+      self.num_ins + other.num_ins, self.num_seqs + other.num_seqs)
+
+  @property
+  def num_errors(self):
+    return self.num_sub + self.num_del + self.num_ins
+
+  @property
+  def wer(self):
+    """
+    :return: WER in percent
+    :rtype: float
+    """
+    return 100.0 * self.num_errors / max(self.num_ref, 1)
+
+  def __repr__(self):
+    return "WordErrorCounts(num_ref=%i, num_sub=%i, num_del=%i, num_ins=%i, num_seqs=%i, wer=%.2f)" % (
+      self.num_ref, self.num_sub, self.num_del, self.num_ins, self.num_seqs, self.wer)
+
+
+class RefToken:
+  """
+  Reference word, possibly with alternative single words and optionally deletable.
+  """
+
+  def __init__(self, alternatives, optional=False):
+    """
+    :param frozenset[str] alternatives: any of these matches
+    :param bool optional: deleting it is not an error
+    """
+    self.alternatives = alternatives
+    self.optional = optional
+
+  def __repr__(self):
+    return "RefToken(%r, optional=%r)" % (sorted(self.alternatives), self.optional)
+
+
+class Alternation:
+  """
+  Alternation with alternatives (paths) of any number of words, ``{ a / b c / @ }``.
+  """
+
+  def __init__(self, paths):
+    """
+    :param list[list] paths: the tokens of each alternative, an empty list for ``@``.
+      In references, the tokens are :class:`RefToken`, in hypotheses str.
+    """
+    self.paths = paths
+
+  def __repr__(self):
+    return "Alternation(%r)" % (self.paths,)
+
+
+class _Aligner:
+  """
+  Alignment of a reference (possibly with alternations) against a fixed hypothesis word sequence.
+  """
+
+  def __init__(self, hyp, costs):
+    """
+    :param list[frozenset[str]] hyp:
+    :param (int,int,int) costs:
+    """
+    self.hyp_set_ids = {}
+    self.hyp_ids = np.array([self.hyp_set_ids.setdefault(h, len(self.hyp_set_ids)) for h in hyp], dtype=np.int64)
+    self.c_sub, self.c_del, self.c_ins = (c * _ERR_BASE + 1 for c in costs)
+    self.ins_offsets = np.arange(len(hyp) + 1, dtype=np.int64) * self.c_ins
+
+  def _token_row(self, token, prev):
+    """
+    :param RefToken token:
+    :param np.ndarray prev: costs up to the previous reference token, for all hyp positions
+    :return: costs including this token, and which hyp words match it
+    :rtype: (np.ndarray, np.ndarray)
+    """
+    matching_ids = [idx for h, idx in self.hyp_set_ids.items() if h & token.alternatives]
+    match = np.isin(self.hyp_ids, matching_ids)
+    row = prev + (0 if token.optional else self.c_del)
+    np.minimum(row[1:], prev[:-1] + np.where(match, 0, self.c_sub), out=row[1:])
+    # insertions within the row: row[j] = min_k<=j (row[k] + (j - k) * c_ins)
+    return np.minimum.accumulate(row - self.ins_offsets) + self.ins_offsets, match
+
+  def forward(self, ref, start_row=None):
+    """
+    :param list[RefToken|Alternation] ref:
+    :param np.ndarray|None start_row:
+    :return: per ref item the data for the backtrace, and the cost rows (len(ref) + 1)
+    :rtype: (list, list[np.ndarray])
+    """
+    rows = [self.ins_offsets if start_row is None else start_row]
+    steps = []
+    for item in ref:
+      if isinstance(item, Alternation):
+        paths = [self.forward(path, rows[-1]) for path in item.paths]
+        # the min of rows which are closed under insertions is closed as well
+        row = np.min([path_rows[-1] for _, path_rows in paths], axis=0)
+        steps.append((item, paths))
+      else:
+        row, match = self._token_row(item, rows[-1])
+        steps.append((item, match))
+      rows.append(row)
+    return steps, rows
+
+  def backtrace(self, steps, rows, j, counts):
+    """
+    Counts the operations from the end of rows at hyp position j back to the first row.
+
+    :param list steps: from :func:`forward`
+    :param list[np.ndarray] rows: from :func:`forward`
+    :param int j: hyp position
+    :param WordErrorCounts counts: updated
+    :return: hyp position in the first row
+    :rtype: int
+    """
+    i = len(steps)
+    while i > 0:
+      cur = rows[i][j]
+      item, data = steps[i - 1]
+      if isinstance(item, Alternation):
+        path_steps, path_rows = next((s, r) for s, r in data if r[-1][j] == cur)
+        j = self.backtrace(path_steps, path_rows, j, counts)
+        i -= 1
+      elif j > 0 and cur == rows[i - 1][j - 1] + (0 if data[j - 1] else self.c_sub):
+        if not data[j - 1]:
+          counts.num_sub += 1
+        counts.num_ref += 1
+        i, j = i - 1, j - 1
+      elif cur == rows[i - 1][j] + (0 if item.optional else self.c_del):
+        if not item.optional:
+          counts.num_del += 1
+          counts.num_ref += 1
+        i -= 1
+      else:
+        assert j > 0 and cur == rows[i][j - 1] + self.c_ins
+        counts.num_ins += 1
+        j -= 1
+    return j
+
+
+def _hyp_paths(hyp):
+  """
+  :param list[str|frozenset[str]|Alternation] hyp:
+  :return: all word sequences, see :data:`MAX_HYP_PATHS`
+  :rtype: list[list[frozenset[str]]]
+  """
+  hyp = [frozenset([h]) if isinstance(h, str) else h for h in hyp]
+  choices = []
+  num_paths = 1
+  for h in hyp:
+    if isinstance(h, Alternation):
+      paths = [[frozenset([w]) for w in path] for path in h.paths]
+      if num_paths * len(paths) > MAX_HYP_PATHS:
+        paths = paths[:1]
+      num_paths *= len(paths)
+      choices.append(paths)
+    else:
+      choices.append([[h]])
+  return [[h for part in combination for h in part] for combination in itertools.product(*choices)]
+
+
+def align(ref, hyp, costs=UNIT_COSTS):
+  """
+  :param list[str|RefToken|Alternation] ref: an alternation contains lists of RefToken
+  :param list[str|frozenset[str]|Alternation] hyp: hypothesis words, a set is an alternation of single words,
+    an alternation contains lists of str
+  :param (int,int,int) costs: substitution, deletion, insertion
+  :rtype: WordErrorCounts
+  """
+  ref = [RefToken(frozenset([r])) if isinstance(r, str) else r for r in ref]
+  best = None
+  for hyp_path in _hyp_paths(hyp):
+    aligner = _Aligner(hyp_path, costs)
+    steps, rows = aligner.forward(ref)
+    if best is None or rows[-1][-1] < best[2][-1][-1]:
+      best = (aligner, steps, rows)
+  aligner, steps, rows = best
+  counts = WordErrorCounts(num_seqs=1)
+  j = aligner.backtrace(steps, rows, len(rows[0]) - 1, counts)
+  counts.num_ins += j  # remaining hyp words before the first ref word
+  return counts
+
+
+def _align_chunk(args):
+  pairs, costs = args
+  total = WordErrorCounts()
+  for ref, hyp in pairs:
+    total += align(ref, hyp, costs)
+  return total
+
+
+def align_all(pairs, costs=UNIT_COSTS, num_workers=1, chunk_size=256):
+  """
+  :param list[(list[str|RefToken|Alternation],list[str|frozenset[str]|Alternation])] pairs: ref and hyp per sequence
+  :param (int,int,int) costs:
+  :param int num_workers: number of processes
+  :param int chunk_size: sequences per task
+  :return: summed counts
+  :rtype: WordErrorCounts
+  """
+  chunks = [(pairs[i:i + chunk_size], costs) for i in range(0, len(pairs), chunk_size)]
+  if num_workers <= 1 or len(chunks) <= 1:
+    results = map(_align_chunk, chunks)
+  else:
+    with multiprocessing.Pool(num_workers) as pool:
+      results = pool.map(_align_chunk, chunks)
+  total = WordErrorCounts()
+  for counts in results:
+    total += counts
+  return total
+
+
+def calc_wer(refs, hyps, expect_full=True, num_workers=1):
+  """
+  Same as RETURNN's calculate-word-error-rate.py: unit costs and whitespace tokenization.
+
+  :param dict[str,str] refs: seq tag -> text
+  :param dict[str,str] hyps: seq tag -> text
+  :param bool expect_full: every ref seq must be in hyps, otherwise missing seqs are skipped
+  :param int num_workers:
+  :rtype: WordErrorCounts
+  """
+  pairs = []
+  for seq_tag, ref_txt in refs.items():
+    if seq_tag not in hyps:
+      assert not expect_full, "seq %r not in hyps" % seq_tag
+      continue
+    pairs.append((ref_txt.split(), hyps[seq_tag].split()))
+  return align_all(pairs, costs=UNIT_COSTS, num_workers=num_workers)
+
+
+class Glm:
+  """
+  Rules of a GLM file (e.g. en20000405_hub5.glm), case insensitive.
+  Contexts (``[ left ] __ [ right ]``) are matched as plain word sequences against the unmapped words.
+  """
+
+  def __init__(self, filename=None):
+    """
+    :param str|None filename:
+    """
+    # lhs -> list of (left context, right context, alternatives (rhs))
+    self.rules = {}  # type: dict[tuple[str],list[(tuple[str],tuple[str],list[tuple[str]])]]
+    self.max_lhs_len = 0
+    if filename:
+      self.load(filename)
+
+  def load(self, filename):
+    rule_re = re.compile(r"^(.+?)\s*=>\s*(.*?)\s*/\s*\[([^\]]*)\]\s*__\s*\[([^\]]*)\]")
+    for line in generic_open(filename).read().splitlines():
+      line = line.split(";;")[0].strip()
+      if not line or line.startswith("*"):
+        continue
+      m = rule_re.match(line)
+      if not m:
+        continue
+      lhs, rhs, left, right = m.groups()
+      rhs = rhs.strip()
+      if rhs.startswith("{") and rhs.endswith("}"):
+        alternatives = [tuple(alt.lower().split()) for alt in rhs[1:-1].split("/")]
+      else:
+        alternatives = [tuple(rhs.lower().split())]
+      lhs = tuple(lhs.lower().split())
+      self.rules.setdefault(lhs, []).append((
+        tuple(left.lower().split()), tuple(right.lower().split()),
+        [() if alt == ("@",) else alt for alt in alternatives]))
+      self.max_lhs_len = max(self.max_lhs_len, len(lhs))
+
+  def _find_rule(self, words, pos, length):
+    for left, right, alternatives in self.rules.get(tuple(words[pos:pos + length]), []):
+      if left and tuple(words[max(pos - len(left), 0):pos]) != left:
+        continue
+      if right and tuple(words[pos + length:pos + length + len(right)]) != right:
+        continue
+      return alternatives
+    return None
+
+  def apply(self, words):
+    """
+    :param list[str] words: lower case
+    :return: words, where a rule with several alternatives gives an :class:`Alternation` (of str)
+    :rtype: list[str|Alternation]
+    """
+    result = []
+    pos = 0
+    while pos < len(words):
+      for length in range(min(self.max_lhs_len, len(words) - pos), 0, -1):
+        alternatives = self._find_rule(words, pos, length)
+        if alternatives is not None:
+          if len(alternatives) == 1:
+            result.extend(alternatives[0])
+          else:
+            result.append(Alternation([list(alt) for alt in alternatives]))
+          pos += length
+          break
+      else:
+        result.append(words[pos])
+        pos += 1
+    return result
+
+
+def parse_stm_text(txt):
+  """
+  :param str txt: reference text of a STM segment, with ``(optional)`` words and ``{ a / b c / @ }`` alternations
+  :return: lower case tokens
+  :rtype: list[str|Alternation]
+  """
+  tokens = []
+  for m in re.finditer(r"\{([^}]*)\}|(\S+)", txt.lower()):
+    if m.group(1) is not None:
+      tokens.append(Alternation([alt.split() if alt.strip() != "@" else [] for alt in m.group(1).split("/")]))
+    else:
+      tokens.append(m.group(2))
+  return tokens
+
+
+def _apply_glm(tokens, glm):
+  """
+  Applies the GLM to the runs of plain words, alternations of the reference are kept as they are.
+
+  :param list[str|Alternation] tokens:
+  :param Glm glm:
+  :rtype: list[str|Alternation]
+  """
+  mapped = []
+  words = []
+  for token in tokens + [None]:
+    if isinstance(token, str):
+      words.append(token)
+      continue
+    mapped.extend(glm.apply(words))
+    words = []
+    if token is not None:
+      mapped.append(token)
+  return mapped
+
+
+def _to_ref_token(word):
+  if len(word) > 2 and word[0] == "(" and word[-1] == ")":
+    return RefToken(frozenset([word[1:-1]]), optional=True)
+  return RefToken(frozenset([word]))
+
+
+def _to_ref_tokens(tokens, glm=None):
+  """
+  :param list[str|Alternation] tokens: from :func:`parse_stm_text`
+  :param Glm|None glm:
+  :rtype: list[RefToken|Alternation]
+  """
+  if glm is not None:
+    tokens = _apply_glm(tokens, glm)
+  ref = []
+  for token in tokens:
+    if not isinstance(token, Alternation):
+      ref.append(_to_ref_token(token))
+    elif all(len(path) <= 1 and not path[0].startswith("(") for path in token.paths if path):
+      # only single words: a single token, which is cheaper to align
+      words = frozenset(path[0] for path in token.paths if path)
+      ref.append(RefToken(words, optional=any(not path for path in token.paths)))
+    else:
+      ref.append(Alternation([[_to_ref_token(word) for word in path] for path in token.paths]))
+  return ref
+
+
+def _to_hyp_tokens(words, glm=None):
+  """
+  :param list[str] words:
+  :param Glm|None glm:
+  :rtype: list[str|frozenset[str]|Alternation]
+  """
+  words = [w.lower() for w in words]
+  tokens = glm.apply(words) if glm is not None else words
+  hyp = []
+  for token in tokens:
+    if isinstance(token, Alternation) and all(len(path) == 1 for path in token.paths):
+      hyp.append(frozenset(path[0] for path in token.paths))
+    else:
+      hyp.append(token)
+  return hyp
+
+
+def read_stm_labels(stm_filename):
+  """
+  :param str stm_filename:
+  :return: label id (lower case) -> short description, from the ``;; LABEL "id" "desc" "..."`` header lines
+  :rtype: dict[str,str]
+  """
+  labels = {}
+  for line in generic_open(stm_filename).read().splitlines():
+    m = re.match(r'^;;\s*LABEL\s+"([^"]*)"\s+"([^"]*)"', line.strip())
+    if m:
+      labels[m.group(1).lower()] = m.group(2)
+  return labels
+
+
+def score_stm_segments(segments, labels, glm=None, costs=SCLITE_COSTS, num_workers=1):
+  """
+  WER per label (subset), like the columns of the sclite .lur table.
+
+  :param list[(str,str,list[str])] segments: flags (e.g. "O,en,F,en-F"), reference text, hypothesis words
+  :param dict[str,str] labels: from :func:`read_stm_labels`
+  :param Glm|None glm:
+  :param (int,int,int) costs:
+  :param int num_workers:
+  :return: subset -> counts, "Overall" contains all segments
+  :rtype: dict[str,WordErrorCounts]
+  """
+  pairs = []
+  pair_labels = []
+  for flags, ref_txt, hyp_words in segments:
+    pairs.append((_to_ref_tokens(parse_stm_text(ref_txt), glm), _to_hyp_tokens(hyp_words, glm)))
+    pair_labels.append([flag.lower() for flag in flags.split(",")])
+  if num_workers > 1:
+    with multiprocessing.Pool(num_workers) as pool:
+      seq_counts = pool.starmap(align, [(ref, hyp, costs) for ref, hyp in pairs], chunksize=256)
+  else:
+    seq_counts = [align(ref, hyp, costs) for ref, hyp in pairs]
+  results = {"Overall": WordErrorCounts()}
+  for counts, flags in zip(seq_counts, pair_labels):
+    results["Overall"] += counts
+    for flag in flags:
+      if flag in labels and labels[flag] != "Overall":
+        results[labels[flag]] = results.get(labels[flag], WordErrorCounts()) + counts
+  return results
+
+
+def lur_wers(results):
+  """
+  :param dict[str,WordErrorCounts] results:
+  :return: subset -> WER rounded like in the .lur table
+  :rtype: dict[str,float]
+  """
+  return {subset: float("%.1f" % counts.wer) for subset, counts in results.items()}
+
+
+def compare_with_lur(results, lur_results, tolerance=0.0):
+  """
+  Regression check against :func:`ScliteHubScoreJob.parse_lur_file`.
+
+  :param dict[str,WordErrorCounts] results:
+  :param dict[str,float] lur_results:
+  :param float tolerance: in absolute WER%
+  :return: subset -> (native WER, sclite WER) for all subsets which differ
+  :rtype: dict[str,(float,float)]
+  """
+  native = lur_wers(results)
+  return {
+    subset: (native.get(subset), wer) for subset, wer in lur_results.items()
+    if subset not in native or abs(native[subset] - wer) > tolerance}
+
+
+def create_synthetic_stm_and_hyps(stm_filename, name="synthetic", num_recordings=20, num_segments=10, seed=42):
+  """
+  Random STM (two subsets) and hypotheses with random errors,
+  to compare with hubscr.pl via :func:`compare_with_lur`.
+
+  :param str stm_filename: written
+  :param str name: corpus name for the full seq tags
+  :return: full seq tag -> hyp text, as in the hyps file of ScliteHubScoreJob
+  :rtype: dict[str,str]
+  """
+  rnd = random.Random(seed)
+  vocab = ["word%i" % i for i in range(200)]
+  hyps = {}
+  with generic_open(stm_filename, "w") as f:
+    f.write(';; CATEGORY "0" "" ""\n;; LABEL "O" "Overall" "Overall"\n')
+    f.write(';; CATEGORY "1" "Corpus" ""\n;; LABEL "AA" "SubsetA" ""\n;; LABEL "BB" "SubsetB" ""\n')
+    for rec in range(num_recordings):
+      subset = "aa" if rec % 2 == 0 else "bb"
+      tag = "%s_%04i" % (subset, rec)
+      for seg in range(num_segments):
+        words = [rnd.choice(vocab) for _ in range(rnd.randint(1, 15))]
+        f.write("%s 1 %s_A %.2f %.2f <O,%s>  %s\n" % (tag, tag, seg * 10.0, seg * 10.0 + 9.0, subset, " ".join(words)))
+        hyp = []
+        for word in words:
+          p = rnd.random()
+          if p < 0.05:
+            continue  # deletion
+          hyp.append(rnd.choice(vocab) if p < 0.15 else word)
+          if rnd.random() < 0.05:
+            hyp.append(rnd.choice(vocab))  # insertion
+        hyps["%s/%s/%i" % (name, tag, seg + 1)] = " ".join(hyp)
+  return hyps
@@ -3,6 +3,8 @@
 from typing import OrderedDict
 from pathlib import Path
 import subprocess
+import shlex
+import sys
 import os
 from datetime import datetime
 
@@ -10,6 +12,9 @@ import argparse
 import logging as log
 log.basicConfig(level=log.DEBUG)
 
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import make_py_summary
+
 
 parser = argparse.ArgumentParser()
 parser.add_argument('-se', '--skip-extraction', action="store_true")
@@ -23,7 +28,9 @@ PY = "/work/tools/asr/python/3.8.0_tf_2.3-v1-generic+cuda10.1/bin/python3.8"
 # setup_path: absolute path so sis setup
 # short_name: ...
 # link_to_path: local path to link the setup to
-# extract_command: extraction command using my make_py_summary.py data extractor
+# extract_command: extraction command using my make_py_summary.py data extractor,
+#   only its arguments are used: make_py_summary.main() of this tools dir runs in this process,
+#   not the script given in the command (e.g. the tools_linked/ copy of the setup)
 
 setups = [
     {
@@ -91,9 +98,11 @@ def extract_datas_for_setup(setup_def):
     # Run the extraction command
     # We want as much data as possible, we parse: logs, configs, sis worker files, qstat ( might take a while )
 
+    # The extraction runs in this process (no interpreter per setup), only the arguments of the command are used
     # TODO: handle exeptions, make defaults
-    _call = setup_def["extract_command"].split(" ") # Yeah we still assume there are no spaces in names but that served us fine so far
-    out = subprocess.check_output(_call).decode('UTF-8') # TODO: check also the return code
+    _call = shlex.split(setup_def["extract_command"])
+    assert _call[1].endswith("make_py_summary.py"), _call
+    make_py_summary.main(_call[2:])  # writes its results to results2/
 
     date_time = datetime.now().strftime("%d-%m-%Y_%H-%M-%S")
     os.close(os.open(f"LAST_EXTRACTED_{date_time}", os.O_CREAT)) # This might allow shipping the extraction at another time
@@ -102,8 +111,6 @@ def extract_datas_for_setup(setup_def):
 
     os.chdir(EXTRACTOR_ROOT)
 
-    return out
-
 
 def generate_data_table(setup_def):
     os.chdir(setup_def['link_to_path'])
@@ -0,0 +1,233 @@
+# In-process replacement for calling get_wer.py / get_wer_for_set.py once per experiment and dataset
+#
+# All files are parsed line by line, learning_rates without eval() via users/zeyer/returnn/learning_rate_scores.py,
+# and the parsed content of every file is cached keyed by its mtime and size,
+# so regenerating the summaries only reads files that changed since the last run.
+#
+# Needs the recipe dir which contains i6_experiments in the PYTHONPATH, e.g. PYTHONPATH=<setup>/recipe.
+
+import json
+import logging as log
+import os
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+from i6_experiments.users.zeyer.returnn.learning_rate_scores import get_learning_rate_scores
+
+
+class FileSummaryCache:
+    """
+    Caches the parse result of files, invalidated when mtime or size of a file changes.
+    Thread safe, persisted as json.
+    """
+
+    def __init__(self, cache_file=None):
+        self.cache_file = cache_file
+        self.entries = {}
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        if cache_file and os.path.exists(cache_file):
+            try:
+                with open(cache_file) as f:
+                    self.entries = json.load(f)
+            except ValueError:
+                log.warning(f"Ignoring broken cache file {cache_file}")
+
+    def get(self, path, parse):
+        """
+        :param str path:
+        :param function parse: path -> json serializable result
+        """
+        path = os.path.realpath(path)
+        st = os.stat(path)
+        stamp = [st.st_mtime, st.st_size]
+        key = f"{parse.__name__}:{path}"
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None and entry["stamp"] == stamp:
+                self.hits += 1
+                return entry["value"]
+        value = parse(path)
+        with self.lock:
+            self.misses += 1
+            self.entries[key] = {"stamp": stamp, "value": value}
+        return value
+
+    def save(self):
+        if not self.cache_file:
+            return
+        tmp_file = self.cache_file + ".tmp"
+        with self.lock, open(tmp_file, "w") as f:
+            json.dump(self.entries, f)
+        os.replace(tmp_file, self.cache_file)
+
+
+def parse_learning_rates(path):
+    """
+    :return: best epoch by summed dev score and the errors per epoch, like get_wer.py
+    """
+    data = get_learning_rate_scores(path).epochs
+
+    best_epoch = None
+    best_score = None
+    finished = [k for (k, v) in data.items() if len(v.error) > 0]
+    if finished:
+        final_epoch = finished[-1]
+        score_keys = ("dev_score", "dev_score_output")
+        num_score = sum(1 for k in data[final_epoch].error if k in score_keys)
+        for epoch in [k for k in data if k <= final_epoch]:
+            scores = [v for k, v in data[epoch].error.items() if k in score_keys]
+            # pretraining might use different losses
+            if len(scores) == num_score and (best_score is None or sum(scores) < best_score):
+                best_score = sum(scores)
+                best_epoch = epoch
+
+    return {"best_epoch": best_epoch, "errors": {epoch: data[epoch].error for epoch in data}}
+
+
+def parse_returnn_log(path):
+    """
+    :return: number of params, train steps, train time in hours per subepoch and the last finished epoch
+    """
+    num_params = 0
+    train_steps = []
+    train_times_h = []
+    max_epoch = 0
+    with open(path, errors="replace") as f:
+        for line in f:
+            if not num_params and line.startswith("net params"):
+                num_params = int(line.split()[-1])
+            if line.startswith("train epoch") and "finished" in line:
+                splits = line.split(" ")
+                train_steps.append(int(splits[5]))
+                h, m, s = splits[7].split(":")
+                train_times_h.append(round(int(h) + (int(m) + int(s) / 60) / 60, 3))
+                max_epoch = int(splits[2].split(",")[0])
+    return {"num_params": num_params, "train_steps": train_steps, "train_times_h": train_times_h, "max_epoch": max_epoch}
+
+
+def parse_sclite_dtl(path):
+    """
+    :return: WER string, e.g. "5.4%", or None
+    """
+    wer = None
+    with open(path, errors="replace") as f:
+        for line in f:
+            if line.startswith("Percent Total Error"):
+                wer = line.split()[-2]
+    return wer
+
+
+def parse_optimize_log(path):
+    """
+    :return: am scale, lm scale and WER of the scale optimization
+    """
+    with open(path) as f:
+        splits = f.readline().split(" ")
+    return [float(splits[5]), float(splits[8]), round(float(splits[-1]), 2)]
+
+
+def harvest_recognitions(recog_path, optimize_recog_path, cache):
+    wers = {}
+    wers_opt = {}
+    optimized_scales = {}
+
+    reports = sorted(os.listdir(recog_path)) if os.path.isdir(recog_path) else []
+    for rep in reports:
+        dtl = os.path.join(recog_path, rep, "sclite.dtl")
+        if not os.path.exists(dtl):
+            continue
+        wer = cache.get(dtl, parse_sclite_dtl)
+        if rep.endswith("-optlm.reports"):
+            e = int(rep.split("-")[0].split("_")[-1])
+            if float(wers_opt.get(e, "100.0%")[:-1]) > float(wer[:-1]):
+                wers_opt[e] = wer
+        elif rep.split(".")[0].isdigit():
+            wers[int(rep.split(".")[0])] = wer
+
+    optimize_logs = sorted(os.listdir(optimize_recog_path)) if os.path.isdir(optimize_recog_path) else []
+    for opt_log in optimize_logs:
+        path = os.path.join(optimize_recog_path, opt_log)
+        if os.path.isdir(path) or not opt_log.split(".")[0].isdigit():
+            continue
+        am_scale, lm_scale, wer_in_opt = cache.get(path, parse_optimize_log)
+        e = int(opt_log.split(".")[0])
+        optimized_scales[e] = (
+            am_scale, lm_scale, str(wer_in_opt) + "%", round(wer_in_opt - float(wers.get(e, "0%")[:-1]), 2))
+
+    return (
+        {k: wers[k] for k in sorted(wers)},
+        {k: wers_opt[k] for k in sorted(wers_opt)},
+        optimized_scales,
+    )
+
+
+def harvest_experiment(prefix, name, data_set=None, cache=None, suffix="train.job"):
+    """
+    In-process equivalent of `get_wer.py --prefix {prefix} --job_name {name} --print true [--set {data_set}]`
+    parsed into the values make_py_summary.py stores. Has to be run in the setup root.
+
+    :param str prefix: e.g. conformer/baseline
+    :param str name: name of the experiment
+    :param str|None data_set: recognitions are searched under recog_{name}_{data_set} if set
+    :param FileSummaryCache|None cache:
+    :rtype: OrderedDict
+    """
+    cache = cache or FileSummaryCache()
+    job_path = os.path.join("alias", prefix, name, suffix)
+    if not os.path.exists(os.path.realpath(job_path)):
+        raise FileNotFoundError(f"job doesn't exist: {job_path}")
+
+    log_data = {"num_params": 0, "train_steps": [], "train_times_h": [], "max_epoch": 0}
+    lr_data = {"best_epoch": None, "errors": {}}
+    if os.path.exists(os.path.join(job_path, "work/learning_rates")):
+        lr_data = cache.get(os.path.join(job_path, "work/learning_rates"), parse_learning_rates)
+        log_data = cache.get(os.path.join(job_path, "work/returnn.log"), parse_returnn_log)
+
+    recog_name = name if data_set is None else f"{name}_{data_set}"
+    wers, _, optimized_scales = harvest_recognitions(
+        os.path.join("output", prefix, f"recog_{recog_name}"),
+        os.path.join("output", prefix, f"optimize_recog_{recog_name}"),
+        cache)
+
+    train_steps = log_data["train_steps"] or [0]
+    train_times_h = log_data["train_times_h"] or [0]
+    max_epoch = log_data["max_epoch"]
+    epoch_total = 200 if max_epoch <= 200 else 500 if max_epoch <= 500 else 600 if max_epoch <= 600 else 1000
+
+    return OrderedDict(
+        num_params=round(log_data["num_params"] / 1000000, 4),
+        avg_s_per_sep=float(int(sum(train_steps) / len(train_steps))),
+        time_p_sep=round(sum(train_times_h) / len(train_times_h), 3),
+        wer_by_ep=wers,
+        optim_wer_by_ep=optimized_scales,
+        best_ep_by_score=lr_data["best_epoch"] if lr_data["best_epoch"] is not None else "not found",
+        errors_per_ep=lr_data["errors"],
+        finished_eps=float(max_epoch) if epoch_total != max_epoch else None,
+    )
+
+
+def harvest_all(jobs, cache=None, max_workers=16):
+    """
+    Runs :func:`harvest_experiment` for all jobs in a thread pool, the work is mostly file system access.
+
+    :param list[dict] jobs: kwargs for :func:`harvest_experiment`
+    :param FileSummaryCache|None cache:
+    :param int max_workers:
+    :return: summary or the raised exception per job, in the order of jobs
+    :rtype: list[OrderedDict|Exception]
+    """
+    cache = cache or FileSummaryCache()
+
+    def run(kwargs):
+        try:
+            return harvest_experiment(cache=cache, **kwargs)
+        except Exception as e:
+            return e  # Just return the exception, handle it later
+
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        results = list(pool.map(run, jobs))
+    log.info(f"Harvested {len(jobs)} jobs, parsed {cache.misses} files, {cache.hits} files unchanged")
+    return results
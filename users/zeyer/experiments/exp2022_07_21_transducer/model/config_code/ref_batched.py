@@ -0,0 +1,316 @@
+"""
+Batched NumPy reference implementation of the RNA and RNN-T loss,
+including the gradient w.r.t. the log-probs and the Viterbi alignment.
+
+All sequences of a batch are processed at once.
+The lattice is traversed along its wavefront, i.e. all cells which only depend on the previous step:
+ - RNA: one frame per step, vectorized over all label positions (T steps),
+ - RNN-T: one anti-diagonal t+u per step (T+U steps).
+Padded frames and labels are masked via the sequence lengths.
+
+There is no TF dependency, so this can be used on CPU to validate the TF kernels
+(rna_tf_impl.py, rnnt_tf_impl.py) or to dump alignments.
+The label repetition variant of RNA (label_rep in rna_tf_impl.py) is not covered.
+
+Shapes:
+ - log_probs: (B, T, U+1, V), normalized over V
+ - labels: (B, U), padded with any valid (non-blank) label index
+ - input_lens, label_lens: (B,)
+"""
+
+import numpy as np
+
+NEG_INF = -float("inf")
+
+
+def log_softmax(acts, axis):
+    """
+    Log softmax over the given axis.
+    """
+    acts = acts - np.max(acts, axis=axis, keepdims=True)
+    probs = np.sum(np.exp(acts), axis=axis, keepdims=True)
+    log_probs = acts - np.log(probs)
+    return log_probs
+
+
+def _prepare(log_probs, labels, input_lens, label_lens, blank_index):
+    """
+    :return: lp_blank (B, T, U+1), lp_emit (B, T, U+1) where lp_emit[:, :, u] is the log-prob of labels[u]
+        (-inf for u=U), input_lens, label_lens, labels
+    """
+    labels = np.asarray(labels, dtype=np.int64)
+    input_lens = np.asarray(input_lens, dtype=np.int64)
+    label_lens = np.asarray(label_lens, dtype=np.int64)
+    n_batch, max_time, n_target, n_vocab = log_probs.shape
+    assert labels.shape == (n_batch, n_target - 1)
+    assert input_lens.shape == label_lens.shape == (n_batch,)
+    assert np.all(input_lens <= max_time) and np.all(label_lens < n_target)
+
+    lp_blank = log_probs[..., blank_index].astype(np.float64)
+    lp_emit = np.take_along_axis(log_probs[:, :, :-1], labels[:, None, :, None], axis=-1)[..., 0]
+    lp_emit = np.concatenate([lp_emit.astype(np.float64), np.full((n_batch, max_time, 1), NEG_INF)], axis=2)
+    return lp_blank, lp_emit, input_lens, label_lens, labels
+
+
+def _scatter_grads(shape, labels, blank_index, g_blank, g_emit):
+    """
+    :param shape: (B, T, U+1, V)
+    :param g_blank: (B, T, U+1)
+    :param g_emit: (B, T, U)
+    :return: gradient of shape (B, T, U+1, V)
+    """
+    grads = np.zeros(shape)
+    grads[..., blank_index] = g_blank
+    idx = np.broadcast_to(labels[:, None, :, None], g_emit.shape + (1,))
+    np.put_along_axis(grads[:, :, :-1], idx, g_emit[..., None], axis=-1)
+    return grads
+
+
+def _safe_log_like(log_like):
+    """Infeasible sequences (e.g. T < U for RNA) get zero gradients instead of NaN."""
+    return np.where(np.isfinite(log_like), log_like, 0.0)[:, None, None]
+
+
+# --- RNA ---
+
+
+def _rna_alphas(lp_blank, lp_emit, viterbi=False):
+    """
+    alpha[:, t, u]: log-prob (or best score) of having emitted u labels after t frames.
+
+    :return: alpha (B, T+1, U+1), emitted (B, T+1, U+1), whether the best arc into (t, u) was a label
+    """
+    n_batch, max_time, n_target = lp_blank.shape
+    combine = np.maximum if viterbi else np.logaddexp
+    alpha = np.full((n_batch, max_time + 1, n_target), NEG_INF)
+    alpha[:, 0, 0] = 0.0
+    emitted = np.zeros((n_batch, max_time + 1, n_target), dtype=bool)
+    for t in range(1, max_time + 1):
+        prev = alpha[:, t - 1]
+        blank = prev + lp_blank[:, t - 1]
+        emit = np.full_like(blank, NEG_INF)
+        emit[:, 1:] = prev[:, :-1] + lp_emit[:, t - 1, :-1]
+        alpha[:, t] = combine(blank, emit)
+        emitted[:, t] = emit > blank
+    return alpha, emitted
+
+
+def _rna_betas(lp_blank, lp_emit, input_lens, label_lens):
+    """
+    beta[:, t, u]: log-prob of emitting the remaining labels in the remaining frames, starting from (t, u).
+
+    :return: beta (B, T+1, U+1)
+    """
+    n_batch, max_time, n_target = lp_blank.shape
+    beta = np.full((n_batch, max_time + 1, n_target), NEG_INF)
+    final = np.where(np.arange(n_target)[None, :] == label_lens[:, None], 0.0, NEG_INF)  # (B, U+1)
+    for t in range(max_time, -1, -1):
+        if t < max_time:
+            nxt = beta[:, t + 1]
+            blank = lp_blank[:, t] + nxt
+            emit = np.full_like(blank, NEG_INF)
+            emit[:, :-1] = lp_emit[:, t, :-1] + nxt[:, 1:]
+            col = np.logaddexp(blank, emit)
+        else:
+            col = np.full((n_batch, n_target), NEG_INF)
+        col = np.where((input_lens == t)[:, None], final, col)
+        col = np.where((input_lens < t)[:, None], NEG_INF, col)
+        beta[:, t] = col
+    return beta
+
+
+def rna_loss(log_probs, labels, input_lens, label_lens, blank_index=0, with_grads=True):
+    """
+    :param np.ndarray log_probs: (B, T, U+1, V)
+    :param np.ndarray labels: (B, U)
+    :param np.ndarray input_lens: (B,)
+    :param np.ndarray label_lens: (B,)
+    :param int blank_index:
+    :param bool with_grads:
+    :return: negative log-likelihood (B,), gradient of it w.r.t. log_probs (B, T, U+1, V) or None
+    """
+    lp_blank, lp_emit, input_lens, label_lens, labels = _prepare(
+        log_probs, labels, input_lens, label_lens, blank_index)
+    n_batch = len(input_lens)
+    alpha, _ = _rna_alphas(lp_blank, lp_emit)
+    log_like = alpha[np.arange(n_batch), input_lens, label_lens]
+    if not with_grads:
+        return -log_like, None
+
+    beta = _rna_betas(lp_blank, lp_emit, input_lens, label_lens)
+    ll = _safe_log_like(log_like)
+    g_blank = -np.exp(alpha[:, :-1] + lp_blank + beta[:, 1:] - ll)
+    g_emit = -np.exp(alpha[:, :-1, :-1] + lp_emit[:, :, :-1] + beta[:, 1:, 1:] - ll)
+    grads = _scatter_grads(log_probs.shape, labels, blank_index, g_blank, g_emit)
+    return -log_like, grads
+
+
+def rna_viterbi(log_probs, labels, input_lens, label_lens, blank_index=0):
+    """
+    :return: best path score (B,), alignment (B, T) with one label or blank per frame,
+        padded frames are set to blank_index
+    """
+    lp_blank, lp_emit, input_lens, label_lens, labels = _prepare(
+        log_probs, labels, input_lens, label_lens, blank_index)
+    n_batch, max_time = lp_blank.shape[:2]
+    b = np.arange(n_batch)
+    alpha, emitted = _rna_alphas(lp_blank, lp_emit, viterbi=True)
+    scores = alpha[b, input_lens, label_lens]
+
+    alignment = np.full((n_batch, max_time), blank_index, dtype=np.int32)
+    u = label_lens.copy()
+    for t in range(max_time, 0, -1):
+        emit = emitted[b, t, u] & (t <= input_lens)
+        alignment[:, t - 1] = np.where(emit, labels[b, np.maximum(u - 1, 0)], blank_index)
+        u = u - emit
+    return scores, alignment
+
+
+# --- RNN-T ---
+
+
+def _diagonal(n, max_time, n_target):
+    """Lattice cells (t, u) with t + u == n."""
+    ts = np.arange(max(0, n - n_target + 1), min(max_time - 1, n) + 1)
+    return ts, n - ts
+
+
+def _rnnt_alphas(lp_blank, lp_emit, viterbi=False):
+    """
+    alpha[:, t, u]: log-prob (or best score) of reaching frame t after emitting u labels.
+
+    :return: alpha (B, T, U+1), emitted (B, T, U+1), whether the best arc into (t, u) was a label
+    """
+    n_batch, max_time, n_target = lp_blank.shape
+    combine = np.maximum if viterbi else np.logaddexp
+    alpha = np.full((n_batch, max_time, n_target), NEG_INF)
+    alpha[:, 0, 0] = 0.0
+    emitted = np.zeros((n_batch, max_time, n_target), dtype=bool)
+    for n in range(1, max_time + n_target - 1):
+        ts, us = _diagonal(n, max_time, n_target)
+        # out-of-range neighbours wrap around, they are masked out by the where
+        blank = np.where(ts > 0, alpha[:, ts - 1, us] + lp_blank[:, ts - 1, us], NEG_INF)
+        emit = np.where(us > 0, alpha[:, ts, us - 1] + lp_emit[:, ts, us - 1], NEG_INF)
+        alpha[:, ts, us] = combine(blank, emit)
+        emitted[:, ts, us] = emit > blank
+    return alpha, emitted
+
+
+def _rnnt_betas(lp_blank, lp_emit, input_lens, label_lens):
+    """
+    beta[:, t, u]: log-prob of the remaining path from (t, u), including the final blank.
+
+    :return: beta (B, T, U+1)
+    """
+    n_batch, max_time, n_target = lp_blank.shape
+    beta = np.full((n_batch, max_time, n_target), NEG_INF)
+    for n in range(max_time + n_target - 2, -1, -1):
+        ts, us = _diagonal(n, max_time, n_target)
+        blank = np.where(
+            ts < max_time - 1, lp_blank[:, ts, us] + beta[:, np.minimum(ts + 1, max_time - 1), us], NEG_INF)
+        emit = np.where(
+            us < n_target - 1, lp_emit[:, ts, us] + beta[:, ts, np.minimum(us + 1, n_target - 1)], NEG_INF)
+        diag = np.logaddexp(blank, emit)
+        valid = (ts[None, :] < input_lens[:, None]) & (us[None, :] <= label_lens[:, None])
+        is_end = (ts[None, :] == input_lens[:, None] - 1) & (us[None, :] == label_lens[:, None])
+        beta[:, ts, us] = np.where(is_end, lp_blank[:, ts, us], np.where(valid, diag, NEG_INF))
+    return beta
+
+
+def rnnt_loss(log_probs, labels, input_lens, label_lens, blank_index=0, with_grads=True):
+    """
+    :param np.ndarray log_probs: (B, T, U+1, V)
+    :param np.ndarray labels: (B, U)
+    :param np.ndarray input_lens: (B,)
+    :param np.ndarray label_lens: (B,)
+    :param int blank_index:
+    :param bool with_grads:
+    :return: negative log-likelihood (B,), gradient of it w.r.t. log_probs (B, T, U+1, V) or None
+    """
+    lp_blank, lp_emit, input_lens, label_lens, labels = _prepare(
+        log_probs, labels, input_lens, label_lens, blank_index)
+    b = np.arange(len(input_lens))
+    alpha, _ = _rnnt_alphas(lp_blank, lp_emit)
+    log_like = alpha[b, input_lens - 1, label_lens] + lp_blank[b, input_lens - 1, label_lens]
+    if not with_grads:
+        return -log_like, None
+
+    beta = _rnnt_betas(lp_blank, lp_emit, input_lens, label_lens)
+    ll = _safe_log_like(log_like)
+    beta_after_blank = np.full_like(beta, NEG_INF)
+    beta_after_blank[:, :-1] = beta[:, 1:]
+    beta_after_blank[b, input_lens - 1, label_lens] = 0.0
+    g_blank = -np.exp(alpha + lp_blank + beta_after_blank - ll)
+    g_emit = -np.exp(alpha[:, :, :-1] + lp_emit[:, :, :-1] + beta[:, :, 1:] - ll)
+    grads = _scatter_grads(log_probs.shape, labels, blank_index, g_blank, g_emit)
+    return -log_like, grads
+
+
+def rnnt_viterbi(log_probs, labels, input_lens, label_lens, blank_index=0):
+    """
+    :return: best path score (B,), alignment (B, T+U) with T blanks and U labels per sequence,
+        padded positions are set to blank_index
+    """
+    lp_blank, lp_emit, input_lens, label_lens, labels = _prepare(
+        log_probs, labels, input_lens, label_lens, blank_index)
+    b = np.arange(len(input_lens))
+    alpha, emitted = _rnnt_alphas(lp_blank, lp_emit, viterbi=True)
+    scores = alpha[b, input_lens - 1, label_lens] + lp_blank[b, input_lens - 1, label_lens]
+
+    path_lens = input_lens + label_lens
+    alignment = np.full((len(b), int(path_lens.max())), blank_index, dtype=np.int32)
+    # the last symbol is always the final blank, start backtracking from its source state
+    t = input_lens - 1
+    u = label_lens.copy()
+    for n in range(alignment.shape[1] - 2, -1, -1):
+        active = n < path_lens - 1
+        emit = emitted[b, t, u] & active
+        alignment[:, n] = np.where(emit, labels[b, np.maximum(u - 1, 0)], blank_index)
+        u = u - emit
+        t = t - (active & ~emit)
+    return scores, alignment
+
+
+def test():
+    from . import ref_rna, ref_transduce
+
+    np.random.seed(0)
+    n_batch, max_time, max_labels, n_vocab = 6, 12, 5, 7
+    blank = 0
+    log_probs = log_softmax(np.random.standard_normal((n_batch, max_time, max_labels + 1, n_vocab)), axis=-1)
+    labels = np.random.randint(1, n_vocab, (n_batch, max_labels))
+    label_lens = np.random.randint(1, max_labels + 1, (n_batch,))
+    input_lens = np.random.randint(max_labels, max_time + 1, (n_batch,))
+
+    rna_nll, rna_grads = rna_loss(log_probs, labels, input_lens, label_lens, blank)
+    rna_scores, rna_align = rna_viterbi(log_probs, labels, input_lens, label_lens, blank)
+    rnnt_nll, rnnt_grads = rnnt_loss(log_probs, labels, input_lens, label_lens, blank)
+    rnnt_scores, rnnt_align = rnnt_viterbi(log_probs, labels, input_lens, label_lens, blank)
+
+    for i in range(n_batch):
+        n_time, n_labels = input_lens[i], label_lens[i]
+        lp = log_probs[i, :n_time, :n_labels + 1]
+        seq = labels[i, :n_labels]
+
+        alphas, ll = ref_rna.forward_pass(lp, seq, blank)
+        betas, _ = ref_rna.backward_pass(lp, seq, blank)
+        grads = ref_rna.analytical_gradient(lp, alphas, betas, seq, blank)
+        assert np.allclose(-rna_nll[i], ll), "RNA loss mismatch"
+        assert np.allclose(rna_grads[i, :n_time, :n_labels + 1], grads), "RNA gradient mismatch"
+        assert not np.any(rna_grads[i, n_time:]) and not np.any(rna_grads[i, :, n_labels + 1:])
+        non_blank = rna_align[i, :n_time][rna_align[i, :n_time] != blank]
+        assert np.array_equal(non_blank, seq), "RNA alignment does not match labels"
+        assert rna_scores[i] <= -rna_nll[i] + 1e-9
+
+        nll, grads = ref_transduce.transduce(lp, seq, blank)
+        assert np.allclose(rnnt_nll[i], nll), "RNN-T loss mismatch"
+        assert np.allclose(rnnt_grads[i, :n_time, :n_labels + 1], grads), "RNN-T gradient mismatch"
+        path = rnnt_align[i, :n_time + n_labels]
+        assert np.count_nonzero(path == blank) == n_time, "RNN-T alignment has wrong number of blanks"
+        assert np.array_equal(path[path != blank], seq), "RNN-T alignment does not match labels"
+        assert rnnt_scores[i] <= -rnnt_nll[i] + 1e-9
+    print("batched RNA and RNN-T match the reference implementations")
+
+
+if __name__ == "__main__":
+    test()
@@ -106,7 +106,7 @@ def numpy_forward_naive(log_probs, labels, blank_index, label_rep=False, with_al
                      2: (u, labels[u-1]),    # (t-1, u),    # same
                      }
       argmax_tuple = argmax_dict[max_prob_idx]
-      if debug or True:
+      if debug:
         print("[np naive] BT[%2d,%2d] = (%s) %d state=%d, label=%d" % (
           t - 1, u, {0: "skip", 1: "emit", 2: "same"}[max_prob_idx],
           max_prob_idx, argmax_tuple[0], argmax_tuple[1]))
@@ -865,7 +865,7 @@ def test_impl(name, acts, labels, blank_index, input_lens=None, label_lens=None,
                               debug=debug)
     if with_alignment:
       alpha_np_naive, cost_np_naive, alignment_naive = res
-      if debug or True:
+      if debug:
         print("[np naive] alignments:", alignment_naive)
       list_alignments += [alignment_naive]
     else:
@@ -0,0 +1,184 @@
+"""
+Parsing of the RETURNN learning-rate-control file (``learning_rates``, ReturnnTrainingJob.out_learning_rates)
+without ``eval``.
+
+The file looks like::
+
+    {
+    1: EpochData(learningRate=0.001, error={
+    'dev_score_output': 1.23,
+    ...
+    }),
+    2: ...
+    }
+
+RETURNN rewrites the file after every epoch, where usually only new epochs are appended.
+:func:`get_learning_rate_scores` caches the parsed epochs per file, keyed by size and mtime,
+and only parses the epochs after the unchanged prefix of the file.
+"""
+
+from __future__ import annotations
+
+import ast
+import hashlib
+import heapq
+import os
+import re
+import threading
+from typing import Any, Dict, List, Optional, Tuple
+
+
+_CONSTANTS = {"nan": float("nan"), "inf": float("inf"), "None": None, "True": True, "False": False}
+_EPOCH_START = re.compile(r"^(\d+):\s*EpochData\(", re.MULTILINE)
+
+
+def _eval_node(node: ast.AST) -> Any:
+    """
+    Evaluates the literals of a learning_rates file, ``EpochData(...)`` calls become dicts.
+    """
+    if isinstance(node, ast.Dict):
+        return {_eval_node(k): _eval_node(v) for k, v in zip(node.keys, node.values)}
+    if isinstance(node, ast.Call) and getattr(node.func, "id", None) == "EpochData":
+        values = [_eval_node(arg) for arg in node.args]
+        values += [None] * (2 - len(values))
+        epoch_data = {"learning_rate": values[0], "error": values[1]}
+        for keyword in node.keywords:
+            name = {"learningRate": "learning_rate"}.get(keyword.arg, keyword.arg)
+            epoch_data[name] = _eval_node(keyword.value)
+        return epoch_data
+    if isinstance(node, ast.Name) and node.id in _CONSTANTS:
+        return _CONSTANTS[node.id]
+    if isinstance(node, ast.UnaryOp) and isinstance(node.op, (ast.USub, ast.UAdd)):
+        value = _eval_node(node.operand)
+        return -value if isinstance(node.op, ast.USub) else value
+    if isinstance(node, (ast.List, ast.Tuple)):
+        return [_eval_node(e) for e in node.elts]
+    return ast.literal_eval(node)
+
+
+class EpochScores:
+    """
+    Learning rate and scores (``error`` dict) of one epoch.
+    """
+
+    def __init__(self, epoch: int, learning_rate: Optional[float], error: Optional[Dict[str, float]]):
+        self.epoch = epoch
+        self.learning_rate = learning_rate
+        self.error = error or {}
+
+    def __repr__(self):
+        return f"EpochScores(epoch={self.epoch}, learning_rate={self.learning_rate}, error={self.error})"
+
+
+class LearningRateScores:
+    """
+    Parsed learning_rates file, with best-N queries per score key.
+    Instances are not modified after creation, the sorted scores per key are computed on first use.
+    """
+
+    def __init__(self, epochs: Dict[int, EpochScores]):
+        self.epochs = dict(sorted(epochs.items()))
+        self._sorted_scores = {}  # type: Dict[str, List[Tuple[float, int]]]
+        self._lock = threading.Lock()
+
+    @property
+    def score_keys(self) -> List[str]:
+        keys = {}
+        for data in self.epochs.values():
+            keys.update(dict.fromkeys(data.error))
+        return list(keys)
+
+    def get_scores(self, score_key: str) -> List[Tuple[float, int]]:
+        """
+        :return: (score, epoch) of all epochs which have this score, sorted ascending (best first)
+        """
+        with self._lock:
+            if score_key not in self._sorted_scores:
+                self._sorted_scores[score_key] = sorted(
+                    (float(data.error[score_key]), epoch)
+                    for epoch, data in self.epochs.items()
+                    if score_key in data.error
+                )
+            return self._sorted_scores[score_key]
+
+    def get_best_epochs(self, score_key: str, n: int = 1) -> List[Tuple[float, int]]:
+        """
+        :return: the n best (lowest) (score, epoch) for this score key
+        """
+        if score_key in self._sorted_scores:
+            return self._sorted_scores[score_key][:n]
+        return heapq.nsmallest(
+            n, ((float(data.error[score_key]), epoch) for epoch, data in self.epochs.items() if score_key in data.error)
+        )
+
+
+def parse_epochs(text: str, start: int = 0) -> Tuple[Dict[int, EpochScores], int]:
+    """
+    :param text: content of a learning_rates file
+    :param start: offset of an epoch entry (or of the file start) from which on to parse
+    :return: the parsed epochs, and the offset of the last epoch entry,
+        i.e. everything before it can be reused when the file was rewritten with more epochs
+    """
+    matches = list(_EPOCH_START.finditer(text, start))
+    if not matches:
+        # e.g. "{\n}\n" before the first epoch is finished
+        ast.literal_eval(text[start:] if start else text)
+        return {}, start
+    end = text.rindex("}")  # end of the outer dict
+    epochs = {}
+    for i, match in enumerate(matches):
+        entry_end = matches[i + 1].start() if i + 1 < len(matches) else end
+        entry = text[match.end() - len("EpochData(") : entry_end].rstrip().rstrip(",")
+        data = _eval_node(ast.parse(entry, mode="eval").body)
+        epoch = int(match.group(1))
+        epochs[epoch] = EpochScores(epoch, learning_rate=data["learning_rate"], error=data["error"])
+    return epochs, matches[-1].start()
+
+
+class _CacheEntry:
+    def __init__(self, size: int, mtime_ns: int, stable_offset: int, prefix_digest: bytes, scores: LearningRateScores):
+        self.size = size
+        self.mtime_ns = mtime_ns
+        self.stable_offset = stable_offset
+        self.prefix_digest = prefix_digest
+        self.scores = scores
+
+
+_cache = {}  # type: Dict[str, _CacheEntry]
+_cache_lock = threading.Lock()
+
+
+def get_learning_rate_scores(filename: str) -> LearningRateScores:
+    """
+    Parses the learning_rates file, or returns the cached result if size and mtime did not change.
+    When the file changed but starts with the same text as before,
+    all epochs except the last cached one are reused and only the rest of the file is parsed.
+    """
+    filename = os.path.abspath(filename)
+    st = os.stat(filename)
+    with _cache_lock:
+        cached = _cache.get(filename)
+    if cached is not None and (cached.size, cached.mtime_ns) == (st.st_size, st.st_mtime_ns):
+        return cached.scores
+
+    with open(filename, "r") as f:
+        text = f.read()
+    epochs = {}
+    start = 0
+    if cached is not None and cached.stable_offset > 0 and len(text) > cached.stable_offset:
+        if hashlib.sha1(text[: cached.stable_offset].encode("utf8")).digest() == cached.prefix_digest:
+            start = cached.stable_offset
+            epochs = {epoch: data for epoch, data in cached.scores.epochs.items() if epoch < _first_epoch(text, start)}
+    new_epochs, stable_offset = parse_epochs(text, start)
+    epochs.update(new_epochs)
+    scores = LearningRateScores(epochs)
+    prefix_digest = hashlib.sha1(text[:stable_offset].encode("utf8")).digest()
+    with _cache_lock:
+        _cache[filename] = _CacheEntry(st.st_size, st.st_mtime_ns, stable_offset, prefix_digest, scores)
+    return scores
+
+
+def _first_epoch(text: str, start: int) -> int:
+    match = _EPOCH_START.match(text, start)
+    assert match, f"no epoch entry at offset {start}"
+    return int(match.group(1))
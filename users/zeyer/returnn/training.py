@@ -15,6 +15,7 @@ from i6_core.returnn.training import Checkpoint
 from i6_core.returnn.config import ReturnnConfig
 import i6_core.util as util
 import returnn.config
+from i6_experiments.users.zeyer.returnn.learning_rate_scores import get_learning_rate_scores
 
 
 class ReturnnInitModelJob(Job):
@@ -174,38 +175,14 @@ def get_relevant_epochs_from_training_learning_rate_scores(
     if log_stream is None:
         log_stream = open(os.devnull, "w")
     print(f"Check relevant epochs in {model_dir.get_path()}", file=log_stream)
-    score_keys = set()
 
-    # simple wrapper, to eval newbob.data
-    # noinspection PyPep8Naming
-    def EpochData(learningRate, error):
-        """
-        :param float learningRate:
-        :param dict[str,float] error: keys are e.g. "dev_score_output" etc
-        :rtype: dict[str,float]
-        """
-        assert isinstance(error, dict)
-        score_keys.update(error.keys())
-        d = {"learning_rate": learningRate}
-        d.update(error)
-        return d
-
-    # nan/inf, for some broken newbob.data
-    nan = float("nan")
-    inf = float("inf")
-
-    scores_str = open(scores_and_learning_rates.get_path()).read()
-    scores = eval(scores_str, {"EpochData": EpochData, "nan": nan, "inf": inf})
-    assert isinstance(scores, dict)
-    all_epochs = sorted(scores.keys())
+    scores = get_learning_rate_scores(scores_and_learning_rates.get_path())
 
     suggested_epochs = set()
-    for score_key in score_keys:
+    for score_key in scores.score_keys:
         if not score_key.startswith("dev_"):
             continue
-        dev_scores = sorted([
-            (float(scores[ep][score_key]), int(ep))
-            for ep in all_epochs if score_key in scores[ep]])
+        dev_scores = scores.get_scores(score_key)
         assert dev_scores
         if dev_scores[0][0] == dev_scores[-1][0]:
             # All values are the same (e.g. 0.0), so no information. Just ignore this score_key.
@@ -213,7 +190,7 @@ def get_relevant_epochs_from_training_learning_rate_scores(
         if dev_scores[0] == (0.0, 1):
             # Heuristic. Ignore the key if it looks invalid.
             continue
-        for value, ep in sorted(dev_scores)[:n_best]:
+        for value, ep in dev_scores[:n_best]:
             suggested_epochs.add(ep)
             print("Suggest: epoch %i because %s %f" % (ep, score_key, value), file=log_stream)
 